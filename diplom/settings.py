@@ -49,6 +49,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'debug_toolbar',
     'retail',
     'rest_framework',
@@ -68,8 +69,6 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'django.middleware.cache.UpdateCacheMiddleware',
-    'django.middleware.cache.FetchFromCacheMiddleware',
     'debug_toolbar.middleware.DebugToolbarMiddleware',
     'allauth.account.middleware.AccountMiddleware',
 ]
@@ -221,3 +220,34 @@ CELERY_TASK_SERIALIZER = os.getenv('CELERY_TASK_SERIALIZER', default='json')
 CELERY_TIMEZONE = os.getenv('CELERY_TIMEZONE', default='Europe/Moscow')
 CELERY_BROKER_CONNECTION_RETRY_ON_STARTUP = True
 
+
+IMPORT_BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', default=1000))
+IMPORT_DOWNLOAD_CHUNK_SIZE = int(os.getenv('IMPORT_DOWNLOAD_CHUNK_SIZE', default=64 * 1024))
+IMPORT_SYNC = strtobool(os.getenv('IMPORT_SYNC', default='True'))
+IMPORT_PARALLEL = strtobool(os.getenv('IMPORT_PARALLEL', default='False'))
+IMPORT_PARALLEL_CHUNK_SIZE = int(os.getenv('IMPORT_PARALLEL_CHUNK_SIZE', default=5000))
+IMPORT_STAGING_REDIS_URL = os.getenv('IMPORT_STAGING_REDIS_URL', default='redis://localhost:6379/2')
+IMPORT_STAGING_TIMEOUT = int(os.getenv('IMPORT_STAGING_TIMEOUT', default=24 * 3600))
+IMPORT_HTTP_CONNECT_TIMEOUT = float(os.getenv('IMPORT_HTTP_CONNECT_TIMEOUT', default=5))
+IMPORT_HTTP_READ_TIMEOUT = float(os.getenv('IMPORT_HTTP_READ_TIMEOUT', default=30))
+IMPORT_HTTP_RETRIES = int(os.getenv('IMPORT_HTTP_RETRIES', default=3))
+IMPORT_HTTP_BACKOFF_FACTOR = float(os.getenv('IMPORT_HTTP_BACKOFF_FACTOR', default=0.5))
+IMPORT_HTTP_POOL_SIZE = int(os.getenv('IMPORT_HTTP_POOL_SIZE', default=4))
+IMPORT_HTTP_MAX_SIZE = int(os.getenv('IMPORT_HTTP_MAX_SIZE', default=1024 * 1024 * 1024))
+
+REFERENCE_CACHE_SIZE = int(os.getenv('REFERENCE_CACHE_SIZE', default=10000))
+REFERENCE_CACHE_TIMEOUT = int(os.getenv('REFERENCE_CACHE_TIMEOUT', default=3600))
+REFERENCE_CACHE_CHECK_INTERVAL = float(os.getenv('REFERENCE_CACHE_CHECK_INTERVAL', default=5))
+
+CATALOG_SEARCH_CONFIG = os.getenv('CATALOG_SEARCH_CONFIG', default='russian')
+CATALOG_RESPONSE_CACHE_TIMEOUT = int(os.getenv('CATALOG_RESPONSE_CACHE_TIMEOUT', default=300))
+CATALOG_EXPORT_CHUNK_SIZE = int(os.getenv('CATALOG_EXPORT_CHUNK_SIZE', default=2000))
+
+BASKET_STORAGE = os.getenv('BASKET_STORAGE', default='database')
+BASKET_REDIS_URL = os.getenv('BASKET_REDIS_URL', default='redis://localhost:6379/1')
+BASKET_REDIS_TIMEOUT = int(os.getenv('BASKET_REDIS_TIMEOUT', default=30 * 24 * 3600))
+BASKET_SNAPSHOT_INTERVAL = float(os.getenv('BASKET_SNAPSHOT_INTERVAL', default=300))
+if BASKET_STORAGE == 'redis':
+    CELERY_BEAT_SCHEDULE = {
+        'snapshot-baskets': {'task': 'retail.tasks.snapshot_baskets', 'schedule': BASKET_SNAPSHOT_INTERVAL},
+    }
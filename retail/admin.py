@@ -4,7 +4,9 @@ from django.contrib.auth.admin import UserAdmin
 
 from retail.models import (User, Retailer, Product, Category, ProductParameter,
                            ProductInfo, Parameter, OrderItem, Order, Contact,
-                           ConfirmEmailToken)
+                           ConfirmEmailToken, PriceList, ImportJob)
+from retail.cache import bump_catalog_version
+from retail.catalog import refresh_catalog
 
 
 @admin.register(User)
@@ -68,6 +70,20 @@ class ProductInfoAdmin(admin.ModelAdmin):
     list_filter = ('model',)
     inlines = [ProductParameterInline]
 
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        refresh_catalog([form.instance.id])
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        bump_catalog_version([obj.retailer_id], [obj.product.category_id])
+
+    def delete_queryset(self, request, queryset):
+        rows = list(queryset.values_list('retailer_id', 'product__category_id'))
+        super().delete_queryset(request, queryset)
+        bump_catalog_version({retailer_id for retailer_id, category_id in rows},
+                             {category_id for retailer_id, category_id in rows})
+
 
 @admin.register(Parameter)
 class ParameterAdmin(admin.ModelAdmin):
@@ -76,7 +92,33 @@ class ParameterAdmin(admin.ModelAdmin):
 
 @admin.register(ProductParameter)
 class ProductParameterAdmin(admin.ModelAdmin):
-    pass
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        refresh_catalog([obj.product_info_id])
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        refresh_catalog([obj.product_info_id])
+
+    def delete_queryset(self, request, queryset):
+        product_info_ids = set(queryset.values_list('product_info_id', flat=True))
+        super().delete_queryset(request, queryset)
+        refresh_catalog(product_info_ids)
+
+
+@admin.register(PriceList)
+class PriceListAdmin(admin.ModelAdmin):
+    list_display = ('retailer', 'url', 'updated_at')
+    readonly_fields = ('etag', 'last_modified', 'sha256', 'updated_at')
+
+
+@admin.register(ImportJob)
+class ImportJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'state', 'rows', 'rows_per_sec', 'download_time',
+                    'parse_time', 'write_time', 'created_at')
+    list_filter = ('state',)
+    readonly_fields = ('task_id', 'rows', 'created', 'updated', 'deleted', 'download_time',
+                       'parse_time', 'write_time', 'message', 'started_at', 'finished_at')
 
 
 class OrderItemInline(admin.TabularInline):
@@ -87,8 +129,9 @@ class OrderItemInline(admin.TabularInline):
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
     model = Order
-    fields = ('user', 'state', 'contact', 'date')
-    list_display = ('id', 'user', 'date', 'state')
+    fields = ('user', 'state', 'contact', 'date', 'total_sum', 'items_count')
+    readonly_fields = ('total_sum', 'items_count')
+    list_display = ('id', 'user', 'date', 'state', 'total_sum', 'items_count')
 
 
 @admin.register(Contact)
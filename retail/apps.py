@@ -1,7 +1,13 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class RetailConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'retail'
     verbose_name = 'API retail'
+
+    def ready(self):
+        import retail.signals
+        from retail.catalog import create_trigram_index
+        post_migrate.connect(create_trigram_index, sender=self)
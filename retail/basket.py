@@ -0,0 +1,384 @@
+from functools import lru_cache
+
+import redis
+from django.conf import settings
+from django.db import connection, transaction
+
+from retail.models import Order, OrderItem, ProductInfo
+from retail.orders import update_order_totals
+from retail.rows import order_rows, product_info_rows, ORDER_VALUES
+
+BASKET_DIRTY_KEY = 'retail:basket:dirty'
+
+
+def is_id(value):
+    """
+    Целое положительное число (идентификатор или количество), bool не допускается
+    """
+    return isinstance(value, int) and not isinstance(value, bool) and value > 0
+
+
+def item_error(key, value, error):
+    return {key: value, 'Status': False, 'Errors': error}
+
+
+def parse_items(items):
+    """
+    Проверка формата позиций корзины [{product_info, quantity}, ...] без запросов
+    к базе данных: словарь product_info -> quantity корректных позиций
+    и отчет по позициям с ошибками (индекс позиции в списке -> ошибка)
+    """
+    valid, report = {}, {}
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            report[index] = item_error('product_info', None, 'Invalid item format')
+            continue
+        id_product_info = item.get('product_info', None)
+        quantity = item.get('quantity', None)
+        if id_product_info is None:
+            report[index] = item_error('product_info', None,
+                                       'The required request parameter <product_info> is missing')
+        elif not is_id(id_product_info):
+            report[index] = item_error('product_info', id_product_info,
+                                       'Invalid type of request parameter <product_info>')
+        elif quantity is None:
+            report[index] = item_error('product_info', id_product_info,
+                                       'The required request parameter <quantity> is missing')
+        elif not is_id(quantity):
+            report[index] = item_error('product_info', id_product_info,
+                                       'Invalid type of request parameter <quantity>')
+        elif id_product_info in valid:
+            report[index] = item_error('product_info', id_product_info,
+                                       'Duplicate <product_info> in request')
+        else:
+            valid[id_product_info] = quantity
+    return valid, report
+
+
+def items_report(items, valid, report, errors):
+    """
+    Отчет по позициям запроса в исходном порядке
+    """
+    result = []
+    for index, item in enumerate(items):
+        if index in report:
+            result.append(report[index])
+            continue
+        id_product_info = item['product_info']
+        if id_product_info in errors:
+            result.append(item_error('product_info', id_product_info, errors[id_product_info]))
+        else:
+            result.append({'product_info': id_product_info, 'quantity': valid[id_product_info], 'Status': True})
+    return result
+
+
+def add_errors(valid, in_basket):
+    """
+    Ошибки добавляемых позиций: товар не найден (один запрос id__in к ProductInfo)
+    или уже есть в корзине, in_basket - функция: множество id товаров -> id товаров в корзине
+    """
+    errors = {}
+    if valid:
+        existing = set(ProductInfo.objects.filter(id__in=valid).values_list('id', flat=True))
+        added = in_basket(existing)
+        for id_product_info in valid:
+            if id_product_info not in existing:
+                errors[id_product_info] = 'Invalid value for <product_info> request parameter'
+            elif id_product_info in added:
+                errors[id_product_info] = 'The product is already in the basket'
+    return errors
+
+
+def add_items(order_id, items):
+    """
+    Добавление позиций в корзину: проверка всех товаров одним запросом
+    id__in, уже добавленных в корзину позиций - вторым запросом, запись
+    одним bulk_create в транзакции вместе с пересчетом суммы корзины.
+    Число запросов не зависит от числа позиций
+    """
+    valid, report = parse_items(items)
+    errors = add_errors(valid, lambda ids: set(OrderItem.objects.filter(
+        order_id=order_id, product_info_id__in=ids).values_list('product_info_id', flat=True)))
+    created = [OrderItem(order_id=order_id, product_info_id=id_product_info, quantity=quantity)
+               for id_product_info, quantity in valid.items() if id_product_info not in errors]
+    if created:
+        with transaction.atomic():
+            OrderItem.objects.bulk_create(created)
+            update_order_totals([order_id])
+    return len(created), items_report(items, valid, report, errors)
+
+
+def update_items(order_id, items):
+    """
+    Изменение количества товаров в корзине: позиции корзины выбираются
+    одним запросом, изменяются одним bulk_update в транзакции
+    """
+    valid, report = parse_items(items)
+    errors = {}
+    updated = []
+    if valid:
+        order_items = {order_item.product_info_id: order_item for order_item in OrderItem.objects.filter(
+            order_id=order_id, product_info_id__in=valid).only('id', 'product_info_id', 'quantity')}
+        for id_product_info, quantity in valid.items():
+            order_item = order_items.get(id_product_info, None)
+            if order_item is None:
+                errors[id_product_info] = 'The product is missing in the basket'
+            elif order_item.quantity != quantity:
+                order_item.quantity = quantity
+                updated.append(order_item)
+    if updated:
+        with transaction.atomic():
+            OrderItem.objects.bulk_update(updated, ['quantity'])
+            update_order_totals([order_id])
+    return len(valid) - len(errors), items_report(items, valid, report, errors)
+
+
+def delete_items(order_id, ids):
+    """
+    Удаление позиций корзины по списку id: проверка одним запросом,
+    удаление одним запросом в транзакции
+    """
+    requested = {order_item_id for order_item_id in ids if is_id(order_item_id)}
+    existing = set(OrderItem.objects.filter(order_id=order_id, id__in=requested).values_list(
+        'id', flat=True)) if requested else set()
+    deleted = 0
+    if existing:
+        with transaction.atomic():
+            deleted = OrderItem.objects.filter(order_id=order_id, id__in=existing).delete()[0]
+            update_order_totals([order_id])
+    report = []
+    for order_item_id in ids:
+        if not is_id(order_item_id):
+            report.append(item_error('id', order_item_id, 'Invalid type of order item id'))
+        elif order_item_id not in existing:
+            report.append(item_error('id', order_item_id, 'The order item is missing in the basket'))
+        else:
+            report.append({'id': order_item_id, 'Status': True})
+    return deleted, report
+
+
+class DatabaseBasket:
+    """
+    Класс: корзина пользователя в строках Order/OrderItem со статусом basket
+    """
+    def __init__(self, user_id):
+        self.user_id = user_id
+
+    def order_id(self):
+        basket, created = Order.objects.get_or_create(user_id=self.user_id, state='basket')
+        return basket.id
+
+    def rows(self):
+        basket = Order.objects.filter(user_id=self.user_id, state='basket').values(*ORDER_VALUES)
+        return order_rows(basket)
+
+    def add(self, items):
+        return add_items(self.order_id(), items)
+
+    def update(self, items):
+        return update_items(self.order_id(), items)
+
+    def delete(self, ids):
+        return delete_items(self.order_id(), ids)
+
+    def materialize(self):
+        pass
+
+    def discard(self, order_id):
+        pass
+
+
+@lru_cache
+def basket_redis():
+    return redis.Redis.from_url(settings.BASKET_REDIS_URL)
+
+
+def next_order_item_ids(count):
+    """
+    Резервирование count id позиций заказа одним запросом
+    к последовательности первичного ключа OrderItem
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT nextval(pg_get_serial_sequence(%s, %s)) FROM generate_series(1, %s)',
+                       [OrderItem._meta.db_table, OrderItem._meta.pk.column, count])
+        return [row[0] for row in cursor.fetchall()]
+
+
+class RedisBasket:
+    """
+    Класс: корзина пользователя в хэше Redis retail:basket:<id пользователя>
+    (поле order - id строки Order корзины, поля <id товара> - строка
+    <id позиции>:<количество>). Изменения корзины не пишут в PostgreSQL:
+    пользователь отмечается в множестве BASKET_DIRTY_KEY, позиции переносятся
+    в OrderItem при оформлении заказа (materialize) или периодической задачей
+    persist_baskets. Id новых позиций резервируются в последовательности
+    OrderItem, поэтому идентификатор позиции в ответах и запросах на удаление
+    совпадает с id строки OrderItem, как и при хранении корзины в базе данных
+    """
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.key = f'retail:basket:{user_id}'
+        self.client = basket_redis()
+
+    @staticmethod
+    def parse(data):
+        """
+        Позиции хэша корзины: словарь id товара -> (id позиции, количество)
+        """
+        items = {}
+        for key, value in data.items():
+            item_id, quantity = value.split(b':')
+            items[int(key)] = (int(item_id), int(quantity))
+        return items
+
+    @staticmethod
+    def fields(items):
+        return {id_: f'{item_id}:{quantity}' for id_, (item_id, quantity) in items.items()}
+
+    def load(self, create=True):
+        """
+        Содержимое корзины: (id строки Order, словарь id товара -> (id позиции, количество)),
+        при отсутствии хэша - загрузка корзины из базы данных, без create
+        строка Order для новой корзины не создается (id None)
+        """
+        data = self.client.hgetall(self.key)
+        if b'order' not in data:
+            if create:
+                basket, created = Order.objects.get_or_create(user_id=self.user_id, state='basket')
+            else:
+                basket = Order.objects.filter(user_id=self.user_id, state='basket').only('id').first()
+                if basket is None:
+                    return None, {}
+            items = {product_info_id: (item_id, quantity) for item_id, product_info_id, quantity
+                     in OrderItem.objects.filter(order=basket).values_list('id', 'product_info_id', 'quantity')}
+            with self.client.pipeline() as pipe:
+                pipe.hset(self.key, mapping={'order': basket.id, **self.fields(items)})
+                pipe.expire(self.key, settings.BASKET_REDIS_TIMEOUT)
+                pipe.execute()
+            return basket.id, items
+        order_id = int(data.pop(b'order'))
+        return order_id, self.parse(data)
+
+    def save(self, changed=None, removed=()):
+        with self.client.pipeline() as pipe:
+            if changed:
+                pipe.hset(self.key, mapping=self.fields(changed))
+            if removed:
+                pipe.hdel(self.key, *removed)
+            pipe.expire(self.key, settings.BASKET_REDIS_TIMEOUT)
+            pipe.sadd(BASKET_DIRTY_KEY, self.user_id)
+            pipe.execute()
+
+    def rows(self):
+        order_id, items = self.load(create=False)
+        if order_id is None:
+            return []
+        products = product_info_rows(items)
+        ordered_items = [{'id': item_id, 'product_info': products[id_], 'quantity': quantity}
+                         for id_, (item_id, quantity) in sorted(items.items(), key=lambda item: item[1][0])
+                         if id_ in products]
+        total_sum = sum(item['quantity'] * item['product_info']['price'] for item in ordered_items)
+        return [{'id': order_id, 'ordered_items': ordered_items, 'state': 'basket', 'contact': None,
+                 'total_sum': total_sum, 'items_count': len(ordered_items)}]
+
+    def add(self, items):
+        order_id, current = self.load()
+        valid, report = parse_items(items)
+        errors = add_errors(valid, lambda ids: ids & set(current))
+        created = [(id_, quantity) for id_, quantity in valid.items() if id_ not in errors]
+        if created:
+            item_ids = next_order_item_ids(len(created))
+            self.save({id_: (item_id, quantity) for (id_, quantity), item_id in zip(created, item_ids)})
+        return len(created), items_report(items, valid, report, errors)
+
+    def update(self, items):
+        order_id, current = self.load()
+        valid, report = parse_items(items)
+        errors = {id_: 'The product is missing in the basket' for id_ in valid if id_ not in current}
+        updated = {id_: (current[id_][0], quantity) for id_, quantity in valid.items() if id_ not in errors}
+        if updated:
+            self.save(updated)
+        return len(updated), items_report(items, valid, report, errors)
+
+    def delete(self, ids):
+        order_id, current = self.load()
+        products = {item_id: id_ for id_, (item_id, quantity) in current.items()}
+        removed = {id_ for id_ in ids if is_id(id_) and id_ in products}
+        if removed:
+            self.save(removed=[products[id_] for id_ in removed])
+        report = []
+        for id_ in ids:
+            if not is_id(id_):
+                report.append(item_error('id', id_, 'Invalid type of order item id'))
+            elif id_ not in removed:
+                report.append(item_error('id', id_, 'The order item is missing in the basket'))
+            else:
+                report.append({'id': id_, 'Status': True})
+        return len(removed), report
+
+    def materialize(self):
+        """
+        Перенос корзины из Redis в OrderItem строки Order корзины с сохранением
+        id позиций: удаление отсутствующих позиций, один upsert по id
+        и пересчет суммы в транзакции
+        """
+        data = self.client.hgetall(self.key)
+        if b'order' not in data:
+            return None
+        order_id = int(data.pop(b'order'))
+        items = self.parse(data)
+        with transaction.atomic():
+            if not Order.objects.select_for_update().filter(id=order_id, state='basket').exists():
+                return None
+            existing = set(ProductInfo.objects.filter(id__in=items).values_list('id', flat=True))
+            item_ids = [items[id_][0] for id_ in existing]
+            OrderItem.objects.filter(order_id=order_id).exclude(id__in=item_ids).delete()
+            OrderItem.objects.bulk_create([OrderItem(id=items[id_][0], order_id=order_id, product_info_id=id_,
+                                                     quantity=items[id_][1])
+                                           for id_ in sorted(existing)],
+                                          update_conflicts=True, unique_fields=['id'],
+                                          update_fields=['quantity'])
+            update_order_totals([order_id])
+        return order_id
+
+    def discard(self, order_id):
+        """
+        Удаление корзины из Redis после оформления заказа order_id
+        """
+        if self.client.hget(self.key, 'order') == str(order_id).encode():
+            self.client.delete(self.key)
+
+
+def get_basket(user_id):
+    """
+    Корзина пользователя в хранилище BASKET_STORAGE (database или redis)
+    """
+    if settings.BASKET_STORAGE == 'redis':
+        return RedisBasket(user_id)
+    return DatabaseBasket(user_id)
+
+
+def persist_baskets(batch_size=1000):
+    """
+    Сохранение измененных корзин из Redis в базу данных (снимок корзин).
+    Пользователи, корзины которых сохранить не удалось, снова отмечаются
+    в BASKET_DIRTY_KEY после обхода остальных корзин, затем выбрасывается
+    первая ошибка
+    """
+    persisted = 0
+    failed = {}
+    client = basket_redis()
+    try:
+        while user_ids := client.spop(BASKET_DIRTY_KEY, batch_size):
+            for user_id in user_ids:
+                try:
+                    if RedisBasket(int(user_id)).materialize() is not None:
+                        persisted += 1
+                except Exception as e:
+                    failed[user_id] = e
+    finally:
+        if failed:
+            client.sadd(BASKET_DIRTY_KEY, *failed)
+    if failed:
+        raise next(iter(failed.values()))
+    return persisted
@@ -0,0 +1,250 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from retail.models import Retailer, Category, Parameter
+
+
+bypass = threading.local()
+
+
+@contextmanager
+def bypass_caches():
+    """
+    Работа в текущем потоке без кэшей (пробная загрузка с откатом транзакции):
+    справочники читаются из базы без сохранения строк в кэш процесса
+    и кэш Django, версии справочников и каталога не меняются, чтобы
+    незафиксированное состояние не попало к другим процессам
+    """
+    bypass.enabled = True
+    try:
+        yield
+    finally:
+        bypass.enabled = False
+
+
+def caches_bypassed():
+    return getattr(bypass, 'enabled', False)
+
+
+class ReferenceCache:
+    """
+    Класс: кэш справочных данных (продавцы, категории, характеристики)
+    Двухуровневый кэш строк модели:
+    - в памяти процесса, LRU размером не более REFERENCE_CACHE_SIZE строк
+    - в кэше Django (общий для процессов), со сроком REFERENCE_CACHE_TIMEOUT
+    Строки ищутся по id или по значению поля (наименование -> id),
+    отсутствующие строки читаются из базы одним запросом.
+    Сброс выполняется обработчиками post_save/post_delete (retail.signals),
+    после массовых операций без сигналов (bulk_create, update) сброс
+    выполняется явно методом invalidate. Другие процессы узнают о сбросе
+    по номеру версии в кэше Django, который проверяется не чаще одного раза
+    в REFERENCE_CACHE_CHECK_INTERVAL секунд.
+    Возвращаемые объекты общие для всех потоков и предназначены только для чтения.
+    """
+    def __init__(self, model):
+        self.model = model
+        self.prefix = f'retail:reference:{model._meta.label_lower}'
+        self.version_key = f'{self.prefix}:version'
+        self.lock = threading.RLock()
+        self.rows = OrderedDict()
+        self.keys = {}
+        self.all_rows = None
+        self.version = None
+        self.checked_at = 0.0
+
+    @property
+    def max_size(self):
+        return settings.REFERENCE_CACHE_SIZE
+
+    def shared_version(self, force=False):
+        """
+        Номер версии в кэше Django, при смене номера локальный кэш сбрасывается
+        """
+        now = time.monotonic()
+        if not force and now - self.checked_at < settings.REFERENCE_CACHE_CHECK_INTERVAL:
+            return self.version
+        self.checked_at = now
+        version = cache.get(self.version_key)
+        if version is None:
+            version = self.version if self.version is not None else time.time_ns()
+            cache.add(self.version_key, version, timeout=None)
+        if version != self.version:
+            self.clear()
+            self.version = version
+        return version
+
+    def sync(self, version):
+        """
+        Проверка версии без ожидания REFERENCE_CACHE_CHECK_INTERVAL, если версия
+        процесса отличается от версии version, прочитанной вызывающим кодом
+        из кэша Django (например, для ETag ответа)
+        """
+        if version != self.version:
+            self.shared_version(force=True)
+
+    def shared_key(self, *parts):
+        digest = hashlib.md5(repr(parts).encode(), usedforsecurity=False).hexdigest()
+        return f'{self.prefix}:{self.version}:{digest}'
+
+    def clear(self):
+        with self.lock:
+            self.rows.clear()
+            self.keys.clear()
+            self.all_rows = None
+
+    def invalidate(self):
+        """
+        Сброс кэша в текущем процессе и смена версии в кэше Django
+        """
+        if caches_bypassed():
+            return
+        self.clear()
+        version = time.time_ns()
+        cache.set(self.version_key, version, timeout=None)
+        self.version = version
+        self.checked_at = time.monotonic()
+
+    def remember(self, rows):
+        with self.lock:
+            for row in rows:
+                self.rows[row.pk] = row
+                self.rows.move_to_end(row.pk)
+            while len(self.rows) > self.max_size:
+                self.rows.popitem(last=False)
+                self.all_rows = None
+            if len(self.keys) > self.max_size:
+                self.keys = {key: pk for key, pk in self.keys.items() if pk in self.rows}
+
+    def get_many(self, field, values):
+        """
+        Поиск строк по значениям поля field, результат: значение -> строка
+        """
+        field = self.model._meta.pk.attname if field == 'pk' else field
+        if caches_bypassed():
+            return {getattr(row, field): row for row in self.model.objects.filter(**{f'{field}__in': values})}
+        self.shared_version()
+        found = {}
+        with self.lock:
+            for value in values:
+                pk = value if field == self.model._meta.pk.attname else self.keys.get((field, value))
+                row = self.rows.get(pk)
+                if row is not None:
+                    self.rows.move_to_end(pk)
+                    found[value] = row
+        missing = [value for value in values if value not in found]
+        if missing:
+            shared_keys = {self.shared_key(field, value): value for value in missing}
+            shared = {shared_keys[key]: row for key, row in cache.get_many(list(shared_keys)).items()}
+            stored = {}
+            for row in self.model.objects.filter(**{f'{field}__in': [value for value in missing
+                                                                      if value not in shared]}):
+                stored[getattr(row, field)] = row
+            if stored:
+                cache.set_many({self.shared_key(field, value): row for value, row in stored.items()},
+                               timeout=settings.REFERENCE_CACHE_TIMEOUT)
+            fetched = shared | stored
+            self.remember(fetched.values())
+            if field != self.model._meta.pk.attname:
+                with self.lock:
+                    self.keys.update({(field, value): row.pk for value, row in fetched.items()})
+            found.update(fetched)
+        return found
+
+    def get(self, pk):
+        return self.get_many('pk', [pk]).get(pk)
+
+    def ids(self, field, values):
+        """
+        Словарь значение поля -> id строки
+        """
+        return {value: row.pk for value, row in self.get_many(field, values).items()}
+
+    def all(self):
+        """
+        Все строки модели в порядке Meta.ordering, если их не больше
+        REFERENCE_CACHE_SIZE, иначе None
+        """
+        if caches_bypassed():
+            rows = list(self.model.objects.all()[:self.max_size + 1])
+            return rows if len(rows) <= self.max_size else None
+        self.shared_version()
+        with self.lock:
+            if self.all_rows is not None:
+                return self.all_rows
+        rows = cache.get(self.shared_key('all'))
+        if rows is None:
+            rows = list(self.model.objects.all()[:self.max_size + 1])
+            if len(rows) > self.max_size:
+                return None
+            cache.set(self.shared_key('all'), rows, timeout=settings.REFERENCE_CACHE_TIMEOUT)
+        self.remember(rows)
+        with self.lock:
+            self.all_rows = rows
+        return rows
+
+
+retailer_cache = ReferenceCache(Retailer)
+category_cache = ReferenceCache(Category)
+parameter_cache = ReferenceCache(Parameter)
+
+REFERENCE_CACHES = {reference.model: reference for reference in (retailer_cache, category_cache, parameter_cache)}
+
+
+CATALOG_VERSION_KEY = 'retail:catalog:version'
+CATALOG_SHARED_VERSION_KEY = 'retail:catalog:version:shared'
+
+
+def catalog_version_key(retailer_id=None, category_id=None):
+    """
+    Ключ версии (тега) каталога продавца retailer_id, категории category_id
+    или всего каталога
+    """
+    if retailer_id is not None:
+        return f'{CATALOG_VERSION_KEY}:retailer:{retailer_id}'
+    if category_id is not None:
+        return f'{CATALOG_VERSION_KEY}:category:{category_id}'
+    return CATALOG_VERSION_KEY
+
+
+def bump_catalog_version(retailer_ids=(), category_ids=(), shared=False):
+    """
+    Смена версий каталога продавцов, категорий (и общих для всех продавцов
+    данных при shared) вместе с версией всего каталога в кэше Django:
+    сразу и повторно после фиксации транзакции, чтобы клиент не получил
+    новую версию с незафиксированным содержимым. Версия - время смены в нс
+    """
+    if caches_bypassed():
+        return
+    keys = [CATALOG_VERSION_KEY,
+            *(catalog_version_key(retailer_id=retailer_id) for retailer_id in retailer_ids),
+            *(catalog_version_key(category_id=category_id) for category_id in category_ids)]
+    if shared:
+        keys.append(CATALOG_SHARED_VERSION_KEY)
+
+    def bump():
+        version = time.time_ns()
+        cache.set_many({key: version for key in keys}, timeout=None)
+    bump()
+    transaction.on_commit(bump)
+
+
+def get_versions(keys):
+    """
+    Версии по ключам одним запросом к кэшу Django,
+    отсутствующие версии создаются с текущим временем
+    """
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        version = time.time_ns()
+        for key in missing:
+            cache.add(key, version, timeout=None)
+            versions[key] = version
+    return versions
@@ -0,0 +1,292 @@
+import csv
+import logging
+from functools import lru_cache
+
+import ujson
+
+from django.conf import settings
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramWordSimilarity
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections, transaction
+from django.db.models import Count, F, Func, JSONField, Q, Sum, TextField, Value
+from django.db.models.functions import Cast, Greatest
+
+from retail.cache import bump_catalog_version
+from retail.models import Category, CatalogEntry, CatalogFacet, ProductInfo, ProductParameter, Retailer
+from retail.rows import product_info_cards
+from retail.serializers import ProductInfoViewSerializer
+
+logger = logging.getLogger(__name__)
+
+
+def product_info_chunks(product_info_ids, batch_size, **filters):
+    """
+    Списки id строк ProductInfo по возрастанию длиной не более batch_size:
+    известные id делятся без запросов, для фильтров используется
+    постраничная выборка по id
+    """
+    if product_info_ids is not None and not filters:
+        ids = sorted(product_info_ids)
+        for start in range(0, len(ids), batch_size):
+            yield ids[start:start + batch_size]
+        return
+    queryset = ProductInfo.objects.filter(**filters)
+    if product_info_ids is not None:
+        queryset = queryset.filter(id__in=product_info_ids)
+    ids = queryset.order_by('id').values_list('id', flat=True).distinct()
+    last_id = 0
+    while chunk := list(ids.filter(id__gt=last_id)[:batch_size]):
+        last_id = chunk[-1]
+        yield chunk
+
+
+def catalog_entry(data, retailer_state, category_id):
+    """
+    Снимок каталога для карточки товара в формате ProductInfoViewSerializer
+    """
+    parameters = data['product_parameters']
+    return CatalogEntry(product_info_id=data['id'], retailer_id=data['retailer'],
+                        category_id=category_id, retailer_state=retailer_state,
+                        price=data['price'], price_rrc=data['price_rrc'], quantity=data['quantity'],
+                        data=data,
+                        parameters={parameter['parameter']: parameter['value'] for parameter in parameters},
+                        search_title=f'{data["product"]["name"]} {data["model"]}',
+                        search_text=' '.join([data['product']['category'],
+                                              *(parameter['value'] for parameter in parameters)]))
+
+
+def refresh_catalog(product_info_ids=None, batch_size=None, **filters):
+    """
+    Пересборка снимков каталога CatalogEntry для строк ProductInfo,
+    заданных списком id и/или фильтрами, пачками по batch_size строк:
+    на пачку два запроса values_list на чтение и один upsert
+    """
+    batch_size = batch_size or settings.IMPORT_BATCH_SIZE
+    refreshed = 0
+    retailer_ids, category_ids = set(), set()
+    for chunk in product_info_chunks(product_info_ids, batch_size, **filters):
+        entries = [catalog_entry(card, retailer_state, category_id) for card, (retailer_state, category_id)
+                   in product_info_cards(chunk, 'retailer__state', 'product__category_id')]
+        CatalogEntry.objects.bulk_create(entries, update_conflicts=True,
+                                         unique_fields=['product_info'],
+                                         update_fields=['retailer', 'category', 'retailer_state',
+                                                        'price', 'price_rrc', 'quantity', 'data', 'parameters', 'search_title', 'search_text',
+                                                        'updated_at'])
+        refreshed += len(entries)
+        retailer_ids.update(entry.retailer_id for entry in entries)
+        category_ids.update(entry.category_id for entry in entries)
+    if retailer_ids:
+        bump_catalog_version(retailer_ids, category_ids)
+    return refreshed
+
+
+def refresh_retailer_state(**filters):
+    """
+    Перенос статуса получения заказов продавцов в снимки каталога
+    """
+    for retailer_id, state in Retailer.objects.filter(**filters).values_list('id', 'state'):
+        if CatalogEntry.objects.filter(retailer_id=retailer_id).exclude(
+                retailer_state=state).update(retailer_state=state):
+            bump_catalog_version([retailer_id], retailer_categories(retailer_id))
+
+
+@lru_cache
+def trigram_available(using=DEFAULT_DB_ALIAS):
+    """
+    Установлено ли в базе данных расширение pg_trgm
+    """
+    with connections[using].cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        return cursor.fetchone() is not None
+
+
+def create_trigram_index(using=DEFAULT_DB_ALIAS, **kwargs):
+    """
+    Обработчик post_migrate: установка расширения pg_trgm и триграммного
+    GIN индекса по наименованию и модели товара. Индекс не объявлен в Meta,
+    так как расширение может быть недоступно на сервере базы данных,
+    в этом случае поиск выполняется без нечетких совпадений
+    """
+    table = CatalogEntry._meta.db_table
+    try:
+        with transaction.atomic(using=using), connections[using].cursor() as cursor:
+            cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+            cursor.execute(f'CREATE INDEX IF NOT EXISTS catalog_search_trgm_idx '
+                           f'ON {table} USING gin (search_title gin_trgm_ops)')
+    except DatabaseError as error:
+        logger.warning('Fuzzy catalog search is disabled, pg_trgm is unavailable: %s', str(error).strip())
+    trigram_available.cache_clear()
+
+
+def search_catalog(queryset, text):
+    """
+    Полнотекстовый поиск по снимкам каталога с сортировкой по релевантности:
+    совпадения по поисковому вектору (GIN индекс catalog_search_idx),
+    при наличии pg_trgm - также нечеткие совпадения по наименованию и модели
+    (GIN индекс catalog_search_trgm_idx)
+    """
+    query = SearchQuery(text, config=settings.CATALOG_SEARCH_CONFIG, search_type='websearch')
+    condition = Q(search_vector=query)
+    rank = SearchRank(F('search_vector'), query)
+    if trigram_available(queryset.db):
+        condition |= Q(search_title__trigram_word_similar=text)
+        rank = Greatest(rank, TrigramWordSimilarity(text, 'search_title'))
+    return queryset.filter(condition).annotate(rank=rank).order_by('-rank', 'pk')
+
+
+def retailer_categories(retailer_id):
+    """
+    Категории продавца из связи категорий с продавцами
+    """
+    return set(Category.retailers.through.objects.filter(
+        retailer_id=retailer_id).values_list('category_id', flat=True))
+
+
+def refresh_facets(retailer_id):
+    """
+    Пересчет числа товаров продавца по категориям и значениям характеристик
+    """
+    counts = ProductParameter.objects.filter(product_info__retailer_id=retailer_id).values(
+        'product_info__product__category_id', 'parameter_id', 'value').annotate(count=Count('id'))
+    facets = [CatalogFacet(retailer_id=retailer_id, category_id=row['product_info__product__category_id'],
+                           parameter_id=row['parameter_id'], value=row['value'], count=row['count'])
+              for row in counts]
+    category_ids = retailer_categories(retailer_id) | {facet.category_id for facet in facets}
+    with transaction.atomic():
+        CatalogFacet.objects.filter(retailer_id=retailer_id).delete()
+        CatalogFacet.objects.bulk_create(facets)
+    bump_catalog_version([retailer_id], category_ids)
+    return len(facets)
+
+
+def filter_parameters(queryset, parameters):
+    """
+    Отбор снимков каталога по значениям характеристик (GIN индекс
+    catalog_parameters_idx): parameters - словарь наименование -> список значений,
+    значения одной характеристики объединяются по ИЛИ, характеристики - по И
+    """
+    for name, values in parameters.items():
+        condition = Q()
+        for value in values:
+            condition |= Q(parameters__contains={name: value})
+        queryset = queryset.filter(condition)
+    return queryset
+
+
+def catalog_facets(retailer_id=None, category_id=None):
+    """
+    Число товаров по значениям характеристик для продавцов, принимающих заказы,
+    с отбором по продавцу и категории, из предрассчитанной таблицы CatalogFacet
+    (без отбора по характеристикам, цене, наличию и поиску, см. filtered_facets)
+    """
+    query = Q(retailer__state=True)
+    if retailer_id is not None:
+        query &= Q(retailer_id=retailer_id)
+    if category_id is not None:
+        query &= Q(category_id=category_id)
+    facets = {}
+    rows = CatalogFacet.objects.filter(query).values('parameter__name', 'value').annotate(
+        total=Sum('count')).order_by('parameter__name', '-total', 'value')
+    for row in rows:
+        facets.setdefault(row['parameter__name'], {})[row['value']] = row['total']
+    return facets
+
+
+def filtered_facets(queryset, parameters):
+    """
+    Число товаров по значениям характеристик в выборке снимков каталога
+    queryset с отбором по характеристикам parameters (как в filter_parameters):
+    значения характеристики из отбора считаются без ее собственного условия
+    (клиент видит альтернативы выбранным значениям), остальные характеристики -
+    с отбором по всем характеристикам. Один запрос: части UNION ALL по
+    характеристикам отбора, значения раскрываются функцией jsonb_each_text
+    """
+    parts = [(filter_parameters(queryset, parameters),
+              'WHERE NOT (facet.key = ANY(%s))' if parameters else '', [list(parameters)] if parameters else [])]
+    for name in parameters:
+        others = {key: values for key, values in parameters.items() if key != name}
+        parts.append((filter_parameters(queryset, others), 'WHERE facet.key = %s', [name]))
+    sqls, params = [], []
+    for part, condition, condition_params in parts:
+        sql, sql_params = part.order_by().values('parameters').query.sql_with_params()
+        sqls.append(f'(SELECT facet.key, facet.value, COUNT(*) FROM ({sql}) entry '
+                    f'CROSS JOIN LATERAL jsonb_each_text(entry.parameters) facet {condition} '
+                    f'GROUP BY facet.key, facet.value)')
+        params += [*sql_params, *condition_params]
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(' UNION ALL '.join(sqls) + ' ORDER BY 1, 3 DESC, 2', params)
+        rows = cursor.fetchall()
+    facets = {}
+    for name, value, count in rows:
+        facets.setdefault(name, {})[value] = count
+    return facets
+
+
+class JSONBWithoutKeys(Func):
+    """
+    Класс: документ jsonb без заданных ключей (оператор jsonb - text[])
+    """
+    arg_joiner = ' - '
+    template = '(%(expressions)s)'
+    output_field = JSONField()
+
+
+def catalog_cards(queryset, fields):
+    """
+    Карточки товаров снимков каталога только с полями fields: лишние ключи
+    (в том числе вложенные товар и характеристики) удаляются в базе данных
+    и не передаются приложению, карточка выдается в аннотации card
+    """
+    excluded = [name for name in ProductInfoViewSerializer.Meta.fields if name not in fields]
+    if not excluded:
+        return queryset
+    return queryset.defer('data').annotate(card=JSONBWithoutKeys(
+        F('data'), Cast(Value(excluded), ArrayField(TextField()))))
+
+
+CATALOG_CSV_COLUMNS = (
+    ('id', 'id'), ('model', 'model'), ('cat_id', 'cat_id'), ('product', 'product'),
+    ('category', 'product'), ('retailer', 'retailer'), ('quantity', 'quantity'),
+    ('price', 'price'), ('price_rrc', 'price_rrc'), ('parameters', 'product_parameters'),
+)
+
+
+class EchoBuffer:
+    """
+    Класс: псевдофайл для csv.writer, возвращающий записанную строку
+    """
+    def write(self, value):
+        return value
+
+
+def catalog_csv_row(card):
+    """
+    Плоская строка CSV из карточки товара: наименование товара и категория
+    в отдельных колонках, характеристики - одной колонкой "наименование: значение; ..."
+    """
+    row = dict(card)
+    product = row.pop('product', None)
+    if product is not None:
+        row['product'], row['category'] = product['name'], product['category']
+    parameters = row.pop('product_parameters', None)
+    if parameters is not None:
+        row['parameters'] = '; '.join(f'{parameter["parameter"]}: {parameter["value"]}'
+                                      for parameter in parameters)
+    return row
+
+
+def export_catalog(cards, export_type='ndjson', fields=None):
+    """
+    Построчная выгрузка карточек товаров из итератора cards в формате
+    NDJSON (карточка JSON на строку) или CSV (fields - выбранные поля карточки)
+    """
+    if export_type == 'ndjson':
+        for card in cards:
+            yield ujson.dumps(card, ensure_ascii=False, escape_forward_slashes=False) + '\n'
+        return
+    fields = fields or ProductInfoViewSerializer.Meta.fields
+    columns = [column for column, field in CATALOG_CSV_COLUMNS if field in fields]
+    writer = csv.DictWriter(EchoBuffer(), fieldnames=columns, extrasaction='ignore')
+    yield writer.writeheader()
+    for card in cards:
+        yield writer.writerow(catalog_csv_row(card))
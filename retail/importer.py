@@ -0,0 +1,721 @@
+import csv
+import hashlib
+import io
+import os
+import tempfile
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import lru_cache
+from itertools import islice
+from urllib.parse import urlsplit
+
+import requests
+import yaml
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from ujson import loads as load_json
+
+from retail.catalog import refresh_catalog, refresh_facets
+from retail.cache import retailer_cache, category_cache, parameter_cache
+from retail.models import (Retailer, Category, Product, Parameter,
+                           ProductParameter, ProductInfo, Order)
+from retail.orders import update_order_totals
+
+
+def chunked(iterable, size):
+    """
+    Разбиение последовательности на списки длиной не более size
+    """
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+YamlLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+
+class PriceListTooLarge(requests.RequestException):
+    """
+    Размер прайс-листа превышает IMPORT_HTTP_MAX_SIZE
+    """
+
+
+@lru_cache(maxsize=None)
+def create_http_session(retries, backoff_factor, pool_size):
+    """
+    Сессия requests с пулом соединений и повторными попытками
+    с экспоненциальной задержкой при ошибках соединения и ответах 429, 5xx.
+    Создается один раз на процесс воркера для каждого набора настроек
+    """
+    retry = Retry(total=retries, connect=retries, read=retries, status=retries,
+                  backoff_factor=backoff_factor, status_forcelist=(429, 500, 502, 503, 504),
+                  allowed_methods=('GET',), raise_on_status=False)
+    adapter = HTTPAdapter(max_retries=retry, pool_connections=pool_size, pool_maxsize=pool_size)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers['Accept-Encoding'] = 'gzip'
+    return session
+
+
+def get_http_session():
+    return create_http_session(settings.IMPORT_HTTP_RETRIES, settings.IMPORT_HTTP_BACKOFF_FACTOR,
+                               settings.IMPORT_HTTP_POOL_SIZE)
+
+
+def download_price_list(url, price_list=None):
+    """
+    Потоковая загрузка прайс-листа во временный файл частями
+    по IMPORT_DOWNLOAD_CHUNK_SIZE байт с подсчетом хэша SHA-256
+    через общую сессию воркера с таймаутами и ограничением размера
+    IMPORT_HTTP_MAX_SIZE (после распаковки gzip).
+    Если известна предыдущая загрузка price_list, запрос отправляется
+    с заголовками If-None-Match / If-Modified-Since.
+    Возвращает None при ответе 304 Not Modified, иначе кортеж из файла,
+    установленного на начало, словаря с полями etag, last_modified, sha256
+    и заголовка Content-Type ответа
+    """
+    headers = {}
+    if price_list is not None:
+        if price_list.etag:
+            headers['If-None-Match'] = price_list.etag
+        if price_list.last_modified:
+            headers['If-Modified-Since'] = price_list.last_modified
+    digest = hashlib.sha256()
+    max_size = settings.IMPORT_HTTP_MAX_SIZE
+    timeout = (settings.IMPORT_HTTP_CONNECT_TIMEOUT, settings.IMPORT_HTTP_READ_TIMEOUT)
+    with get_http_session().get(url, stream=True, headers=headers, timeout=timeout) as response:
+        if response.status_code == 304:
+            return None
+        response.raise_for_status()
+        if int(response.headers.get('Content-Length') or 0) > max_size:
+            raise PriceListTooLarge(f'Price list is larger than {max_size} bytes')
+        price_list_file = tempfile.TemporaryFile()
+        size = 0
+        for chunk in response.iter_content(chunk_size=settings.IMPORT_DOWNLOAD_CHUNK_SIZE):
+            size += len(chunk)
+            if size > max_size:
+                price_list_file.close()
+                raise PriceListTooLarge(f'Price list is larger than {max_size} bytes')
+            price_list_file.write(chunk)
+            digest.update(chunk)
+    price_list_file.seek(0)
+    return price_list_file, {'etag': response.headers.get('ETag', ''),
+                             'last_modified': response.headers.get('Last-Modified', ''),
+                             'sha256': digest.hexdigest()}, response.headers.get('Content-Type', '')
+
+
+class PriceListError(ValueError):
+    """
+    Ошибка формата или содержимого прайс-листа
+    """
+
+
+class PriceListReader:
+    """
+    Базовый класс: разбор прайс-листа
+    - наименование продавца retailer и список категорий categories
+      доступны после создания объекта
+    - метод goods() возвращает товары по одному в виде словарей
+      с ключами id, category, model, name, price, price_rrc, quantity, parameters
+    - ошибки разбора из списка errors преобразуются в PriceListError
+    """
+    errors = ()
+    header = ('retailer', 'categories')
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.data = {}
+        try:
+            self.read_header()
+        except self.errors as e:
+            raise PriceListError(str(e)) from e
+        for key in self.header:
+            if key not in self.data:
+                raise PriceListError(f'Price list has no {key} section')
+
+    @property
+    def retailer(self):
+        return self.data['retailer']
+
+    @property
+    def categories(self):
+        return self.data['categories']
+
+    def goods(self):
+        try:
+            for item in self.read_goods():
+                if not isinstance(item, dict):
+                    raise PriceListError(f'Invalid goods item in price list: {item}')
+                yield item
+        except self.errors as e:
+            raise PriceListError(str(e)) from e
+
+    def read_header(self):
+        raise NotImplementedError
+
+    def read_goods(self):
+        raise NotImplementedError
+
+
+class YamlPriceListReader(PriceListReader):
+    """
+    Класс: потоковый разбор прайс-листа в формате YAML
+    - разделы retailer и categories читаются целиком при создании объекта
+    - товары раздела goods строятся по событиям парсера по одному
+      в методе goods(), весь документ в памяти не хранится, кэш построенных
+      объектов загрузчика очищается после каждого товара
+    - если раздел goods расположен раньше остальных, файл
+      читается повторно с начала, поэтому поток должен поддерживать seek
+    """
+    errors = (yaml.YAMLError,)
+
+    def read_header(self):
+        self.loader = self.open_document()
+        if not self.seek_goods(read_header=True):
+            if 'goods' not in self.data:
+                raise PriceListError('Price list has no goods section')
+            self.stream.seek(0)
+            self.loader = self.open_document()
+            self.seek_goods(read_header=False)
+
+    def open_document(self):
+        loader = YamlLoader(self.stream)
+        loader.get_event()
+        loader.get_event()
+        if not loader.check_event(yaml.MappingStartEvent):
+            raise yaml.YAMLError('Price list must be a mapping')
+        loader.get_event()
+        return loader
+
+    def seek_goods(self, read_header):
+        """
+        Чтение разделов документа до раздела goods. Возвращает True,
+        если парсер остановлен на начале раздела goods и все разделы
+        header уже прочитаны
+        """
+        while not self.loader.check_event(yaml.MappingEndEvent):
+            key = self.read_object()
+            if key == 'goods':
+                if all(section in self.data for section in self.header):
+                    return True
+                self.data['goods'] = None
+                self.skip_object()
+            elif read_header:
+                self.data[key] = self.read_object()
+            else:
+                self.skip_object()
+        return False
+
+    def read_goods(self):
+        if not self.loader.check_event(yaml.SequenceStartEvent):
+            raise yaml.YAMLError('Section <goods> must be a sequence')
+        self.loader.get_event()
+        while not self.loader.check_event(yaml.SequenceEndEvent):
+            item = self.read_object()
+            self.loader.constructed_objects.clear()
+            self.loader.recursive_objects.clear()
+            yield item
+        self.loader.get_event()
+
+    def read_object(self):
+        """
+        Построение очередного значения (скаляр, список, словарь) по событиям парсера
+        """
+        event = self.loader.get_event()
+        if isinstance(event, yaml.ScalarEvent):
+            tag = event.tag
+            if tag is None or tag == '!':
+                tag = self.loader.resolve(yaml.ScalarNode, event.value, event.implicit)
+            node = yaml.ScalarNode(tag, event.value, event.start_mark, event.end_mark, style=event.style)
+            return self.loader.construct_object(node)
+        if isinstance(event, yaml.SequenceStartEvent):
+            items = []
+            while not self.loader.check_event(yaml.SequenceEndEvent):
+                items.append(self.read_object())
+            self.loader.get_event()
+            return items
+        if isinstance(event, yaml.MappingStartEvent):
+            mapping = {}
+            while not self.loader.check_event(yaml.MappingEndEvent):
+                key = self.read_object()
+                mapping[key] = self.read_object()
+            self.loader.get_event()
+            return mapping
+        raise yaml.YAMLError(f'Unsupported YAML element in price list: {event}')
+
+    def skip_object(self):
+        depth = 0
+        while True:
+            event = self.loader.get_event()
+            if isinstance(event, (yaml.SequenceStartEvent, yaml.MappingStartEvent)):
+                depth += 1
+            elif isinstance(event, (yaml.SequenceEndEvent, yaml.MappingEndEvent)):
+                depth -= 1
+            if depth == 0:
+                return
+
+
+class JsonPriceListReader(PriceListReader):
+    """
+    Класс: разбор прайс-листа в формате JSON с теми же разделами, что и YAML.
+    Документ читается целиком с помощью ujson, для больших прайс-листов
+    следует использовать построчный формат NDJSON
+    """
+    errors = (ValueError,)
+
+    def read_header(self):
+        self.data = load_json(self.stream.read())
+        if not isinstance(self.data, dict) or not isinstance(self.data.get('goods'), list):
+            raise PriceListError('Price list must be an object with goods list')
+
+    def read_goods(self):
+        goods = self.data.pop('goods')
+        goods.reverse()
+        while goods:
+            yield goods.pop()
+
+
+class NdjsonPriceListReader(PriceListReader):
+    """
+    Класс: построчный разбор прайс-листа в формате NDJSON
+    - первая строка содержит объект с ключами retailer и categories
+    - каждая следующая строка содержит один товар
+    """
+    errors = (ValueError,)
+
+    def read_header(self):
+        for line in self.stream:
+            if line.strip():
+                self.data = load_json(line)
+                break
+        if not isinstance(self.data, dict):
+            raise PriceListError('First line of price list must be an object')
+
+    def read_goods(self):
+        for line in self.stream:
+            if line.strip():
+                yield load_json(line)
+
+
+class CsvPriceListReader(PriceListReader):
+    """
+    Класс: построчный разбор прайс-листа в формате CSV
+    - обязательные колонки: retailer, category, category_name, id, name,
+      model, price, price_rrc, quantity
+    - остальные колонки считаются характеристиками товара, пустые значения пропускаются
+    - продавец и категории собираются первым проходом по файлу,
+      товары читаются вторым проходом, поэтому поток должен поддерживать seek
+    """
+    errors = (csv.Error, ValueError)
+    columns = ('retailer', 'category', 'category_name', 'id', 'name',
+               'model', 'price', 'price_rrc', 'quantity')
+
+    def rows(self):
+        self.stream.seek(0)
+        text = io.TextIOWrapper(self.stream, encoding='utf-8-sig', newline='')
+        try:
+            reader = csv.DictReader(text)
+            missing = [column for column in self.columns if column not in (reader.fieldnames or ())]
+            if missing:
+                raise PriceListError(f'Price list has no columns: {", ".join(missing)}')
+            yield from reader
+        finally:
+            text.detach()
+
+    def read_header(self):
+        categories = {}
+        for row in self.rows():
+            self.data.setdefault('retailer', row['retailer'])
+            categories.setdefault(int(row['category']), row['category_name'])
+        self.data['categories'] = [{'id': category_id, 'name': name}
+                                   for category_id, name in categories.items()]
+
+    def read_goods(self):
+        for row in self.rows():
+            yield {'id': int(row['id']), 'category': int(row['category']),
+                   'model': row['model'], 'name': row['name'],
+                   'price': int(row['price']), 'price_rrc': int(row['price_rrc']),
+                   'quantity': int(row['quantity']),
+                   'parameters': {name: value for name, value in row.items()
+                                  if name not in self.columns and value not in ('', None)}}
+
+
+PRICE_LIST_READERS = {
+    'yaml': YamlPriceListReader,
+    'json': JsonPriceListReader,
+    'ndjson': NdjsonPriceListReader,
+    'csv': CsvPriceListReader,
+}
+
+PRICE_LIST_CONTENT_TYPES = {
+    'application/yaml': 'yaml',
+    'application/x-yaml': 'yaml',
+    'text/yaml': 'yaml',
+    'text/x-yaml': 'yaml',
+    'application/json': 'json',
+    'text/json': 'json',
+    'application/x-ndjson': 'ndjson',
+    'application/ndjson': 'ndjson',
+    'application/jsonl': 'ndjson',
+    'application/x-jsonlines': 'ndjson',
+    'text/csv': 'csv',
+    'application/csv': 'csv',
+}
+
+PRICE_LIST_EXTENSIONS = {
+    '.yaml': 'yaml',
+    '.yml': 'yaml',
+    '.json': 'json',
+    '.ndjson': 'ndjson',
+    '.jsonl': 'ndjson',
+    '.csv': 'csv',
+}
+
+
+def detect_format(url, content_type=''):
+    """
+    Определение формата прайс-листа по заголовку Content-Type,
+    затем по расширению файла в ссылке, по умолчанию YAML
+    """
+    media_type = (content_type or '').split(';')[0].strip().lower()
+    if media_type in PRICE_LIST_CONTENT_TYPES:
+        return PRICE_LIST_CONTENT_TYPES[media_type]
+    extension = os.path.splitext(urlsplit(url).path)[1].lower()
+    return PRICE_LIST_EXTENSIONS.get(extension, 'yaml')
+
+
+def open_price_list(stream, price_list_format):
+    if price_list_format not in PRICE_LIST_READERS:
+        raise PriceListError(f'Unsupported price list format: {price_list_format}')
+    return PRICE_LIST_READERS[price_list_format](stream)
+
+
+class PriceListImporter:
+    """
+    Класс: пакетная загрузка прайс-листа продавца
+    - наименования категорий, товаров и характеристик сопоставляются с id
+      через словари, заполняемые запросами вида IN (...)
+    - информация о товарах и значения характеристик записываются
+      с помощью bulk_create пачками по batch_size товаров
+    - в режиме sync каталог продавца не удаляется: строки сопоставляются
+      по ключу (товар, продавец, каталожный номер), записываются только
+      новые и изменившиеся строки, отсутствующие в прайс-листе строки
+      удаляются методом delete_missing()
+    """
+    product_info_fields = ('model', 'price', 'price_rrc', 'quantity')
+
+    def __init__(self, partner, batch_size=None, sync=None, progress=None):
+        self.partner = partner
+        self.batch_size = batch_size or settings.IMPORT_BATCH_SIZE
+        self.sync = settings.IMPORT_SYNC if sync is None else sync
+        self.retailer = None
+        self.parameters = {}
+        self.seen = set()
+        self.baskets = set()
+        self.rows = 0
+        self.created = 0
+        self.updated = 0
+        self.deleted = 0
+        self.timings = defaultdict(float)
+        self.progress = progress
+
+    @property
+    def stats(self):
+        return {'Objects imported': self.rows, 'Objects created': self.created,
+                'Objects updated': self.updated, 'Objects deleted': self.deleted}
+
+    def result(self):
+        """
+        Результат загрузки пачки товаров для передачи между задачами celery
+        """
+        return {'stats': self.stats, 'seen': list(self.seen), 'baskets': list(self.baskets),
+                'timings': self.timings}
+
+    def merge_result(self, result):
+        """
+        Учет результата загрузки пачки товаров, выполненной другой задачей
+        """
+        if result:
+            self.rows += result['stats']['Objects imported']
+            self.created += result['stats']['Objects created']
+            self.updated += result['stats']['Objects updated']
+            self.deleted += result['stats']['Objects deleted']
+            self.seen.update(result['seen'])
+            self.baskets.update(result.get('baskets', ()))
+            for phase, duration in result['timings'].items():
+                self.timings[phase] += duration
+
+    @contextmanager
+    def timer(self, phase):
+        """
+        Учет длительности этапа загрузки phase в словаре timings
+        """
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.timings[phase] += time.monotonic() - started
+
+    def prepare(self, price_list):
+        """
+        Загрузка продавца и категорий, очистка каталога продавца вне режима sync
+        (корзины с товарами продавца запоминаются до каскадного удаления их позиций)
+        """
+        with self.timer('resolve'):
+            self.import_retailer(price_list.retailer)
+            self.import_categories(price_list.categories)
+        if not self.sync:
+            self.collect_baskets()
+            self.clear()
+
+    def run(self, price_list):
+        """
+        Загрузка прайс-листа целиком: продавец, категории, товары
+        и удаление отсутствующих в прайс-листе строк каталога
+        """
+        self.prepare(price_list)
+        self.import_goods(price_list.goods())
+        self.finish()
+        return self.stats
+
+    def finish(self):
+        """
+        Завершение загрузки: удаление отсутствующих в прайс-листе строк
+        каталога в режиме sync, пересчет сумм корзин с товарами продавца
+        (цены и состав корзин могли измениться) и фасетов каталога продавца
+        """
+        self.collect_baskets()
+        if self.sync:
+            self.delete_missing()
+        if self.baskets:
+            update_order_totals(self.baskets)
+        with self.timer('facets'):
+            refresh_facets(self.retailer.id)
+
+    def collect_baskets(self):
+        """
+        Запоминание корзин с товарами продавца для пересчета сумм в finish():
+        позиции корзин удаляются каскадом вместе со строками каталога
+        """
+        self.baskets.update(Order.objects.filter(
+            state='basket', ordered_items__product_info__retailer_id=self.retailer.id).values_list(
+            'id', flat=True).distinct())
+
+    def import_retailer(self, name):
+        self.retailer = retailer_cache.get_many('user_id', [self.partner]).get(self.partner)
+        if self.retailer is None or self.retailer.name != name:
+            self.retailer, created = Retailer.objects.get_or_create(name=name, user_id=self.partner)
+        return self.retailer
+
+    def import_categories(self, categories):
+        """
+        Запись только новых и переименованных категорий,
+        известные категории берутся из кэша справочных данных
+        """
+        category_objects = {category['id']: Category(id=category['id'], name=category['name'])
+                            for category in categories}
+        known = category_cache.get_many('pk', list(category_objects))
+        changed = [category for category_id, category in category_objects.items()
+                   if category_id not in known or known[category_id].name != category.name]
+        if changed:
+            Category.objects.bulk_create(changed, update_conflicts=True,
+                                         unique_fields=['id'], update_fields=['name'])
+            category_cache.invalidate()
+        self.retailer.categories.add(*category_objects)
+
+    def clear(self):
+        with self.timer('delete'):
+            self.deleted += ProductInfo.objects.filter(retailer_id=self.retailer.id).delete()[1].get(
+                ProductInfo._meta.label, 0)
+
+    def import_goods(self, goods):
+        """
+        Загрузка товаров пачками с учетом времени разбора и записи,
+        после каждой пачки вызывается обработчик progress
+        """
+        chunks = chunked(goods, self.batch_size)
+        while True:
+            with self.timer('parse'):
+                chunk = next(chunks, None)
+            if chunk is None:
+                return self.rows
+            with self.timer('write'), transaction.atomic():
+                if self.sync:
+                    touched = self.sync_chunk(chunk)
+                else:
+                    touched = self.import_chunk(chunk)
+                with self.timer('catalog'):
+                    refresh_catalog(touched, self.batch_size)
+            self.rows += len(chunk)
+            if self.progress is not None:
+                self.progress(self, len(chunk))
+
+    def import_chunk(self, chunk):
+        """
+        Запись пачки товаров за постоянное число запросов:
+        поиск и создание товаров, поиск и создание характеристик,
+        upsert информации о товарах, upsert значений характеристик,
+        возвращает id записанных строк ProductInfo
+        """
+        with self.timer('resolve'):
+            products = self.resolve_products(chunk)
+            self.resolve_parameters(chunk)
+        with self.timer('product_info'):
+            products_info = {}
+            for item in chunk:
+                product_id = products[(item['name'], item['category'])]
+                products_info[(product_id, item['id'])] = ProductInfo(
+                    product_id=product_id, cat_id=item['id'],
+                    retailer_id=self.retailer.id,
+                    **self.product_info_values(item))
+            ProductInfo.objects.bulk_create(
+                products_info.values(), update_conflicts=True,
+                unique_fields=['product', 'retailer', 'cat_id'],
+                update_fields=self.product_info_fields)
+            self.created += len(products_info)
+
+        with self.timer('product_parameter'):
+            product_parameters = {}
+            for item in chunk:
+                product_info = products_info[(products[(item['name'], item['category'])], item['id'])]
+                for parameter_id, value in self.parameter_values(item).items():
+                    product_parameters[(product_info.id, parameter_id)] = ProductParameter(
+                        product_info_id=product_info.id,
+                        parameter_id=parameter_id,
+                        value=value)
+            ProductParameter.objects.bulk_create(
+                product_parameters.values(), update_conflicts=True,
+                unique_fields=['product_info', 'parameter'],
+                update_fields=['value'])
+        return [product_info.id for product_info in products_info.values()]
+
+    def sync_chunk(self, chunk):
+        """
+        Сравнение пачки товаров с текущими строками каталога продавца:
+        создаются новые строки, обновляются только строки с изменившимися
+        моделью, ценами, количеством или характеристиками,
+        возвращает id созданных и измененных строк ProductInfo
+        """
+        with self.timer('resolve'):
+            products = self.resolve_products(chunk)
+            self.resolve_parameters(chunk)
+        goods = {(products[(item['name'], item['category'])], item['id']): item for item in chunk}
+
+        with self.timer('product_info'):
+            existing = ProductInfo.objects.filter(
+                retailer_id=self.retailer.id,
+                product_id__in={product_id for product_id, cat_id in goods},
+                cat_id__in={cat_id for product_id, cat_id in goods}).only(
+                'id', 'product_id', 'cat_id', *self.product_info_fields)
+            products_info = {(row.product_id, row.cat_id): row for row in existing}
+            new_rows = []
+            changed_rows = {}
+            for key, item in goods.items():
+                values = self.product_info_values(item)
+                row = products_info.get(key)
+                if row is None:
+                    products_info[key] = ProductInfo(product_id=key[0], cat_id=key[1],
+                                                     retailer_id=self.retailer.id, **values)
+                    new_rows.append(products_info[key])
+                elif any(getattr(row, field) != value for field, value in values.items()):
+                    for field, value in values.items():
+                        setattr(row, field, value)
+                    changed_rows[row.id] = row
+            existing_ids = [row.id for row in products_info.values() if row.id is not None]
+            ProductInfo.objects.bulk_create(new_rows)
+            ProductInfo.objects.bulk_update(changed_rows.values(), self.product_info_fields)
+            new_ids = {row.id for row in new_rows}
+
+        with self.timer('product_parameter'):
+            existing_parameters = defaultdict(dict)
+            for row_id, parameter_id, value in ProductParameter.objects.filter(
+                    product_info_id__in=existing_ids).values_list('product_info_id', 'parameter_id', 'value'):
+                existing_parameters[row_id][parameter_id] = value
+            new_parameters = []
+            stale_parameters = Q()
+            for key, item in goods.items():
+                row = products_info[key]
+                self.seen.add(row.id)
+                current = existing_parameters.get(row.id, {})
+                values = self.parameter_values(item)
+                changed = False
+                for parameter_id, value in values.items():
+                    if current.get(parameter_id) != value:
+                        new_parameters.append(ProductParameter(product_info_id=row.id,
+                                                               parameter_id=parameter_id,
+                                                               value=value))
+                        changed = True
+                removed = current.keys() - values.keys()
+                if removed:
+                    stale_parameters |= Q(product_info_id=row.id, parameter_id__in=removed)
+                    changed = True
+                if changed and row.id not in new_ids:
+                    changed_rows[row.id] = row
+            if stale_parameters:
+                ProductParameter.objects.filter(stale_parameters).delete()
+            ProductParameter.objects.bulk_create(
+                new_parameters, update_conflicts=True,
+                unique_fields=['product_info', 'parameter'],
+                update_fields=['value'])
+        self.created += len(new_rows)
+        self.updated += len(changed_rows)
+        return new_ids | changed_rows.keys()
+
+    def delete_missing(self):
+        """
+        Удаление строк каталога продавца, отсутствующих в прайс-листе
+        """
+        with self.timer('delete'):
+            stale = [row_id for row_id in ProductInfo.objects.filter(
+                retailer_id=self.retailer.id).values_list('id', flat=True).iterator(chunk_size=self.batch_size)
+                     if row_id not in self.seen]
+            for ids in chunked(stale, self.batch_size):
+                self.deleted += ProductInfo.objects.filter(id__in=ids).delete()[1].get(
+                    ProductInfo._meta.label, 0)
+
+    def product_info_values(self, item):
+        return {'model': item['model'], 'price': item['price'],
+                'price_rrc': item['price_rrc'], 'quantity': item['quantity']}
+
+    def parameter_values(self, item):
+        return {self.parameters[name]: str(value) for name, value in item.get('parameters', {}).items()}
+
+    def resolve_products(self, chunk):
+        """
+        Словарь (наименование, id категории) -> id товара для пачки товаров,
+        недостающие товары создаются одним запросом
+        """
+        keys = {(item['name'], item['category']) for item in chunk}
+        products = {}
+        existing = Product.objects.filter(
+            name__in={name for name, category_id in keys},
+            category_id__in={category_id for name, category_id in keys}).values_list('id', 'name', 'category_id')
+        for product_id, name, category_id in existing:
+            products.setdefault((name, category_id), product_id)
+        new_products = [Product(name=name, category_id=category_id)
+                        for name, category_id in keys if (name, category_id) not in products]
+        for product in Product.objects.bulk_create(new_products):
+            products[(product.name, product.category_id)] = product.id
+        return products
+
+    def resolve_parameters(self, chunk):
+        """
+        Пополнение словаря наименование -> id характеристики,
+        словарь сохраняется между пачками, известные характеристики берутся
+        из кэша справочных данных, недостающие создаются одним запросом
+        """
+        names = {name for item in chunk for name in item.get('parameters', {})}
+        missing = {name for name in names if name not in self.parameters}
+        if not missing:
+            return self.parameters
+        for name, parameter_id in parameter_cache.ids('name', list(missing)).items():
+            self.parameters.setdefault(name, parameter_id)
+        new_parameters = [Parameter(name=name) for name in missing if name not in self.parameters]
+        for parameter in Parameter.objects.bulk_create(new_parameters):
+            self.parameters[parameter.name] = parameter.id
+        return self.parameters
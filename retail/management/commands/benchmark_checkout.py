@@ -0,0 +1,100 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+
+from retail.models import Category, Contact, Order, OrderItem, Product, ProductInfo, Retailer, User
+from retail.stock import OutOfStock, place_order
+
+
+class Command(BaseCommand):
+    """
+    Команда: нагрузочная проверка оформления заказов на один товар
+    из многих потоков с отчетом о пропускной способности и перепродажах.
+    Тестовые данные фиксируются в базе данных (потоки работают в своих
+    соединениях) и удаляются по окончании
+    """
+    help = 'Hammer one hot product from many threads at checkout and report throughput and oversells'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16, help='Concurrent checkout threads')
+        parser.add_argument('--orders', type=int, default=200, help='Orders competing for the product')
+        parser.add_argument('--stock', type=int, default=100, help='Initial stock of the product')
+        parser.add_argument('--quantity', type=int, default=1, help='Units of the product per order')
+        parser.add_argument('--naive', action='store_true',
+                            help='Use an unlocked read-check-save decrement for comparison')
+
+    def handle(self, *args, **options):
+        product_info, orders = self.generate(options['orders'], options['stock'], options['quantity'])
+        checkout = self.naive_checkout if options['naive'] else self.checkout
+        barrier = threading.Barrier(options['threads'])
+
+        def start(_):
+            barrier.wait()
+
+        def stop(_):
+            barrier.wait()
+            connections.close_all()
+
+        try:
+            with ThreadPoolExecutor(max_workers=options['threads']) as executor:
+                list(executor.map(start, range(options['threads'])))
+                started = time.perf_counter()
+                results = list(executor.map(lambda order: checkout(*order), orders))
+                elapsed = time.perf_counter() - started
+                list(executor.map(stop, range(options['threads'])))
+            product_info.refresh_from_db()
+            placed = sum(results)
+            sold = placed * options['quantity']
+            oversold = max(0, sold - options['stock']) + max(0, -product_info.quantity)
+            self.stdout.write(f'{"naive" if options["naive"] else "reserve_stock"}: '
+                              f'{len(orders)} checkouts in {elapsed:.3f} s '
+                              f'({len(orders) / elapsed:.1f} per s) with {options["threads"]} threads')
+            self.stdout.write(f'placed {placed}, rejected {len(orders) - placed}, '
+                              f'stock left {product_info.quantity}, oversold units {oversold}')
+        finally:
+            self.cleanup(product_info)
+
+    def generate(self, orders, stock, quantity):
+        with transaction.atomic():
+            retailer_user = User.objects.create_user(email='checkout-retailer@example.com', password=None,
+                                                     type='Retailer')
+            retailer = Retailer.objects.create(name='Checkout benchmark retailer', user=retailer_user)
+            category = Category.objects.create(name='Checkout benchmark category')
+            product = Product.objects.create(name='Hot product', category=category)
+            product_info = ProductInfo.objects.create(product=product, retailer=retailer, model='hot', cat_id=1,
+                                                      quantity=stock, price=100, price_rrc=120)
+            checkouts = []
+            for number in range(orders):
+                customer = User.objects.create_user(email=f'checkout-customer-{number}@example.com',
+                                                    password=None)
+                contact = Contact.objects.create(user=customer, country='RU', city='Moscow', street='Tverskaya',
+                                                 house='1', phone='+70000000000')
+                order = Order.objects.create(user=customer, state='basket')
+                OrderItem.objects.create(order=order, product_info=product_info, quantity=quantity)
+                checkouts.append((customer.id, order.id, contact.id))
+        return product_info, checkouts
+
+    @staticmethod
+    def checkout(user_id, order_id, contact_id):
+        try:
+            return place_order(user_id, order_id, contact_id)
+        except OutOfStock:
+            return False
+
+    @staticmethod
+    def naive_checkout(user_id, order_id, contact_id):
+        for item in OrderItem.objects.filter(order_id=order_id).select_related('product_info'):
+            if item.product_info.quantity < item.quantity:
+                return False
+            item.product_info.quantity -= item.quantity
+            item.product_info.save(update_fields=['quantity'])
+        return bool(Order.objects.filter(id=order_id, state='basket').update(contact_id=contact_id, state='new'))
+
+    @staticmethod
+    def cleanup(product_info):
+        User.objects.filter(email__startswith='checkout-customer-').delete()
+        User.objects.filter(email='checkout-retailer@example.com').delete()
+        Category.objects.filter(id=product_info.product.category_id).delete()
@@ -0,0 +1,88 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from retail.importer import PriceListImporter
+from retail.models import Order, OrderItem, ProductInfo, User
+from retail.orders import update_order_totals
+from retail.renderers import UJSONRenderer
+from retail.rows import (order_rows, partner_order_rows, product_info_rows,
+                         ORDER_VALUES, PARTNER_ORDER_VALUES)
+from retail.serializers import OrderViewSerializer, PartnerOrdersSerializer, ProductInfoViewSerializer
+
+
+class Command(BaseCommand):
+    """
+    Команда: сравнение сериализаторов DRF и быстрого формирования ответов
+    из values() на страницах товаров и заказов, тестовые данные создаются
+    в транзакции, которая всегда откатывается
+    """
+    help = 'Compare DRF serializers with the values() read path on generated product and order pages'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000, help='Rows per page')
+        parser.add_argument('--items-per-order', type=int, default=10, help='Order items per order')
+        parser.add_argument('--repeat', type=int, default=3, help='Runs per variant, the best one is reported')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            product_info_ids, order_ids, retailer_user_id = self.generate(options['rows'],
+                                                                          options['items_per_order'])
+            products = ProductInfo.objects.filter(id__in=product_info_ids)
+            orders = Order.objects.filter(id__in=order_ids)
+            order_items = OrderItem.objects.filter(product_info__retailer__user_id=retailer_user_id)
+            pages = {
+                'products': (
+                    lambda: ProductInfoViewSerializer(products.select_related('product__category').prefetch_related(
+                        'product_parameters__parameter'), many=True).data,
+                    lambda: list(product_info_rows(product_info_ids).values())),
+                'orders': (
+                    lambda: OrderViewSerializer(orders.select_related('contact').prefetch_related(
+                        'ordered_items__product_info__product__category',
+                        'ordered_items__product_info__product_parameters__parameter'), many=True).data,
+                    lambda: order_rows(orders.values(*ORDER_VALUES))),
+                'partner orders': (
+                    lambda: PartnerOrdersSerializer(order_items.select_related('order__contact').prefetch_related(
+                        'product_info__product__category', 'product_info__product_parameters__parameter'),
+                        many=True).data,
+                    lambda: partner_order_rows(order_items.values(*PARTNER_ORDER_VALUES))),
+            }
+            for name, (serializer, rows) in pages.items():
+                slow = self.measure(serializer, JSONRenderer(), options['repeat'])
+                fast = self.measure(rows, UJSONRenderer(), options['repeat'])
+                self.stdout.write(f'{name:<15} serializer {slow:8.3f} s   values() + ujson {fast:8.3f} s   '
+                                  f'x{slow / fast:.1f}')
+            transaction.set_rollback(True)
+
+    def generate(self, rows, items_per_order):
+        retailer_user = User.objects.create_user(email='benchmark-retailer@example.com', password=None,
+                                                 type='Retailer')
+        customer = User.objects.create_user(email='benchmark-customer@example.com', password=None)
+        importer = PriceListImporter(retailer_user.id, sync=False)
+        importer.import_retailer('Benchmark retailer')
+        importer.import_categories([{'id': 1, 'name': 'Benchmark category'}])
+        importer.import_goods([{'id': number, 'category': 1, 'model': f'model/{number}',
+                                'name': f'Product {number}', 'price': 100 + number,
+                                'price_rrc': 120 + number, 'quantity': 5,
+                                'parameters': {'Color': 'black', 'Size': number % 10, 'Weight': number}}
+                               for number in range(rows)])
+        product_info_ids = list(ProductInfo.objects.filter(retailer=importer.retailer).values_list('id', flat=True))
+        orders = Order.objects.bulk_create(Order(user=customer, state='new')
+                                           for _ in range(0, rows, items_per_order))
+        OrderItem.objects.bulk_create(OrderItem(order=orders[number // items_per_order],
+                                                product_info_id=product_info_id, quantity=1)
+                                      for number, product_info_id in enumerate(product_info_ids))
+        update_order_totals([order.id for order in orders])
+        return product_info_ids, [order.id for order in orders], retailer_user.id
+
+    @staticmethod
+    def measure(build, renderer, repeat):
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            renderer.render(build())
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best
@@ -0,0 +1,119 @@
+import cProfile
+import pstats
+import time
+from contextlib import ExitStack
+from urllib.parse import urlsplit
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from retail.cache import bypass_caches
+from retail.importer import (PRICE_LIST_READERS, PriceListError, PriceListImporter,
+                             detect_format, download_price_list, open_price_list)
+from retail.models import User
+
+
+class Command(BaseCommand):
+    """
+    Команда: синхронная загрузка прайс-листа из файла или по ссылке
+    без celery с отчетом о длительности этапов загрузки
+    """
+    help = 'Import a price list synchronously from a local file or URL and report phase timings'
+
+    phases = (
+        ('fetch', 'Fetch'),
+        ('parse', 'Parse'),
+        ('resolve', 'Dictionary resolution'),
+        ('product_info', 'ProductInfo writes'),
+        ('product_parameter', 'ProductParameter writes'),
+        ('catalog', 'Catalog snapshots'),
+        ('delete', 'Deletes'),
+        ('facets', 'Facet counts'),
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help='Path or URL of the price list')
+        parser.add_argument('--retailer-user', type=int, required=True,
+                            help='Id of the retailer user the price list belongs to')
+        parser.add_argument('--format', choices=PRICE_LIST_READERS,
+                            help='Price list format, detected from the file extension by default')
+        parser.add_argument('--batch-size', type=int, help='Goods per chunk, IMPORT_BATCH_SIZE by default')
+        parser.add_argument('--no-sync', action='store_true',
+                            help='Delete and recreate the catalog instead of incremental sync')
+        parser.add_argument('--dry-run', action='store_true', help='Roll back all database changes')
+        parser.add_argument('--profile', action='store_true', help='Print cProfile statistics')
+        parser.add_argument('--profile-output', help='Save cProfile statistics to a file')
+        parser.add_argument('--profile-limit', type=int, default=30,
+                            help='Number of functions in the printed profile')
+
+    def handle(self, *args, **options):
+        source = options['source']
+        if not User.objects.filter(id=options['retailer_user'], type='Retailer').exists():
+            raise CommandError(f"User [{options['retailer_user']}] is missing or is not a retailer")
+        importer = PriceListImporter(options['retailer_user'], options['batch_size'],
+                                     sync=not options['no_sync'])
+        profiler = cProfile.Profile() if options['profile'] or options['profile_output'] else None
+        started = time.monotonic()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            with importer.timer('fetch'):
+                price_list_file, content_type = self.fetch(source)
+            with price_list_file, ExitStack() as dry_run:
+                if options['dry_run']:
+                    dry_run.enter_context(transaction.atomic())
+                    dry_run.enter_context(bypass_caches())
+                with importer.timer('parse'):
+                    price_list = open_price_list(price_list_file,
+                                                 options['format'] or detect_format(source, content_type))
+                importer.run(price_list)
+                if options['dry_run']:
+                    transaction.set_rollback(True)
+        except PriceListError as e:
+            raise CommandError(f'Invalid price list: {e}')
+        finally:
+            if profiler is not None:
+                profiler.disable()
+        total = time.monotonic() - started
+
+        self.report(importer, total, options['dry_run'])
+        if profiler is not None:
+            if options['profile_output']:
+                profiler.dump_stats(options['profile_output'])
+                self.stdout.write(f"Profile saved to {options['profile_output']}")
+            if options['profile']:
+                stats = pstats.Stats(profiler, stream=self.stdout)
+                stats.sort_stats('cumulative').print_stats(options['profile_limit'])
+
+    def fetch(self, source):
+        """
+        Открытие локального файла или загрузка прайс-листа по ссылке,
+        возвращает файл и заголовок Content-Type
+        """
+        if urlsplit(source).scheme in ('http', 'https'):
+            try:
+                price_list_file, fetch_info, content_type = download_price_list(source)
+            except requests.RequestException as e:
+                raise CommandError(f'Failed to download price list: {e}')
+            return price_list_file, content_type
+        try:
+            return open(source, 'rb'), ''
+        except OSError as e:
+            raise CommandError(f'Failed to open price list: {e}')
+
+    def report(self, importer, total, dry_run):
+        self.stdout.write(f"{'Phase':<26}{'Seconds':>10}{'Share':>9}")
+        for phase, title in self.phases:
+            duration = importer.timings[phase]
+            share = duration / total * 100 if total else 0
+            self.stdout.write(f'{title:<26}{duration:>10.3f}{share:>8.1f}%')
+        self.stdout.write(f"{'Total':<26}{total:>10.3f}")
+        rows_per_sec = importer.rows / total if total else 0
+        self.stdout.write(f'Rows: {importer.rows}, created: {importer.created}, '
+                          f'updated: {importer.updated}, deleted: {importer.deleted}, '
+                          f'rows/sec: {rows_per_sec:.1f}')
+        if dry_run:
+            self.stdout.write('Dry run: all changes have been rolled back')
+        else:
+            self.stdout.write(self.style.SUCCESS('Price list imported'))
@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from retail.catalog import refresh_catalog, refresh_facets
+from retail.models import Retailer
+
+
+class Command(BaseCommand):
+    """
+    Команда: полная пересборка снимков каталога CatalogEntry и фасетов CatalogFacet
+    """
+    help = 'Rebuild catalog snapshots and facet counts served by the /products/ endpoint'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retailer', type=int, help='Rebuild only the catalog of this retailer id')
+        parser.add_argument('--batch-size', type=int, help='Rows per chunk, IMPORT_BATCH_SIZE by default')
+
+    def handle(self, *args, **options):
+        filters = {}
+        if options['retailer'] is not None:
+            filters['retailer_id'] = options['retailer']
+        started = time.monotonic()
+        refreshed = refresh_catalog(batch_size=options['batch_size'], **filters)
+        facets = 0
+        retailers = Retailer.objects.all()
+        if options['retailer'] is not None:
+            retailers = retailers.filter(id=options['retailer'])
+        for retailer_id in retailers.values_list('id', flat=True):
+            facets += refresh_facets(retailer_id)
+        self.stdout.write(self.style.SUCCESS(
+            f'Catalog rebuilt: {refreshed} entries, {facets} facet counts '
+            f'in {time.monotonic() - started:.3f} s'))
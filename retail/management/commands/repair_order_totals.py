@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from retail.models import Order
+from retail.orders import update_order_totals
+
+
+class Command(BaseCommand):
+    """
+    Команда: пересчет сохраненных сумм и числа позиций заказов
+    пачками по диапазонам id заказов
+    """
+    help = 'Recompute persisted Order.total_sum and Order.items_count in bulk'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help='Orders per UPDATE')
+        parser.add_argument('--state', help='Recompute only orders in this state, e.g. basket')
+
+    def handle(self, *args, **options):
+        orders = Order.objects.all()
+        if options['state']:
+            orders = orders.filter(state=options['state'])
+        ids = orders.order_by('id').values_list('id', flat=True)
+        started = time.monotonic()
+        repaired = 0
+        last_id = 0
+        while chunk := list(ids.filter(id__gt=last_id)[:options['batch_size']]):
+            last_id = chunk[-1]
+            repaired += update_order_totals(chunk)
+        self.stdout.write(self.style.SUCCESS(
+            f'Order totals recomputed: {repaired} orders in {time.monotonic() - started:.3f} s'))
@@ -1,7 +1,11 @@
+from django.conf import settings
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
 from django.db import models
 from django.contrib.auth.base_user import BaseUserManager
 from django.contrib.auth.models import AbstractUser
 from django.contrib.auth.validators import UnicodeUsernameValidator
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from django_rest_passwordreset.tokens import get_token_generator
 
@@ -22,6 +26,15 @@ USER_TYPE_CHOICES = (
     ('Client', 'Клиент')
 )
 
+IMPORT_STATE_CHOICES = (
+    ('pending', 'Ожидает запуска'),
+    ('download', 'Загрузка прайс-листа'),
+    ('import', 'Запись в каталог'),
+    ('finished', 'Завершена'),
+    ('skipped', 'Пропущена'),
+    ('failed', 'Ошибка')
+)
+
 
 class UserManager(BaseUserManager):
     use_in_migrations = True
@@ -143,12 +156,16 @@ class Product(models.Model):
     """
     name = models.CharField(max_length=200, verbose_name='Наименование товара')
     category = models.ForeignKey(Category, verbose_name='Категория', related_name='products', blank=True,
-                                 on_delete=models.CASCADE)
+                                 on_delete=models.CASCADE, db_index=False)
 
     class Meta:
         verbose_name = 'Товар'
         verbose_name_plural = "Список товаров"
         ordering = ('-name',)
+        indexes = [
+            models.Index(fields=['category', 'name'], name='product_category_name_idx'),
+            models.Index(fields=['name', 'category'], name='product_name_category_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -172,7 +189,7 @@ class ProductInfo(models.Model):
     product = models.ForeignKey(Product, verbose_name='Товар', related_name='products_info', blank=True,
                                 on_delete=models.CASCADE)
     retailer = models.ForeignKey(Retailer, verbose_name='Продавец', related_name='products_info', blank=True,
-                                 on_delete=models.CASCADE)
+                                 on_delete=models.CASCADE, db_index=False)
     quantity = models.PositiveIntegerField(verbose_name='Количество')
     price = models.PositiveIntegerField(verbose_name='Цена')
     price_rrc = models.PositiveIntegerField(verbose_name='Розничная рекомендуемая цена')
@@ -183,6 +200,9 @@ class ProductInfo(models.Model):
         constraints = [
             models.UniqueConstraint(fields=['product', 'retailer', 'cat_id'], name='unique_product_info'),
         ]
+        indexes = [
+            models.Index(fields=['retailer', 'cat_id'], name='product_info_retailer_idx'),
+        ]
 
     def __str__(self):
         return f'{self.retailer.name}: {self.product.name}\n{self.price}: {self.price_rrc}'
@@ -230,6 +250,172 @@ class ProductParameter(models.Model):
         return f'{self.product_info.model}: {self.parameter.name}'
 
 
+class CatalogEntry(models.Model):
+    """
+    Модель со снимком карточки товара для выдачи каталога CatalogEntry:
+    - связь с моделью, содержащей основную информацию о товарах ProductInfo
+    - связь с моделью продавца Retailer
+    - связь с моделью категории Category
+    - принимает или нет заказы продавец
+    - цена, розничная рекомендуемая цена и количество товара для отбора и сортировки
+    - готовое представление карточки товара с характеристиками
+    - характеристики товара: наименование -> значение
+    - текст для поиска: наименование и модель товара
+    - текст для поиска: категория и значения характеристик
+    - поисковый вектор tsvector, вычисляется базой данных из текстов для поиска
+    - дата обновления снимка
+    """
+    product_info = models.OneToOneField(ProductInfo, verbose_name='Информация о товаре',
+                                        related_name='catalog_entry', primary_key=True,
+                                        on_delete=models.CASCADE)
+    retailer = models.ForeignKey(Retailer, verbose_name='Продавец', related_name='catalog_entries',
+                                 db_index=False, on_delete=models.CASCADE)
+    category = models.ForeignKey(Category, verbose_name='Категория', related_name='catalog_entries',
+                                 db_index=False, on_delete=models.CASCADE)
+    retailer_state = models.BooleanField(verbose_name='Статус получения заказов', default=True)
+    price = models.PositiveIntegerField(verbose_name='Цена', default=0)
+    price_rrc = models.PositiveIntegerField(verbose_name='Розничная рекомендуемая цена', default=0)
+    quantity = models.PositiveIntegerField(verbose_name='Количество', default=0)
+    data = models.JSONField(verbose_name='Карточка товара')
+    parameters = models.JSONField(verbose_name='Характеристики', default=dict)
+    search_title = models.TextField(verbose_name='Наименование и модель', blank=True, default='')
+    search_text = models.TextField(verbose_name='Категория и характеристики', blank=True, default='')
+    search_vector = models.GeneratedField(
+        expression=SearchVector('search_title', weight='A', config=settings.CATALOG_SEARCH_CONFIG)
+        + SearchVector('search_text', weight='C', config=settings.CATALOG_SEARCH_CONFIG),
+        output_field=SearchVectorField(), db_persist=True, verbose_name='Поисковый вектор')
+    updated_at = models.DateTimeField(verbose_name='Дата обновления', auto_now=True)
+
+    class Meta:
+        verbose_name = 'Карточка каталога'
+        verbose_name_plural = "Каталог товаров"
+        ordering = ('product_info',)
+        indexes = [
+            models.Index(fields=['retailer_state', 'product_info'], name='catalog_state_idx'),
+            models.Index(fields=['retailer', 'retailer_state', 'product_info'], name='catalog_retailer_idx'),
+            models.Index(fields=['category', 'retailer_state', 'product_info'], name='catalog_category_idx'),
+            GinIndex(fields=['search_vector'], name='catalog_search_idx'),
+            GinIndex(fields=['parameters'], opclasses=['jsonb_path_ops'], name='catalog_parameters_idx'),
+            models.Index(fields=['price', 'product_info'], condition=models.Q(retailer_state=True),
+                         name='catalog_price_idx'),
+            models.Index(fields=['price_rrc', 'product_info'], condition=models.Q(retailer_state=True),
+                         name='catalog_price_rrc_idx'),
+            models.Index(fields=['category', 'price', 'product_info'], condition=models.Q(retailer_state=True),
+                         name='catalog_category_price_idx'),
+            models.Index(fields=['retailer', 'price', 'product_info'], condition=models.Q(retailer_state=True),
+                         name='catalog_retailer_price_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.product_info_id}: {self.data.get("model", "")}'
+
+
+class CatalogFacet(models.Model):
+    """
+    Модель с числом товаров по значениям характеристик CatalogFacet
+    (пересчитывается при загрузке прайс-листа продавца):
+    - связь с моделью продавца Retailer
+    - связь с моделью категории Category
+    - связь с моделью, описывающей наименования произвольной характеристики товара Parameter
+    - значение характеристики
+    - число товаров продавца в категории с этим значением характеристики
+    """
+    retailer = models.ForeignKey(Retailer, verbose_name='Продавец', related_name='catalog_facets',
+                                 db_index=False, on_delete=models.CASCADE)
+    category = models.ForeignKey(Category, verbose_name='Категория', related_name='catalog_facets',
+                                 db_index=False, on_delete=models.CASCADE)
+    parameter = models.ForeignKey(Parameter, verbose_name='Параметр товара', related_name='catalog_facets',
+                                  db_index=False, on_delete=models.CASCADE)
+    value = models.CharField(verbose_name='Значение параметра', max_length=50)
+    count = models.PositiveIntegerField(verbose_name='Количество товаров')
+
+    class Meta:
+        verbose_name = 'Фасет каталога'
+        verbose_name_plural = "Фасеты каталога"
+        constraints = [
+            models.UniqueConstraint(fields=['retailer', 'category', 'parameter', 'value'],
+                                    name='unique_catalog_facet'),
+        ]
+        indexes = [
+            models.Index(fields=['category', 'retailer'], name='catalog_facet_category_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.parameter_id}: {self.value} ({self.count})'
+
+
+class PriceList(models.Model):
+    """
+    Модель с информацией о последней загрузке прайс-листа продавца PriceList:
+    - связь с моделью продавца Retailer
+    - ссылка на прайс-лист
+    - заголовок ETag ответа сервера продавца
+    - заголовок Last-Modified ответа сервера продавца
+    - хэш SHA-256 содержимого прайс-листа
+    - дата загрузки
+    """
+    retailer = models.OneToOneField(Retailer, verbose_name='Продавец', related_name='price_list',
+                                    on_delete=models.CASCADE)
+    url = models.URLField(verbose_name='Ссылка на прайс-лист', max_length=500)
+    etag = models.CharField(verbose_name='ETag', max_length=255, blank=True)
+    last_modified = models.CharField(verbose_name='Last-Modified', max_length=64, blank=True)
+    sha256 = models.CharField(verbose_name='SHA-256', max_length=64, blank=True)
+    updated_at = models.DateTimeField(verbose_name='Дата загрузки', auto_now=True)
+
+    class Meta:
+        verbose_name = 'Прайс-лист'
+        verbose_name_plural = "Список прайс-листов"
+
+    def __str__(self):
+        return f'{self.retailer}: {self.url}'
+
+
+class ImportJob(models.Model):
+    """
+    Модель с информацией о загрузке прайс-листа ImportJob:
+    - связь с моделью пользователя-продавца User
+    - ссылка на прайс-лист
+    - идентификатор задачи celery
+    - статус загрузки с выбором из списка IMPORT_STATE_CHOICES
+    - количество обработанных, созданных, обновленных и удаленных строк
+    - длительность этапов загрузки, разбора и записи в секундах
+    - текст ошибки или причина пропуска загрузки
+    - даты создания, запуска и завершения загрузки
+    """
+    user = models.ForeignKey(User, verbose_name='Пользователь', related_name='import_jobs',
+                             on_delete=models.CASCADE)
+    url = models.URLField(verbose_name='Ссылка на прайс-лист', max_length=500)
+    task_id = models.CharField(verbose_name='Задача', max_length=255, blank=True)
+    state = models.CharField(verbose_name='Статус', choices=IMPORT_STATE_CHOICES, max_length=15,
+                             default='pending')
+    rows = models.PositiveIntegerField(verbose_name='Обработано строк', default=0)
+    created = models.PositiveIntegerField(verbose_name='Создано строк', default=0)
+    updated = models.PositiveIntegerField(verbose_name='Обновлено строк', default=0)
+    deleted = models.PositiveIntegerField(verbose_name='Удалено строк', default=0)
+    download_time = models.FloatField(verbose_name='Загрузка, с', default=0)
+    parse_time = models.FloatField(verbose_name='Разбор, с', default=0)
+    write_time = models.FloatField(verbose_name='Запись, с', default=0)
+    message = models.TextField(verbose_name='Сообщение', blank=True)
+    created_at = models.DateTimeField(verbose_name='Дата создания', auto_now_add=True)
+    started_at = models.DateTimeField(verbose_name='Дата запуска', null=True, blank=True)
+    finished_at = models.DateTimeField(verbose_name='Дата завершения', null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'Загрузка прайс-листа'
+        verbose_name_plural = "Список загрузок прайс-листов"
+        ordering = ('-created_at',)
+
+    def __str__(self):
+        return f'{self.user}: {self.url} [{self.state}]'
+
+    @property
+    def rows_per_sec(self):
+        if self.started_at is None:
+            return 0
+        elapsed = ((self.finished_at or timezone.now()) - self.started_at).total_seconds()
+        return round(self.rows / elapsed, 1) if elapsed > 0 else 0
+
+
 class Contact(models.Model):
     """
     Модель с контактами пользователей Contact:
@@ -274,20 +460,27 @@ class Order(models.Model):
     - дата заказа
     - статус заказа с выбором из списка STATE_CHOICES
     - связь с моделью содержащей контакты пользователя Contact
+    - сумма заказа и число позиций заказа, пересчитываются при изменении
+      позиций заказа (retail.orders.update_order_totals)
     """
     user = models.ForeignKey(User, verbose_name='Пользователь',
                              related_name='orders', blank=True,
-                             on_delete=models.CASCADE)
+                             on_delete=models.CASCADE, db_index=False)
     date = models.DateTimeField(auto_now_add=True)
     state = models.CharField(verbose_name='Статус', choices=STATE_CHOICES, max_length=15)
     contact = models.ForeignKey(Contact, verbose_name='Контакт',
                                 blank=True, null=True,
                                 on_delete=models.CASCADE)
+    total_sum = models.PositiveBigIntegerField(verbose_name='Сумма заказа', default=0)
+    items_count = models.PositiveIntegerField(verbose_name='Число позиций', default=0)
 
     class Meta:
         verbose_name = 'Заказ'
         verbose_name_plural = "Список заказов"
         ordering = ('-date',)
+        indexes = [
+            models.Index(fields=['user', 'state'], name='order_user_state_idx'),
+        ]
 
     def __str__(self):
         return f'{self.user}: {self.date}'
@@ -305,7 +498,7 @@ class OrderItem(models.Model):
                               on_delete=models.CASCADE)
     product_info = models.ForeignKey(ProductInfo, verbose_name='Информация о продукте',
                                    related_name='ordered_items', blank=True,
-                                   on_delete=models.CASCADE)
+                                   on_delete=models.CASCADE, db_index=False)
     quantity = models.PositiveIntegerField(verbose_name='Количество')
 
     class Meta:
@@ -314,6 +507,9 @@ class OrderItem(models.Model):
         constraints = [
             models.UniqueConstraint(fields=['order', 'product_info'], name='unique_order_item'),
         ]
+        indexes = [
+            models.Index(fields=['product_info', 'order'], name='order_item_product_info_idx'),
+        ]
 
 
 class ConfirmEmailToken(models.Model):
@@ -0,0 +1,18 @@
+from django.db.models import BigIntegerField, Count, F, OuterRef, QuerySet, Subquery, Sum, Value
+from django.db.models.functions import Cast, Coalesce
+
+from retail.models import Order, OrderItem
+
+
+def update_order_totals(orders):
+    """
+    Пересчет суммы и числа позиций заказов одним UPDATE с подзапросами
+    по позициям заказов (произведение в bigint), orders - queryset Order или список id заказов
+    """
+    if not isinstance(orders, QuerySet):
+        orders = Order.objects.filter(id__in=list(orders))
+    items = OrderItem.objects.filter(order_id=OuterRef('pk')).order_by().values('order_id')
+    total_sum = items.annotate(total=Sum(Cast('quantity', BigIntegerField()) * F('product_info__price'))).values('total')
+    items_count = items.annotate(count=Count('id')).values('count')
+    return orders.update(total_sum=Coalesce(Subquery(total_sum), Value(0)),
+                         items_count=Coalesce(Subquery(items_count), Value(0)))
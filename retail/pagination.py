@@ -0,0 +1,153 @@
+import json
+
+from django.db import connections
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination, PageNumberPagination, _reverse_ordering
+from rest_framework.response import Response
+
+
+def estimate_count(queryset):
+    """
+    Оценка числа строк выборки по статистике планировщика PostgreSQL
+    (EXPLAIN без выполнения запроса) вместо точного COUNT(*)
+    """
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Класс: постраничная выдача по курсору (keyset) без OFFSET и COUNT(*)
+    Поля сортировки задаются атрибутом cursor_ordering представления,
+    по умолчанию -pk, последним полем всегда идет первичный ключ, поэтому
+    позиция курсора (значения всех полей сортировки последней строки)
+    уникальна и следующая страница выбирается условием по этим полям,
+    а не смещением среди строк с одинаковым значением первого поля.
+    С параметром count=estimate в ответ добавляется оценка общего
+    числа строк count_estimate по статистике планировщика
+    """
+    ordering = '-pk'
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    count_query_param = 'count'
+
+    def get_ordering(self, request, queryset, view):
+        ordering = getattr(view, 'cursor_ordering', self.ordering)
+        ordering = (ordering,) if isinstance(ordering, str) else tuple(ordering)
+        if not {field.lstrip('-') for field in ordering} & {'pk', queryset.model._meta.pk.name}:
+            ordering += ('-pk' if ordering[-1].startswith('-') else 'pk',)
+        return ordering
+
+    def decode_cursor(self, request):
+        cursor = super().decode_cursor(request)
+        if cursor is None or cursor.position is None:
+            return cursor
+        try:
+            position = json.loads(cursor.position)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return Cursor(offset=0, reverse=cursor.reverse, position=position)
+
+    def position(self, instance):
+        return json.dumps([self._get_position_from_instance(instance, [field]) for field in self.ordering])
+
+    def position_filter(self, position, reverse):
+        """
+        Условие "строка после позиции" для сортировки по нескольким полям:
+        (f1 > v1) OR (f1 = v1 AND f2 > v2) OR ..., направление сравнения
+        каждого поля - по его направлению сортировки и направлению курсора,
+        дополнительное условие по первому полю позволяет использовать индекс
+        """
+        query, equal = Q(), Q()
+        for field, value in zip(self.ordering, position):
+            lookup = 'lt' if field.startswith('-') != reverse else 'gt'
+            query = query | (equal & Q(**{f'{field.lstrip("-")}__{lookup}': value}))
+            equal = equal & Q(**{field.lstrip('-'): value})
+        first = self.ordering[0]
+        lookup = 'lte' if first.startswith('-') != reverse else 'gte'
+        return Q(**{f'{first.lstrip("-")}__{lookup}': position[0]}) & query
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count_estimate = None
+        if request.query_params.get(self.count_query_param) == 'estimate':
+            self.count_estimate = estimate_count(queryset)
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor is not None and self.cursor.reverse
+        position = self.cursor.position if self.cursor is not None else None
+        queryset = queryset.order_by(*(_reverse_ordering(self.ordering) if reverse else self.ordering))
+        if position is not None:
+            queryset = queryset.filter(self.position_filter(position, reverse))
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        has_following = len(results) > len(self.page)
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = position is not None, has_following
+        else:
+            self.has_next, self.has_previous = has_following, position is not None
+        self.display_page_controls = self.has_previous or self.has_next
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        position = self.position(self.page[-1]) if self.page else json.dumps(self.cursor.position)
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=position))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        position = self.position(self.page[0]) if self.page else json.dumps(self.cursor.position)
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=position))
+
+    def get_paginated_response(self, data):
+        response = {'next': self.get_next_link(), 'previous': self.get_previous_link()}
+        if self.count_estimate is not None:
+            response['count_estimate'] = self.count_estimate
+        response['results'] = data
+        return Response(response)
+
+
+class OptionalKeysetPagination(PageNumberPagination):
+    """
+    Класс: постраничная выдача по номеру страницы, по запросу клиента
+    (параметр pagination=cursor или cursor=...) - выдача по курсору KeysetPagination
+    """
+    mode_query_param = 'pagination'
+    keyset_pagination_class = KeysetPagination
+
+    def keyset_requested(self, request):
+        return (request.query_params.get(self.mode_query_param) == 'cursor'
+                or self.keyset_pagination_class.cursor_query_param in request.query_params)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = self.keyset_pagination_class() if self.keyset_requested(request) else None
+        if self.keyset is not None:
+            page = self.keyset.paginate_queryset(queryset, request, view)
+            self.display_page_controls = self.keyset.display_page_controls
+            return page
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def to_html(self):
+        if self.keyset is not None:
+            return self.keyset.to_html()
+        return super().to_html()
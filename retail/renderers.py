@@ -0,0 +1,19 @@
+import ujson
+from rest_framework.renderers import JSONRenderer
+
+
+class UJSONRenderer(JSONRenderer):
+    """
+    Класс: вывод ответов API в формате JSON через ujson,
+    данные с типами, которые ujson не поддерживает (даты, ленивые строки
+    переводов и т. п.), выводятся стандартным JSONRenderer
+    """
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        indent = self.get_indent(accepted_media_type, renderer_context or {})
+        try:
+            return ujson.dumps(data, ensure_ascii=self.ensure_ascii, indent=indent or 0,
+                               escape_forward_slashes=False).encode()
+        except (TypeError, OverflowError):
+            return super().render(data, accepted_media_type, renderer_context)
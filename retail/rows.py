@@ -0,0 +1,100 @@
+from retail.models import Contact, OrderItem, ProductInfo, ProductParameter
+from retail.serializers import ContactViewSerializer
+
+
+CONTACT_FIELDS = tuple(name for name in ContactViewSerializer.Meta.fields if name != 'user')
+ORDER_VALUES = ('id', 'state', 'contact_id', 'total_sum', 'items_count')
+PARTNER_ORDER_VALUES = ('id', 'order_id', 'order__state', 'order__contact_id', 'product_info_id', 'quantity')
+
+
+def product_parameter_rows(product_info_ids):
+    """
+    Характеристики товаров в формате ProductParameterSerializer:
+    словарь id строки ProductInfo -> список характеристик
+    """
+    parameters = {product_info_id: [] for product_info_id in product_info_ids}
+    rows = ProductParameter.objects.filter(product_info_id__in=product_info_ids).order_by('id').values_list(
+        'product_info_id', 'parameter__name', 'value')
+    for product_info_id, name, value in rows:
+        parameters[product_info_id].append({'parameter': name, 'value': value})
+    return parameters
+
+
+def product_info_cards(product_info_ids, *extra):
+    """
+    Карточки товаров в формате ProductInfoViewSerializer без создания
+    моделей и полей сериализатора: пары (карточка, кортеж значений полей extra),
+    два запроса values_list на весь список id
+    """
+    product_info_ids = set(product_info_ids)
+    if not product_info_ids:
+        return
+    parameters = product_parameter_rows(product_info_ids)
+    rows = ProductInfo.objects.filter(id__in=product_info_ids).values_list(
+        'id', 'model', 'cat_id', 'product__name', 'product__category__name',
+        'retailer_id', 'quantity', 'price', 'price_rrc', *extra)
+    for id_, model, cat_id, product, category, retailer_id, quantity, price, price_rrc, *values in rows:
+        yield ({'id': id_, 'model': model, 'cat_id': cat_id,
+                'product': {'name': product, 'category': category},
+                'retailer': retailer_id, 'quantity': quantity, 'price': price, 'price_rrc': price_rrc,
+                'product_parameters': parameters[id_]},
+               tuple(values))
+
+
+def product_info_rows(product_info_ids):
+    """
+    Карточки товаров: словарь id строки ProductInfo -> карточка
+    """
+    return {card['id']: card for card, _ in product_info_cards(product_info_ids)}
+
+
+def contact_rows(contact_ids):
+    """
+    Контакты в формате ContactViewSerializer: словарь id -> контакт
+    """
+    contact_ids = set(contact_ids) - {None}
+    if not contact_ids:
+        return {}
+    return {row['id']: row for row in Contact.objects.filter(id__in=contact_ids).values(*CONTACT_FIELDS)}
+
+
+def order_rows(orders):
+    """
+    Заказы в формате OrderSerializer из словарей values() с ключами
+    ORDER_VALUES: позиции заказов, карточки товаров
+    и контакты загружаются пачкой, по одному-два запроса на каждый вид данных
+    """
+    orders = list(orders)
+    items = {}
+    order_items = OrderItem.objects.filter(order_id__in=[order['id'] for order in orders]).order_by('id').values(
+        'id', 'order_id', 'product_info_id', 'quantity')
+    for row in order_items:
+        items.setdefault(row['order_id'], []).append(row)
+    products = product_info_rows(row['product_info_id'] for rows in items.values() for row in rows)
+    contacts = contact_rows(order['contact_id'] for order in orders)
+    return [{'id': order['id'],
+             'ordered_items': [{'id': row['id'], 'product_info': products[row['product_info_id']],
+                                'quantity': row['quantity']}
+                               for row in items.get(order['id'], [])],
+             'state': order['state'],
+             'contact': contacts.get(order['contact_id']),
+             'total_sum': order['total_sum'],
+             'items_count': order['items_count']}
+            for order in orders]
+
+
+def partner_order_rows(order_items):
+    """
+    Позиции заказов в формате PartnerOrdersSerializer из словарей values()
+    с ключами PARTNER_ORDER_VALUES
+    """
+    order_items = list(order_items)
+    products = product_info_rows(row['product_info_id'] for row in order_items)
+    contacts = contact_rows(row['order__contact_id'] for row in order_items)
+    return [{'order': {'id': row['order_id'], 'state': row['order__state'],
+                       'contact': contacts.get(row['order__contact_id'])},
+             'id': row['id'],
+             'product_info': products[row['product_info_id']],
+             'quantity': row['quantity']}
+            for row in order_items]
+
@@ -1,7 +1,7 @@
 from rest_framework import serializers
 from retail.models import (Contact, User, Category, Retailer,
                            Product, ProductParameter, ProductInfo,
-                           Order, OrderItem)
+                           Order, OrderItem, ImportJob)
 
 
 class ContactViewSerializer(serializers.ModelSerializer):
@@ -69,6 +69,35 @@ class ProductInfoViewSerializer(serializers.ModelSerializer):
         fields = ('id', 'model', 'cat_id', 'product', 'retailer', 'quantity', 'price', 'price_rrc', 'product_parameters',)
         read_only_fields = ('id',)
 
+    expandable_fields = ('product', 'product_parameters')
+
+    @classmethod
+    def select_fields(cls, fields=None, expand=None):
+        """
+        Поля карточки товара по спискам fields и expand: без обоих списков -
+        все поля, иначе - перечисленные в fields (по умолчанию все поля, кроме
+        вложенных) и вложенные из expand. Неизвестные поля - ValueError
+        """
+        if fields is None and expand is None:
+            return cls.Meta.fields
+        if fields is None:
+            fields = [name for name in cls.Meta.fields if name not in cls.expandable_fields]
+        expand = expand or []
+        unknown = [name for name in fields if name not in cls.Meta.fields]
+        unknown += [name for name in expand if name not in cls.expandable_fields]
+        if unknown:
+            raise ValueError(', '.join(unknown))
+        return tuple(name for name in cls.Meta.fields if name in fields or name in expand)
+
+
+class CatalogEntrySerializer(serializers.BaseSerializer):
+    """
+    Выдача готовой карточки товара из снимка каталога,
+    при выборе полей - урезанной в базе данных карточки card
+    """
+    def to_representation(self, instance):
+        return instance.card if hasattr(instance, 'card') else instance.data
+
 
 class OrderItemSerializer(serializers.ModelSerializer):
     class Meta:
@@ -90,7 +119,7 @@ class OrderSerializer(serializers.ModelSerializer):
     contact = ContactViewSerializer(read_only=True)
     class Meta:
         model = Order
-        fields = ('id', 'ordered_items', 'state', 'contact', 'total_sum')
+        fields = ('id', 'ordered_items', 'state', 'contact', 'total_sum', 'items_count')
         read_only_fields = ('id',)
 
 
@@ -116,4 +145,14 @@ class PartnerOrdersSerializer(serializers.ModelSerializer):
     class Meta:
         model = OrderItem
         fields = ('order', 'id', 'product_info', 'quantity')
-        read_only_fields = ('id', )
\ No newline at end of file
+        read_only_fields = ('id', )
+
+
+class ImportJobSerializer(serializers.ModelSerializer):
+    rows_per_sec = serializers.ReadOnlyField()
+    class Meta:
+        model = ImportJob
+        fields = ('id', 'url', 'state', 'rows', 'created', 'updated', 'deleted', 'rows_per_sec',
+                  'download_time', 'parse_time', 'write_time', 'message',
+                  'created_at', 'started_at', 'finished_at')
+        read_only_fields = fields
@@ -1,7 +1,15 @@
+import threading
+
 from django.conf import settings
 from django.core.mail import EmailMultiAlternatives
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import Signal, receiver
-from retail.models import ConfirmEmailToken, User
+from retail.cache import REFERENCE_CACHES, bump_catalog_version
+from retail.catalog import refresh_catalog, refresh_retailer_state
+from retail.models import (ConfirmEmailToken, User, Retailer, Category,
+                           Product, ProductInfo, Parameter, Order, OrderItem)
+from retail.orders import update_order_totals
 
 
 new_user_registered = Signal()
@@ -48,3 +56,115 @@ def new_order_signal(user_id, **kwargs):
         from_email=settings.EMAIL_HOST_USER,
         to=[user.email])
     message.send()
+
+
+def reference_changed_signal(sender, instance, **kwargs):
+    """
+    Сбрасываем кэш справочных данных при изменении продавца, категории
+    или характеристики: сразу и повторно после фиксации транзакции,
+    чтобы другие процессы не закэшировали незафиксированное состояние.
+    Удаление продавца, категории или характеристики меняет версию
+    общих данных каталога
+    """
+    reference = REFERENCE_CACHES[sender]
+    reference.invalidate()
+    transaction.on_commit(reference.invalidate)
+    if kwargs.get('signal') is post_delete:
+        bump_catalog_version([instance.id] if sender is Retailer else [], shared=True)
+
+
+for reference_model in REFERENCE_CACHES:
+    post_save.connect(reference_changed_signal, sender=reference_model)
+    post_delete.connect(reference_changed_signal, sender=reference_model)
+
+
+@receiver(post_save, sender=ProductInfo)
+def product_info_saved_signal(instance, **kwargs):
+    """
+    Пересобираем снимок каталога сохраненной строки ProductInfo
+    (удаление снимка выполняется каскадом) и суммы корзин с этим товаром
+    """
+    refresh_catalog([instance.id])
+    update_order_totals(Order.objects.filter(state='basket', ordered_items__product_info_id=instance.id))
+
+
+@receiver(post_save, sender=OrderItem)
+def order_item_saved_signal(instance, **kwargs):
+    """
+    Пересчитываем сумму и число позиций заказа после сохранения позиции
+    (пакетные изменения позиций пересчитывают суммы явно)
+    """
+    update_order_totals([instance.order_id])
+
+
+deleted_order_items = threading.local()
+
+
+def update_pending_baskets():
+    """
+    Пересчет сумм корзин, позиции которых удалены в зафиксированной транзакции
+    """
+    orders, deleted_order_items.orders = getattr(deleted_order_items, 'orders', set()), set()
+    if orders:
+        update_order_totals(Order.objects.filter(id__in=orders, state='basket'))
+
+
+@receiver(post_delete, sender=OrderItem)
+def order_item_deleted_signal(instance, **kwargs):
+    """
+    Пересчитываем суммы корзин после удаления позиций, в том числе каскадом
+    при удалении товара, категории, продавца или строки ProductInfo:
+    номера заказов копятся до фиксации транзакции и пересчитываются одним UPDATE
+    (первый обработчик on_commit забирает все номера, остальные ничего не делают)
+    """
+    if not hasattr(deleted_order_items, 'orders'):
+        deleted_order_items.orders = set()
+    deleted_order_items.orders.add(instance.order_id)
+    transaction.on_commit(update_pending_baskets)
+
+
+@receiver(post_save, sender=Product)
+def product_saved_signal(instance, created, **kwargs):
+    """
+    Пересобираем снимки каталога товара после смены наименования или категории,
+    версия общих данных каталога меняется для прежней категории товара
+    """
+    if not created:
+        refresh_catalog(product_id=instance.id)
+        bump_catalog_version(shared=True)
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted_signal(**kwargs):
+    """
+    Меняем версию общих данных каталога после удаления товара
+    (снимки каталога удаляются каскадом)
+    """
+    bump_catalog_version(shared=True)
+
+
+@receiver(post_save, sender=Category)
+def category_saved_signal(instance, created, **kwargs):
+    """
+    Пересобираем снимки каталога товаров категории после смены наименования
+    """
+    if not created:
+        refresh_catalog(product__category_id=instance.id)
+
+
+@receiver(post_save, sender=Parameter)
+def parameter_saved_signal(instance, created, **kwargs):
+    """
+    Пересобираем снимки каталога товаров с переименованной характеристикой
+    """
+    if not created:
+        refresh_catalog(product_parameters__parameter_id=instance.id)
+
+
+@receiver(post_save, sender=Retailer)
+def retailer_saved_signal(instance, created, **kwargs):
+    """
+    Переносим статус получения заказов продавца в снимки каталога
+    """
+    if not created:
+        refresh_retailer_state(id=instance.id)
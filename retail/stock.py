@@ -0,0 +1,61 @@
+from django.db import transaction
+from django.db.models import Case, F, PositiveIntegerField, Q, Value, When
+
+from retail.catalog import refresh_catalog
+from retail.models import Order, OrderItem, ProductInfo
+from retail.orders import update_order_totals
+
+
+class OutOfStock(Exception):
+    """
+    Исключение: товара на складе меньше, чем в заказе,
+    shortages - словарь id строки ProductInfo -> {requested, available}
+    """
+    def __init__(self, shortages):
+        self.shortages = shortages
+        super().__init__(f'Not enough stock for product_info {", ".join(map(str, shortages))}')
+
+
+def reserve_stock(order_id):
+    """
+    Резервирование остатков товаров заказа, выполняется в транзакции:
+    строки ProductInfo блокируются одним SELECT ... FOR UPDATE по возрастанию id
+    (единый порядок блокировок исключает взаимные блокировки встречных заказов),
+    остатки уменьшаются одним UPDATE с условием quantity >= количества в заказе
+    для каждой строки. При нехватке товара - исключение OutOfStock
+    """
+    items = dict(OrderItem.objects.filter(order_id=order_id).values_list('product_info_id', 'quantity'))
+    if not items:
+        return []
+    ids = sorted(items)
+    stock = dict(ProductInfo.objects.filter(id__in=ids).order_by('id').select_for_update().values_list(
+        'id', 'quantity'))
+    shortages = {id_: {'requested': items[id_], 'available': stock.get(id_, 0)}
+                 for id_ in ids if stock.get(id_, 0) < items[id_]}
+    if shortages:
+        raise OutOfStock(shortages)
+    condition = Q()
+    for id_ in ids:
+        condition |= Q(id=id_, quantity__gte=items[id_])
+    reserved = Case(*(When(id=id_, then=Value(items[id_])) for id_ in ids), output_field=PositiveIntegerField())
+    if ProductInfo.objects.filter(condition).update(quantity=F('quantity') - reserved) != len(ids):
+        raise OutOfStock({id_: {'requested': items[id_], 'available': None} for id_ in ids})
+    transaction.on_commit(lambda: refresh_catalog(ids))
+    return ids
+
+
+def place_order(user_id, order_id, contact_id):
+    """
+    Оформление корзины в заказ с резервированием остатков и фиксацией
+    суммы заказа по текущим ценам в одной транзакции:
+    False - заказ уже оформлен ранее (повторный запрос не резервирует товар
+    повторно), True - корзина оформлена, при нехватке товара - OutOfStock
+    """
+    with transaction.atomic():
+        order = Order.objects.select_for_update().filter(user_id=user_id, id=order_id).only('state').first()
+        if order is None or order.state != 'basket':
+            return False
+        reserve_stock(order_id)
+        update_order_totals([order_id])
+        Order.objects.filter(id=order_id).update(contact_id=contact_id, state='new')
+    return True
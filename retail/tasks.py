@@ -1,14 +1,24 @@
+import time
+import uuid
+from functools import lru_cache
+
+import redis
 import requests
-import yaml
+from celery import chord, group
 from django.conf import settings
 from django.core.mail import EmailMultiAlternatives
 from django.core.validators import URLValidator
 from django.core.exceptions import ValidationError
 from django.db import IntegrityError
+from django.db.models import F
+from django.utils import timezone
+from kombu.utils.json import dumps, loads
 
 
-from retail.models import (Retailer, Category, Product, Parameter,
-                           ProductParameter, ProductInfo)
+from retail.basket import persist_baskets
+from retail.importer import (PriceListError, PriceListImporter, chunked, detect_format,
+                             download_price_list, open_price_list)
+from retail.models import ImportJob, PriceList, Retailer
 from diplom.celery import celery_app
 
 
@@ -29,54 +39,223 @@ def send_email(title, message, email, *args, **kwargs):
 
 
 @celery_app.task()
-def get_import(partner, url):
-    print(f'{url=}, {partner=}')
+def snapshot_baskets():
+    """
+    Периодическое сохранение измененных корзин из Redis в базу данных
+    """
+    return persist_baskets()
+
+
+@celery_app.task()
+def get_import(partner, url, batch_size=None, sync=None, parallel=None, job_id=None,
+               price_list_format=None):
+    update_job(job_id, state='download', started_at=timezone.now())
+    try:
+        result = run_import(partner, url, batch_size, sync, parallel, job_id, price_list_format)
+    except Exception as e:
+        fail_job(job_id, str(e))
+        raise
+    if not result.get('Parallel'):
+        finish_job(job_id, result)
+    return result
+
+
+def run_import(partner, url, batch_size, sync, parallel, job_id, price_list_format):
     if url:
         validate_url = URLValidator()
         try:
             validate_url(url)
         except ValidationError as e:
             return {'Status': False, 'Error': str(e)}
-        else:
-            print(f'{url=}, {partner=}')
-            stream_url = requests.get(url)
-            print(f'{stream_url=}')
-            stream=stream_url.content
-            print(f'{stream=}')
-
-        data = yaml.load(stream, Loader=yaml.Loader)
-        print(f'{data=}')
+        last_import = PriceList.objects.filter(retailer__user_id=partner, url=url).first()
+        started = time.monotonic()
         try:
-            print(f'{data['retailer']=}')
-            print(f'{partner=}')
-            retailer, created = Retailer.objects.get_or_create(
-                name=data['retailer'],
-                user_id=partner)
-        except IntegrityError as e:
+            download = download_price_list(url, last_import)
+        except requests.RequestException as e:
             return {'Status': False, 'Error': str(e)}
+        update_job(job_id, state='import', download_time=time.monotonic() - started)
+        if download is None:
+            return {'Status': True, 'Skipped': True, 'Reason': 'Price list is not modified (HTTP 304)'}
+
+        price_list_file, fetch_info, content_type = download
+        with price_list_file:
+            if last_import is not None and last_import.sha256 == fetch_info['sha256']:
+                PriceList.objects.filter(id=last_import.id).update(**fetch_info)
+                return {'Status': True, 'Skipped': True, 'Reason': 'Price list content is unchanged'}
+            try:
+                price_list = open_price_list(price_list_file,
+                                             price_list_format or detect_format(url, content_type))
+            except PriceListError as e:
+                return {'Status': False, 'Error': str(e)}
+            parallel = settings.IMPORT_PARALLEL if parallel is None else parallel
+            importer = PriceListImporter(partner, batch_size, True if parallel else sync,
+                                         progress=job_progress(job_id))
+            try:
+                importer.prepare(price_list)
+            except IntegrityError as e:
+                return {'Status': False, 'Error': str(e)}
 
-        for category in data['categories']:
-            category_object, created = Category.objects.get_or_create(
-                id=category['id'],
-                name=category['name'])
-            category_object.retailers.add(retailer.id)
-            category_object.save()
-
-        ProductInfo.objects.filter(retailer_id=retailer.id).delete()
-        for item in data['goods']:
-            product, created = Product.objects.get_or_create(
-                name=item['name'],
-                category_id=item['category'])
-            product_info = ProductInfo.objects.create(
-                product_id=product.id, cat_id=item['id'],
-                model=item['model'], price=item['price'],
-                price_rrc=item['price_rrc'], quantity=item['quantity'],
-                retailer_id=retailer.id)
-            for name, value in item['parameters'].items():
-                parameter_object, created = Parameter.objects.get_or_create(name=name)
-                ProductParameter.objects.create(
-                    product_info_id=product_info.id,
-                    parameter_id=parameter_object.id,
-                    value=value)
-        return {'Status': True}
+            if parallel:
+                try:
+                    return dispatch_import(importer, price_list.goods(), url, fetch_info, job_id)
+                except PriceListError as e:
+                    return {'Status': False, 'Error': str(e)}
+            try:
+                importer.import_goods(price_list.goods())
+            except PriceListError as e:
+                return {'Status': False, 'Error': str(e), **importer.stats}
+            importer.finish()
+        PriceList.objects.update_or_create(retailer=importer.retailer,
+                                           defaults={'url': url, **fetch_info})
+        return {'Status': True, **importer.stats}
     return {'Status': False, 'Errors': 'Url is false'}
+
+
+def dispatch_import(importer, goods, url, fetch_info, job_id):
+    """
+    Параллельная загрузка товаров: координатор читает товары пачками
+    по IMPORT_PARALLEL_CHUNK_SIZE, создает недостающие товары и характеристики
+    (общие для всех пачек строки записываются до запуска задач) и отбрасывает
+    повторы ключа строки каталога (товар, каталожный номер) - каждую строку
+    ProductInfo и ее характеристики записывает только одна задача, поэтому
+    upsert параллельных задач не конфликтуют (при повторе товара в прайс-листе
+    загружается его первое вхождение). Пачка сохраняется в Redis
+    (IMPORT_STAGING_REDIS_URL), задаче передается только ключ пачки.
+    Независимые задачи import_goods_chunk выполняются группой celery,
+    итоговая задача finish_import собирает id записанных строк из результатов
+    пачек, удаляет устаревшие строки каталога и подводит итоги.
+    Параллельная загрузка всегда выполняется в режиме sync: каталог продавца
+    не очищается до запуска задач, строки, отсутствующие в прайс-листе,
+    удаляются только в finish_import.
+    При ошибке любой пачки или итоговой задачи обработчик import_failed
+    отмечает загрузку неудавшейся, PriceList при этом не обновляется
+    """
+    prefix = f'retail:import:{uuid.uuid4().hex}'
+    keys = set()
+    tasks = []
+    for chunk in chunked(goods, settings.IMPORT_PARALLEL_CHUNK_SIZE):
+        products = importer.resolve_products(chunk)
+        importer.resolve_parameters(chunk)
+        unique = []
+        for item in chunk:
+            key = (products[(item['name'], item['category'])], item['id'])
+            if key not in keys:
+                keys.add(key)
+                unique.append(item)
+        if not unique:
+            continue
+        parameters = {name: importer.parameters[name]
+                      for name in {name for item in unique for name in item.get('parameters', {})}}
+        reference = stage_chunk(f'{prefix}:{len(tasks)}', unique)
+        task = import_goods_chunk.si(reference, importer.partner, importer.retailer.id, parameters,
+                                     importer.sync, job_id)
+        tasks.append(task.on_error(import_failed.s(job_id)))
+    body = finish_import.s(importer.partner, importer.retailer.id, url,
+                           importer.sync, fetch_info, importer.result(), job_id)
+    result = chord(group(tasks))(body.on_error(import_failed.s(job_id)))
+    return {'Status': True, 'Parallel': True, 'Chunks': len(tasks), 'Task': result.id}
+
+
+@lru_cache
+def import_staging_redis():
+    return redis.Redis.from_url(settings.IMPORT_STAGING_REDIS_URL)
+
+
+def stage_chunk(key, chunk):
+    """
+    Сохранение пачки товаров в Redis на IMPORT_STAGING_TIMEOUT секунд
+    """
+    import_staging_redis().set(key, dumps(chunk), ex=settings.IMPORT_STAGING_TIMEOUT)
+    return key
+
+
+def load_chunk(key):
+    data = import_staging_redis().get(key)
+    if data is None:
+        raise PriceListError(f'Staged price list chunk {key} is missing or expired')
+    return loads(data)
+
+
+@celery_app.task()
+def import_goods_chunk(reference, partner, retailer_id, parameters, sync, job_id=None):
+    """
+    Загрузка сохраненной в Redis пачки товаров, пачка удаляется после записи
+    """
+    chunk = load_chunk(reference)
+    importer = PriceListImporter(partner, len(chunk), sync)
+    importer.retailer = Retailer.objects.get(id=retailer_id)
+    importer.parameters = parameters
+    importer.import_goods(chunk)
+    update_job(job_id, rows=F('rows') + importer.rows,
+               parse_time=F('parse_time') + importer.timings['parse'],
+               write_time=F('write_time') + importer.timings['write'])
+    import_staging_redis().delete(reference)
+    return importer.result()
+
+
+@celery_app.task()
+def finish_import(results, partner, retailer_id, url, sync, fetch_info, coordinator_result, job_id=None):
+    importer = PriceListImporter(partner, sync=sync)
+    importer.retailer = Retailer.objects.get(id=retailer_id)
+    importer.merge_result(coordinator_result)
+    for result in results:
+        importer.merge_result(result)
+    importer.finish()
+    PriceList.objects.update_or_create(retailer=importer.retailer,
+                                       defaults={'url': url, **fetch_info})
+    result = {'Status': True, **importer.stats}
+    finish_job(job_id, result, importer)
+    return result
+
+
+@celery_app.task()
+def import_failed(request, exc, traceback, job_id=None):
+    """
+    Обработчик ошибки пачки товаров или итоговой задачи параллельной загрузки:
+    загрузка отмечается неудавшейся с текстом первой ошибки
+    """
+    fail_job(job_id, f'{type(exc).__name__}: {exc}')
+
+
+def update_job(job_id, **fields):
+    """
+    Обновление записи ImportJob, если загрузка запущена с отслеживанием
+    """
+    if job_id is not None:
+        ImportJob.objects.filter(id=job_id).update(**fields)
+
+
+def fail_job(job_id, message):
+    """
+    Отметка загрузки неудавшейся, сохраняется текст первой ошибки
+    """
+    if job_id is not None:
+        ImportJob.objects.filter(id=job_id).exclude(state='failed').update(
+            state='failed', message=message, finished_at=timezone.now())
+
+
+def job_progress(job_id):
+    """
+    Обработчик, переносящий счетчики загрузчика в ImportJob после каждой пачки товаров
+    """
+    def progress(importer, rows):
+        update_job(job_id, rows=importer.rows, created=importer.created,
+                   updated=importer.updated, deleted=importer.deleted,
+                   parse_time=importer.timings['parse'],
+                   write_time=importer.timings['write'])
+    return progress
+
+
+def finish_job(job_id, result, importer=None):
+    fields = {'finished_at': timezone.now()}
+    if not result['Status']:
+        fields.update(state='failed', message=result.get('Error') or result.get('Errors', ''))
+    elif result.get('Skipped'):
+        fields.update(state='skipped', message=result['Reason'])
+    else:
+        fields.update(state='finished', rows=result['Objects imported'],
+                      created=result['Objects created'], updated=result['Objects updated'],
+                      deleted=result['Objects deleted'])
+    if importer is not None:
+        fields.update(parse_time=importer.timings['parse'], write_time=importer.timings['write'])
+    update_job(job_id, **fields)
@@ -14,6 +14,7 @@ app_name = 'retail'
 urlpatterns = r.urls
 urlpatterns += [
     path('partner/update/', PartnerUpdate.as_view(), name='partner-update'),
+    path('partner/update/<int:job_id>/', PartnerUpdate.as_view(), name='partner-update-status'),
     path('partner/state/', PartnerState.as_view(), name='partner-state'),
     path('partner/orders/', PartnerOrders.as_view(), name='partner-orders'),
     path('user/register/', RegisterUser.as_view(), name='user-register'),
@@ -1,23 +1,41 @@
-import json
+import hashlib
+import re
 from django.contrib.auth import authenticate
 from django.contrib.auth.password_validation import validate_password
 from django.db import IntegrityError
-from django.db.models import Q, Sum, F
-from django.http import JsonResponse
+from django.db.models import Q
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
 from rest_framework import status
 from rest_framework.authtoken.models import Token
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.generics import ListAPIView
+from rest_framework.renderers import BrowsableAPIRenderer
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from ujson import loads as load_json
 from rest_framework.viewsets import ModelViewSet
-from retail.models import (Retailer, Category, ProductInfo, Order,
-                           OrderItem, Contact, ConfirmEmailToken)
+from retail.basket import get_basket
+from retail.cache import (retailer_cache, category_cache, catalog_version_key,
+                          get_versions, CATALOG_SHARED_VERSION_KEY)
+from retail.catalog import (refresh_retailer_state, search_catalog, filter_parameters, catalog_facets,
+                            filtered_facets, catalog_cards, export_catalog)
+from retail.pagination import OptionalKeysetPagination
+from retail.renderers import UJSONRenderer
+from retail.stock import place_order, OutOfStock
+from retail.rows import order_rows, partner_order_rows, ORDER_VALUES, PARTNER_ORDER_VALUES
+from retail.models import (Retailer, Category, Order,
+                           OrderItem, Contact, ConfirmEmailToken, ImportJob,
+                           CatalogEntry)
 from retail.serializers import (RegisterUserSerializer, UserDetailsSerializer,
                                 CategoryViewSerializer, RetailerViewSerializer,
-                                BasketViewSerializer, OrderItemSerializer,
-                                ProductInfoViewSerializer, PartnerOrdersSerializer,
-                                ContactViewSerializer, OrderViewSerializer)
+                                ContactViewSerializer,
+                                ImportJobSerializer, CatalogEntrySerializer,
+                                ProductInfoViewSerializer)
 from retail.tasks import send_email, get_import
 from django_rest_passwordreset.signals import reset_password_token_created
 from django.dispatch import receiver
@@ -147,183 +165,352 @@ class UserDetails(APIView):
                                 status=status.HTTP_400_BAD_REQUEST)
 
 
-class CategoryView(ListAPIView):
+class CatalogResponse(Exception):
+    """
+    Готовый ответ каталога (304 или ответ из кэша), прерывающий
+    обработку запроса после аутентификации и проверки частоты запросов
+    """
+    def __init__(self, response):
+        self.response = response
+
+
+class CatalogVersionMixin:
+    """
+    Класс: условные ответы и кэш ответов GET по версиям (тегам) каталога
+    Теги ответа (version_keys) - версии каталога продавца, категории
+    или всего каталога, они меняются при загрузке прайс-листов и правках
+    каталога. ETag строится из адреса запроса, согласованного формата ответа
+    и версий тегов (Last-Modified не отдается: точность HTTP-даты в секунду
+    не различает смены версий в пределах одной секунды).
+    Проверка выполняется в initial() после аутентификации, проверки прав
+    и ограничения частоты запросов:
+    - совпадение If-None-Match возвращает 304 после одного запроса к кэшу
+      без обращения к базе данных
+    - иначе ответ берется из кэша по ключу ETag или формируется и сохраняется
+      в кэш на CATALOG_RESPONSE_CACHE_TIMEOUT секунд, смена версии любого
+      тега делает прежние записи недоступными
+    Прочитанные версии сохраняются в catalog_versions, тело ответа должно
+    строиться по тем же версиям, что и ETag.
+    Подходит только для общедоступных ответов, одинаковых для всех пользователей
+    """
+    catalog_digest = None
+    catalog_versions = None
+
+    def version_keys(self, request, *args, **kwargs):
+        raise NotImplementedError
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.catalog_digest = None
+        self.catalog_versions = None
+        if request.method not in ('GET', 'HEAD'):
+            return
+        versions = self.catalog_versions = get_versions(self.version_keys(request, *args, **kwargs))
+        fingerprint = repr((request.get_full_path(), request.accepted_media_type, sorted(versions.items())))
+        self.catalog_digest = hashlib.sha1(fingerprint.encode()).hexdigest()
+        response = get_conditional_response(request, etag=quote_etag(self.catalog_digest))
+        if response is None:
+            cached = cache.get(f'retail:response:{self.catalog_digest}')
+            if cached is not None:
+                content, content_type = cached
+                response = HttpResponse(content, content_type=content_type)
+        if response is not None:
+            raise CatalogResponse(response)
+
+    def handle_exception(self, exc):
+        if isinstance(exc, CatalogResponse):
+            return exc.response
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        """
+        ETag для ответов 200 и 304, в кэш сохраняются только сформированные
+        ответы JSON с кодом 200 (страницы Browsable API содержат данные пользователя)
+        """
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if self.catalog_digest is None or response.status_code not in (status.HTTP_200_OK,
+                                                                       status.HTTP_304_NOT_MODIFIED):
+            return response
+        if (isinstance(response, Response)
+                and getattr(response, 'accepted_media_type', '').startswith('application/json')):
+            response.render()
+            cache.set(f'retail:response:{self.catalog_digest}', (response.content, response['Content-Type']),
+                      timeout=settings.CATALOG_RESPONSE_CACHE_TIMEOUT)
+        response.headers['ETag'] = quote_etag(self.catalog_digest)
+        return response
+
+
+class CategoryView(CatalogVersionMixin, ListAPIView):
     """
     Класс: просмотр списка категорий
     """
     queryset = Category.objects.all()
     serializer_class = CategoryViewSerializer
 
+    def version_keys(self, request, *args, **kwargs):
+        return [category_cache.version_key]
+
+    def get_queryset(self):
+        if self.catalog_versions is not None:
+            category_cache.sync(self.catalog_versions[category_cache.version_key])
+        categories = category_cache.all()
+        return self.queryset.all() if categories is None else categories
 
-class RetailerView(ListAPIView):
+
+class RetailerView(CatalogVersionMixin, ListAPIView):
     """
     Класс: просмотр списка продавцов
     """
     queryset = Retailer.objects.filter(state=True)
     serializer_class = RetailerViewSerializer
 
+    def version_keys(self, request, *args, **kwargs):
+        return [retailer_cache.version_key]
 
-class ProductInfoView(ModelViewSet):
+    def get_queryset(self):
+        if self.catalog_versions is not None:
+            retailer_cache.sync(self.catalog_versions[retailer_cache.version_key])
+        retailers = retailer_cache.all()
+        if retailers is None:
+            return self.queryset.all()
+        return [retailer for retailer in retailers if retailer.state]
+
+
+class ProductInfoView(CatalogVersionMixin, ModelViewSet):
     """
     Класс: поиск товаров
+    Карточки товаров выдаются из снимков каталога CatalogEntry,
+    с параметром pagination=cursor - постранично по курсору,
+    с параметром q - результаты поиска по релевантности (только
+    с постраничной выдачей по номеру страницы),
+    с параметрами param[<наименование>]=<значение> - отбор по характеристикам,
+    с параметром facets=true - число товаров по значениям характеристик
+    с отбором запроса (для значений характеристики из param[] - без ее
+    собственного условия),
+    с параметрами min_price, max_price, in_stock=true - отбор по цене и наличию,
+    с параметром ordering=price|-price|price_rrc - сортировка по цене
+    (частичные индексы по ценам товаров продавцов, принимающих заказы),
+    с параметрами fields=<поле>,... и expand=product,product_parameters -
+    только перечисленные поля карточки, вложенные товар и характеристики
+    выдаются только при указании в fields или expand,
+    /products/export/?type=ndjson|csv - потоковая выгрузка всех карточек
+    с теми же параметрами отбора без постраничной выдачи
     """
-    serializer_class = ProductInfoViewSerializer
+    serializer_class = CatalogEntrySerializer
+    renderer_classes = (UJSONRenderer, BrowsableAPIRenderer)
     http_method_names = ['get', ]
-
-    def get_queryset(self):
-        query = Q(retailer__state=True)
-        retailer_id = self.request.query_params.get('retailer_id', None)
-        category_id = self.request.query_params.get('category_id', None)
+    pagination_class = OptionalKeysetPagination
+    orderings = {
+        'price': ('price', 'pk'),
+        '-price': ('-price', '-pk'),
+        'price_rrc': ('price_rrc', 'pk'),
+    }
+
+    def version_keys(self, request, *args, **kwargs):
+        retailer_id, category_id = self.catalog_filters()
+        if 'pk' in kwargs or retailer_id is None and category_id is None:
+            return [catalog_version_key()]
+        return [catalog_version_key(retailer_id, category_id), CATALOG_SHARED_VERSION_KEY]
+
+    @property
+    def cursor_ordering(self):
+        return self.orderings.get(self.request.query_params.get('ordering'), 'pk')
+
+    def catalog_filters(self):
+        """
+        Продавец и категория запроса (retailer_id, category_id) числами,
+        по ним же строятся теги ответа
+        """
+        values = []
+        for param in ('retailer_id', 'category_id'):
+            value = self.request.query_params.get(param, None)
+            if value is not None:
+                try:
+                    value = int(value)
+                except ValueError:
+                    raise ValidationError({'Status': False,
+                                           'Errors': f'Invalid value for <{param}> request parameter'})
+            values.append(value)
+        return tuple(values)
+
+    def catalog_queryset(self):
+        """
+        Снимки каталога с отбором запроса по продавцу, категории, цене,
+        наличию и поиску (без отбора по характеристикам)
+        """
+        query = Q(retailer_state=True)
+        retailer_id, category_id = self.catalog_filters()
         if retailer_id is not None:
             query = query & Q(retailer_id=retailer_id)
         if category_id is not None:
-            query = query & Q(product__category_id=category_id)
-        queryset = ProductInfo.objects.filter(query).select_related(
-            'retailer', 'product__category').prefetch_related(
-            'product_parameters__parameter').distinct()
+            query = query & Q(category_id=category_id)
+        query = query & self.price_filters()
+        queryset = CatalogEntry.objects.filter(query)
+        search = self.request.query_params.get('q', '').strip()
+        if search:
+            queryset = search_catalog(queryset, search)
         return queryset
 
+    def get_queryset(self):
+        queryset = self.catalog_queryset().only('product_info', 'price', 'price_rrc', 'data')
+        fields = self.selected_fields()
+        if fields is not None:
+            queryset = catalog_cards(queryset, fields)
+        parameters = self.parameter_filters()
+        if parameters:
+            queryset = filter_parameters(queryset, parameters)
+        ordering = self.request.query_params.get('ordering', None)
+        if ordering is not None:
+            if ordering not in self.orderings:
+                raise ValidationError({'Status': False,
+                                       'Errors': f'Invalid value for <ordering> request parameter, '
+                                                 f'expected one of: {", ".join(self.orderings)}'})
+            queryset = queryset.order_by(*self.orderings[ordering])
+        return queryset
+
+    def price_filters(self):
+        query = Q()
+        for param, lookup in (('min_price', 'price__gte'), ('max_price', 'price__lte')):
+            value = self.request.query_params.get(param, None)
+            if value is not None:
+                try:
+                    query = query & Q(**{lookup: int(value)})
+                except ValueError:
+                    raise ValidationError({'Status': False,
+                                           'Errors': f'Invalid value for <{param}> request parameter'})
+        if strtobool(self.request.query_params.get('in_stock', 'false')):
+            query = query & Q(quantity__gt=0)
+        return query
+
+    def selected_fields(self):
+        lists = {}
+        for param in ('fields', 'expand'):
+            value = self.request.query_params.get(param, None)
+            if value is not None:
+                lists[param] = [name.strip() for name in value.split(',') if name.strip()]
+        if not lists:
+            return None
+        try:
+            return ProductInfoViewSerializer.select_fields(**lists)
+        except ValueError as error:
+            raise ValidationError({'Status': False,
+                                   'Errors': f'Unknown fields in <fields> or <expand> request parameters: {error}'})
+
+    def parameter_filters(self):
+        parameters = {}
+        for key in self.request.query_params:
+            match = re.fullmatch(r'param\[(.+)\]', key)
+            if match:
+                parameters[match.group(1)] = self.request.query_params.getlist(key)
+        return parameters
+
+    export_types = {
+        'ndjson': 'application/x-ndjson; charset=utf-8',
+        'csv': 'text/csv; charset=utf-8',
+    }
+
+    @action(detail=False)
+    def export(self, request, *args, **kwargs):
+        """
+        Потоковая выгрузка карточек товаров: строки читаются курсором
+        на стороне сервера базы данных пачками по CATALOG_EXPORT_CHUNK_SIZE
+        и сразу отправляются клиенту, память не зависит от числа строк
+        """
+        export_type = request.query_params.get('type', 'ndjson')
+        if export_type not in self.export_types:
+            return JsonResponse({'Status': False,
+                                 'Errors': f'Invalid value for <type> request parameter, '
+                                           f'expected one of: {", ".join(self.export_types)}'},
+                                status=status.HTTP_400_BAD_REQUEST)
+        queryset = self.get_queryset()
+        fields = self.selected_fields()
+        if not queryset.ordered:
+            queryset = queryset.order_by('pk')
+        column = 'data' if fields is None or 'card' not in queryset.query.annotations else 'card'
+        cards = queryset.values_list(column, flat=True).iterator(chunk_size=settings.CATALOG_EXPORT_CHUNK_SIZE)
+        response = StreamingHttpResponse(export_catalog(cards, export_type, fields),
+                                         content_type=self.export_types[export_type])
+        response['Content-Disposition'] = f'attachment; filename="catalog.{export_type}"'
+        return response
+
+    def list(self, request, *args, **kwargs):
+        if request.query_params.get('q', '').strip() and self.paginator.keyset_requested(request):
+            raise ValidationError({'Status': False,
+                                   'Errors': 'Request parameter <q> is not supported with cursor pagination, '
+                                             'search results are ordered by relevance'})
+        response = super().list(request, *args, **kwargs)
+        if strtobool(request.query_params.get('facets', 'false')):
+            parameters = self.parameter_filters()
+            if parameters or self.price_filters() or request.query_params.get('q', '').strip():
+                response.data['facets'] = filtered_facets(self.catalog_queryset(), parameters)
+            else:
+                response.data['facets'] = catalog_facets(*self.catalog_filters())
+        return response
+
 
 class BasketView(APIView):
     """
     Класс: обработка корзины
+    Добавление, изменение и удаление позиций выполняется пачкой: все позиции
+    проверяются одним запросом, записываются одним запросом в транзакции,
+    в ответе - результат по каждой позиции (Items).
+    Корзина хранится в базе данных или, при BASKET_STORAGE=redis, в Redis
+    с переносом в базу данных при оформлении заказа и периодически
     """
+    renderer_classes = (UJSONRenderer, BrowsableAPIRenderer)
+
     def get(self, request, *args, **kwargs):
-        user = request.user
-        id_user = user.id
-        basket = Order.objects.filter(user_id=id_user, state='basket').prefetch_related(
-            'ordered_items__product_info__product_parameters__parameter').annotate(
-            total_sum=Sum(F('ordered_items__quantity') * F('ordered_items__product_info__price'))).distinct()
-        serializer = BasketViewSerializer(basket, many=True)
-        return Response(serializer.data)
+        return Response(get_basket(request.user.id).rows())
 
-    def post(self, request, *args, **kwargs):
+    def get_basket_items(self, request):
+        """
+        Список позиций из параметра items запроса (список JSON
+        или строка JSON при отправке формы), None - параметр не задан или неверен
+        """
         items = request.data.get('items')
-        user = request.user
-        id_user = user.id
-        if items:
+        if isinstance(items, str):
             try:
-                items_dict = json.dumps(items)
-            except ValueError as e:
-                JsonResponse({'Status': False, 'Errors': f'Invalid request format {e}'})
-            else:
-                basket, created = Order.objects.get_or_create(user_id=id_user, state='basket')
-                id_order = basket.id
-                objects_created = 0
-                for order_item in load_json(items_dict):
-                    id_product_info = order_item.get('product_info', None)
-                    if id_product_info is None:
-                        return JsonResponse({'Status': False,
-                                             'Errors': f'The required request parameter <product_info> is missing'},
-                                            status=status.HTTP_400_BAD_REQUEST)
-                    elif isinstance(id_product_info, int):
-                        productinfo = ProductInfo.objects.filter(product_id=id_product_info).first()
-                        if productinfo:
-                            id_retailer = productinfo.retailer_id
-                            quantity = order_item.get('quantity', None)
-                            if quantity is None:
-                                return JsonResponse({'Status': False,
-                                                     'Errors': f'The required request parameter <quantity> is missing'},
-                                                    status=status.HTTP_400_BAD_REQUEST)
-                            if not quantity.is_integer():
-                                return JsonResponse({'Status': False,
-                                                     'Errors': f'Invalid type of request parameter <quantity>'},
-                                                    status=status.HTTP_400_BAD_REQUEST)
-                        else:
-                            return JsonResponse({'Status': False,
-                                                 'Errors': f'Invalid value for <product_info> request parameter'},
-                                                status=status.HTTP_400_BAD_REQUEST)
-                    else:
-                        return JsonResponse({'Status': False,
-                                             'Errors': f'Invalid type of request parameter <product_info>'},
-                                            status=status.HTTP_400_BAD_REQUEST)
-                    order_item.update({'order': id_order, 'retailer': id_retailer, 'state': 'basket'})
-                    serializer = OrderItemSerializer(data=order_item)
-                    if serializer.is_valid(raise_exception=True):
-                        try:
-                            serializer.save()
-                        except IntegrityError as e:
-                            return JsonResponse({'Status': False, 'Errors': str(e)})
-                        else:
-                            objects_created += 1
-                    else:
-                        JsonResponse({'Status': False, 'Errors': serializer.errors})
-                return JsonResponse({'Status': True,
-                                     'Objects created': objects_created},
-                                    status=status.HTTP_201_CREATED)
-        return JsonResponse({'Status': False,
-                             'Errors': 'All necessary arguments are not specified'},
-                            status=status.HTTP_400_BAD_REQUEST)
+                items = load_json(items)
+            except ValueError:
+                return None
+        if not items or not isinstance(items, list):
+            return None
+        return items
 
-    def put(self, request, *args, **kwargs):
-        items = request.data.get('items')
-        user = request.user
-        id_user = user.id
-        if items:
-            try:
-                items_dict = json.dumps(items)
-            except ValueError as e:
-                JsonResponse({'Status': False, 'Errors': f'Invalid request format {e}'})
-            else:
-                basket, created = Order.objects.get_or_create(user_id=id_user, state='basket')
-                id_order = basket.id
-                objects_updated = 0
-                for order_item in json.loads(items_dict):
-                    id_product_info = order_item.get('product_info', None)
-                    if id_product_info is None:
-                        return JsonResponse({'Status': False,
-                                             'Errors': f'The required request parameter <product_info> is missing'},
-                                            status=status.HTTP_400_BAD_REQUEST)
-                    elif isinstance(id_product_info, int):
-                        quantity = order_item.get('quantity', None)
-                        if quantity is None:
-                            return JsonResponse({'Status': False,
-                                                 'Errors': f'The required request parameter <quantity> is missing'},
-                                                status=status.HTTP_400_BAD_REQUEST)
-                        if not quantity.is_integer():
-                            return JsonResponse({'Status': False,
-                                                 'Errors': f'Invalid type of request parameter <quantity>'},
-                                                status=status.HTTP_400_BAD_REQUEST)
-                    else:
-                        return JsonResponse({'Status': False,
-                                             'Errors': f'Invalid type of request parameter <product_info>'},
-                                            status=status.HTTP_400_BAD_REQUEST)
-                    objects_updated += (OrderItem.objects.filter(order_id=id_order,
-                                                                 product_info_id=id_product_info).
-                                                          update(quantity=quantity))
+    def basket_response(self, key, count, report, success_status=status.HTTP_200_OK):
+        return JsonResponse({'Status': all(item['Status'] for item in report), key: count, 'Items': report},
+                            status=success_status if count else status.HTTP_400_BAD_REQUEST)
 
-                return JsonResponse({'Status': True,
-                                     'Objects updated': objects_updated})
+    def post(self, request, *args, **kwargs):
+        items = self.get_basket_items(request)
+        if items is None:
+            return JsonResponse({'Status': False,
+                                 'Errors': 'All necessary arguments are not specified'},
+                                status=status.HTTP_400_BAD_REQUEST)
+        objects_created, report = get_basket(request.user.id).add(items)
+        return self.basket_response('Objects created', objects_created, report, status.HTTP_201_CREATED)
 
-        return JsonResponse({'Status': False,
-                             'Errors': 'All necessary arguments are not specified'},
-                            status=status.HTTP_400_BAD_REQUEST)
+    def put(self, request, *args, **kwargs):
+        items = self.get_basket_items(request)
+        if items is None:
+            return JsonResponse({'Status': False,
+                                 'Errors': 'All necessary arguments are not specified'},
+                                status=status.HTTP_400_BAD_REQUEST)
+        objects_updated, report = get_basket(request.user.id).update(items)
+        return self.basket_response('Objects updated', objects_updated, report)
 
     def delete(self, request, *args, **kwargs):
-        items_list = request.data.get('items')
-        user = request.user
-        id_user = user.id
-        if items_list:
-            basket, created = Order.objects.get_or_create(user_id=id_user, state='basket')
-            query = Q()
-            objects_deleted = False
-            id_order = basket.id
-            for order_item_id in items_list:
-                if order_item_id.is_integer():
-                    query_order_item = Q(order_id=id_order, id=order_item_id)
-                    if OrderItem.objects.filter(query_order_item).exists():
-                        query = query | query_order_item
-                        objects_deleted = True
-            if objects_deleted:
-                deleted_count = OrderItem.objects.filter(query).delete()[0]
-                return JsonResponse({'Status': True, 'Objects deleted': deleted_count}, status=status.HTTP_200_OK)
-        return JsonResponse({'Status': False, 'Error': 'All necessary arguments are not specified'},
-                            status=status.HTTP_400_BAD_REQUEST)
+        items = self.get_basket_items(request)
+        if items is None:
+            return JsonResponse({'Status': False, 'Error': 'All necessary arguments are not specified'},
+                                status=status.HTTP_400_BAD_REQUEST)
+        objects_deleted, report = get_basket(request.user.id).delete(items)
+        return self.basket_response('Objects deleted', objects_deleted, report)
 
 
 class PartnerUpdate(APIView):
     """
-    Класс: прайс-листа продавца
+    Класс: прайс-листа продавца, отслеживание загрузок прайс-листа
     """
     def post(self, request, *args, **kwargs):
         if not request.user.is_authenticated:
@@ -334,16 +521,38 @@ class PartnerUpdate(APIView):
                                 status=status.HTTP_403_FORBIDDEN)
         url = request.data.get('url')
         if url:
+            job = ImportJob.objects.create(user=request.user, url=url)
             try:
-                task = get_import.delay(request.user.id, url)
+                task = get_import.delay(request.user.id, url, job_id=job.id)
             except IntegrityError as e:
                 return JsonResponse({'Status': False,
                                      'Errors': f'Integrity Error: {e}'})
-            return JsonResponse({'Status': True}, status=status.HTTP_200_OK)
+            ImportJob.objects.filter(id=job.id).update(task_id=task.id)
+            return JsonResponse({'Status': True, 'Job': job.id}, status=status.HTTP_200_OK)
         return JsonResponse({'Status': False,
                              'Errors': 'All necessary arguments are not specified'},
                             status=status.HTTP_400_BAD_REQUEST)
 
+    def get(self, request, job_id=None, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({'Status': False, 'Error': 'Log in required'},
+                                status=status.HTTP_403_FORBIDDEN)
+        if request.user.type != 'Retailer':
+            return JsonResponse({'Status': False, 'Error': 'For retailers only'},
+                                status=status.HTTP_403_FORBIDDEN)
+        if job_id is None:
+            jobs = ImportJob.objects.filter(user_id=request.user.id)
+            serializer = ImportJobSerializer(jobs, many=True)
+            return Response(serializer.data)
+        job = ImportJob.objects.filter(user_id=request.user.id, id=job_id).first()
+        if job is None:
+            return JsonResponse({'Status': False,
+                                 'Errors': f'Import job [{job_id}] is missing or '
+                                           f'does not belong to user [{request.user}]'},
+                                status=status.HTTP_400_BAD_REQUEST)
+        serializer = ImportJobSerializer(job)
+        return Response(serializer.data)
+
 
 class PartnerState(APIView):
     """
@@ -371,6 +580,8 @@ class PartnerState(APIView):
             state = strtobool(state)
             try:
                 Retailer.objects.filter(user_id=request.user.id).update(state=state)
+                retailer_cache.invalidate()
+                refresh_retailer_state(user_id=request.user.id)
                 return JsonResponse({'Status': True}, status=status.HTTP_200_OK)
             except ValueError as error:
                 return JsonResponse({'Status': False, 'Errors': str(error)})
@@ -383,6 +594,8 @@ class PartnerOrders(APIView):
     Класс: получение заказов клиентов продавцом,
     изменение статуса заказа по мере продвижения заказа
     """
+    renderer_classes = (UJSONRenderer, BrowsableAPIRenderer)
+
     def get(self, request, *args, **kwargs):
         state_choice_list = []
         for state_choice in STATE_CHOICES:
@@ -417,13 +630,8 @@ class PartnerOrders(APIView):
                                  'error': "Invalid type request parameter <state_order>"},
                                 status=status.HTTP_400_BAD_REQUEST)
 
-        orderitems = (OrderItem.objects.filter(query).select_related('order').
-                      prefetch_related('product_info__retailer__user__contacts',
-                                       'product_info__product__category',
-                                       'product_info__product_parameters__parameter').
-                      select_related('order').distinct())
-        serializer = PartnerOrdersSerializer(orderitems, many=True)
-        data = serializer.data
+        orderitems = OrderItem.objects.filter(query).order_by('id').values(*PARTNER_ORDER_VALUES)
+        data = partner_order_rows(orderitems)
         if data:
             send_email.delay('Order status update',
                              'The order(s) is(are) loaded', retailer_email)
@@ -557,7 +765,12 @@ class ContactView(APIView):
 class OrderView(APIView):
     """
     Класс: получение и размешение заказа покупателя
+    При размещении заказа остатки товаров резервируются атомарно,
+    повторный запрос на размещение уже оформленного заказа ничего не меняет
     """
+    renderer_classes = (UJSONRenderer, BrowsableAPIRenderer)
+    cursor_ordering = '-id'
+
     def get(self, request, *args, **kwargs):
         user = request.user
         id_user = user.id
@@ -567,11 +780,7 @@ class OrderView(APIView):
             if isinstance(id_order, str):
                 if id_order == 'all':
                     order = (Order.objects.filter(user_id=id_user).exclude(state='basket').
-                             prefetch_related('ordered_items__product_info__product__category',
-                                              'ordered_items__product_info__product_parameters__parameter').
-                             select_related('contact').annotate(total_sum=Sum(F('ordered_items__quantity')
-                                                                              * F('ordered_items__product_info__price'))).
-                             distinct().order_by('-date'))
+                             order_by('-date').values(*ORDER_VALUES))
                 else:
                     return JsonResponse({'Status': False,
                                          'error': "Invalid value <id_order> request parameter"},
@@ -579,11 +788,7 @@ class OrderView(APIView):
             elif isinstance(id_order, int):
                 if Order.objects.filter(user_id=id_user, id=id_order).exclude(state='basket').exists():
                     order = (Order.objects.filter(user_id=id_user, id=id_order).exclude(state='basket').
-                             prefetch_related('ordered_items__product_info__product__category',
-                                              'ordered_items__product_info__product_parameters__parameter').
-                             select_related('contact').annotate(total_sum=Sum(F('ordered_items__quantity')
-                                                                              * F('ordered_items__product_info__price'))).
-                             distinct().order_by('-date'))
+                             order_by('-date').values(*ORDER_VALUES))
                 else:
                     return JsonResponse({'Status': False,
                                          'error': f"Order [{id_order}] is missing or does not belong to user [{user}]"},
@@ -596,8 +801,11 @@ class OrderView(APIView):
              return JsonResponse({'Status': False,
                                   'Error': 'All necessary arguments are not specified'},
                                  status=status.HTTP_400_BAD_REQUEST)
-        serializer = OrderViewSerializer(order, many=True)
-        return Response(serializer.data)
+        paginator = OptionalKeysetPagination()
+        if paginator.keyset_requested(request):
+            page = paginator.paginate_queryset(order, request, view=self)
+            return paginator.get_paginated_response(order_rows(page))
+        return Response(order_rows(order))
 
     def post(self, request, *args, **kwargs):
         data = request.data
@@ -634,14 +842,22 @@ class OrderView(APIView):
                                      'message': f"Order [{id_order}] is missing or "
                                                 f"does not belong to user [{user}]"},
                                     status=status.HTTP_400_BAD_REQUEST)
-            is_updated = (Order.objects.filter(user_id=id_user, id=id_order).
-                                        update(contact_id=id_contact, state='new'))
-            if is_updated:
+            basket = get_basket(id_user)
+            basket.materialize()
+            try:
+                is_placed = place_order(id_user, id_order, id_contact)
+            except OutOfStock as error:
+                return JsonResponse({'Status': False,
+                                     'Errors': f'Not enough products in stock for order [{id_order}]',
+                                     'Shortages': error.shortages},
+                                    status=status.HTTP_409_CONFLICT)
+            if is_placed:
+                basket.discard(id_order)
                 send_email.delay('Order status update',
                                  f'The basket has been processed. '
                                  f'The order [{id_order}] has been formed',
                                  user_email)
-                return JsonResponse({'Status': True}, status=status.HTTP_200_OK)
+            return JsonResponse({'Status': True}, status=status.HTTP_200_OK)
         return JsonResponse({'Status': False,
                              'Errors': 'All necessary arguments are not specified'},
                             status=status.HTTP_400_BAD_REQUEST)
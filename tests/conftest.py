@@ -1,7 +1,25 @@
+import gzip
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
 import pytest
 from rest_framework.test import APIClient
 from model_bakery import baker
 
+from diplom.celery import celery_app
+from retail.cache import REFERENCE_CACHES
+
+
+@pytest.fixture(autouse=True)
+def reference_caches():
+    """
+    Кэш справочных данных живет в процессе и не откатывается вместе с базой
+    """
+    for reference in REFERENCE_CACHES.values():
+        reference.invalidate()
+    yield REFERENCE_CACHES
+
 
 @pytest.fixture
 def api_client():
@@ -78,4 +96,66 @@ def contact_factory():
     def factory(**kwargs):
         return baker.make('retail.Contact', **kwargs)
 
-    return factory
\ No newline at end of file
+    return factory
+
+
+@pytest.fixture
+def price_list_server():
+    """
+    Локальный HTTP-сервер, отдающий прайс-лист из словаря server.files,
+    при server.etag = True отвечает заголовком ETag и поддерживает If-None-Match,
+    при server.gzip = True сжимает ответ, первые server.failures запросов получают ответ 503
+    """
+    files = {}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            server.requests.append(dict(self.headers))
+            body = files.get(self.path)
+            if body is None:
+                self.send_response(404)
+                self.end_headers()
+                return
+            if server.failures:
+                server.failures -= 1
+                self.send_response(503)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            etag = f'"{hashlib.md5(body).hexdigest()}"'
+            if server.etag and self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.end_headers()
+                return
+            self.send_response(200)
+            if server.etag:
+                self.send_header('ETag', etag)
+            if server.gzip and 'gzip' in self.headers.get('Accept-Encoding', ''):
+                body = gzip.compress(body)
+                self.send_header('Content-Encoding', 'gzip')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.files = files
+    server.etag = False
+    server.gzip = False
+    server.failures = 0
+    server.requests = []
+    server.url = f'http://127.0.0.1:{server.server_port}'
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def celery_eager():
+    celery_app.conf.task_always_eager = True
+    yield celery_app
+    celery_app.conf.task_always_eager = False
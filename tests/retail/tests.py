@@ -1,8 +1,36 @@
+import csv
+import datetime
+import io
+
 import pytest
+from celery import group
+from django.contrib import admin
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F, Prefetch, Sum
 from django.urls import reverse
+from rest_framework.renderers import JSONRenderer
 from rest_framework.status import HTTP_200_OK, HTTP_401_UNAUTHORIZED, HTTP_201_CREATED, HTTP_403_FORBIDDEN
+from rest_framework.throttling import SimpleRateThrottle
+
+import yaml
+
+import ujson
 
-from retail.models import User
+from retail.basket import basket_redis, persist_baskets, RedisBasket, BASKET_DIRTY_KEY
+from retail.cache import (ReferenceCache, category_cache, retailer_cache, get_versions,
+                          CATALOG_VERSION_KEY)
+from retail.catalog import search_catalog, catalog_cards
+from retail.importer import (PriceListImporter, YamlPriceListReader, CsvPriceListReader,
+                             JsonPriceListReader, NdjsonPriceListReader, PriceListTooLarge,
+                             detect_format, download_price_list)
+from retail.models import (User, Category, CatalogEntry, Retailer, Order, OrderItem, Product,
+                           ProductInfo, ProductParameter, PriceList, ImportJob)
+from retail.orders import update_order_totals
+from retail.renderers import UJSONRenderer
+from retail.rows import order_rows, partner_order_rows, ORDER_VALUES, PARTNER_ORDER_VALUES
+from retail.serializers import ProductInfoViewSerializer, OrderViewSerializer, PartnerOrdersSerializer
+from retail.tasks import get_import, import_staging_redis, load_chunk
 
 @pytest.mark.django_db
 def test_user_create(api_client):
@@ -123,4 +151,1041 @@ def test_category_get(api_client, category_factory):
     category_factory(_quantity=4)
     response = api_client.get(url)
     assert response.status_code == 200
-    assert len(response.data) == 4
\ No newline at end of file
+    assert len(response.data) == 4
+
+
+def price_list_goods(count, start=0):
+    return [{'id': 1000 + number, 'category': 224, 'model': f'model/{number}',
+             'name': f'Smartphone {number}', 'price': 100 + number,
+             'price_rrc': 120 + number, 'quantity': 5,
+             'parameters': {'Color': 'black', 'Memory': number}}
+            for number in range(start, start + count)]
+
+
+@pytest.mark.django_db
+def test_import_goods_batched(user_factory, django_assert_max_num_queries):
+    partner = user_factory(type='Retailer')
+    importer = PriceListImporter(partner.id, batch_size=50, sync=False)
+    importer.import_retailer('Retailer1')
+    importer.import_categories([{'id': 224, 'name': 'Smartphones'}])
+    with django_assert_max_num_queries(2 * 10):
+        importer.import_goods(price_list_goods(100))
+    assert ProductInfo.objects.filter(retailer=importer.retailer).count() == 100
+    assert ProductParameter.objects.count() == 200
+
+    importer = PriceListImporter(partner.id, batch_size=50, sync=False)
+    importer.import_retailer('Retailer1')
+    goods = price_list_goods(100)
+    goods[0]['price'] = 1
+    importer.import_goods(goods)
+    assert ProductInfo.objects.count() == 100
+    assert Product.objects.count() == 100
+    assert ProductInfo.objects.get(cat_id=1000).price == 1
+
+
+@pytest.mark.django_db
+def test_import_goods_sync(user_factory, order_factory, order_item_factory):
+    partner = user_factory(type='Retailer')
+    importer = PriceListImporter(partner.id, batch_size=20, sync=True)
+    importer.import_retailer('Retailer1')
+    importer.import_categories([{'id': 224, 'name': 'Smartphones'}])
+    importer.import_goods(price_list_goods(50))
+    importer.delete_missing()
+    assert importer.created == 50
+    basket_item = order_item_factory(order=order_factory(user=partner, state='basket'),
+                                     product_info=ProductInfo.objects.get(cat_id=1001))
+
+    goods = price_list_goods(49, start=1)
+    goods[0]['price'] = 1
+    goods[1]['parameters']['Color'] = 'white'
+    del goods[2]['parameters']['Memory']
+    goods.append(price_list_goods(1, start=100)[0])
+    importer = PriceListImporter(partner.id, batch_size=20, sync=True)
+    importer.import_retailer('Retailer1')
+    importer.import_goods(goods)
+    importer.delete_missing()
+    assert importer.stats == {'Objects imported': 50, 'Objects created': 1,
+                              'Objects updated': 3, 'Objects deleted': 1}
+    assert ProductInfo.objects.get(id=basket_item.product_info_id).price == 1
+    assert ProductParameter.objects.get(product_info__cat_id=1002, parameter__name='Color').value == 'white'
+    assert not ProductParameter.objects.filter(product_info__cat_id=1003, parameter__name='Memory').exists()
+    assert not ProductInfo.objects.filter(cat_id=1000).exists()
+
+
+@pytest.mark.parametrize('sort_keys', [False, True])
+def test_price_list_reader_streams_goods(sort_keys):
+    price_list = yaml.safe_dump({'retailer': 'Retailer1',
+                                 'categories': [{'id': 224, 'name': 'Smartphones'}],
+                                 'goods': price_list_goods(3)}, allow_unicode=True, sort_keys=sort_keys)
+    reader = YamlPriceListReader(io.BytesIO(price_list.encode()))
+    assert reader.retailer == 'Retailer1'
+    assert reader.categories == [{'id': 224, 'name': 'Smartphones'}]
+    goods = reader.goods()
+    assert next(goods) == price_list_goods(1)[0]
+    assert len(list(goods)) == 2
+
+
+def test_price_list_reader_memory_is_bounded():
+    price_list = yaml.safe_dump({'retailer': 'Retailer1',
+                                 'categories': [{'id': 224, 'name': 'Smartphones'}],
+                                 'goods': price_list_goods(5000)}, allow_unicode=True)
+    reader = YamlPriceListReader(io.BytesIO(price_list.encode()))
+    cached = 0
+    for number, item in enumerate(reader.goods()):
+        cached = max(cached, len(reader.loader.constructed_objects))
+    assert number == 4999
+    assert cached < 50
+
+
+@pytest.mark.django_db
+def test_get_import(user_factory, price_list_server):
+    partner = user_factory(type='Retailer')
+    price_list_server.files['/shop.yaml'] = yaml.safe_dump(
+        {'retailer': 'Retailer1', 'categories': [{'id': 224, 'name': 'Smartphones'}],
+         'goods': price_list_goods(10)}, allow_unicode=True).encode()
+    result = get_import(partner.id, f'{price_list_server.url}/shop.yaml', batch_size=3)
+    assert result['Status'] is True
+    assert result['Objects imported'] == 10
+    assert ProductInfo.objects.filter(retailer__user=partner).count() == 10
+    result = get_import(partner.id, f'{price_list_server.url}/missing.yaml')
+    assert result['Status'] is False
+
+
+@pytest.mark.django_db
+def test_get_import_skips_unchanged_price_list(user_factory, price_list_server):
+    partner = user_factory(type='Retailer')
+    url = f'{price_list_server.url}/shop.yaml'
+    price_list_server.files['/shop.yaml'] = yaml.safe_dump(
+        {'retailer': 'Retailer1', 'categories': [{'id': 224, 'name': 'Smartphones'}],
+         'goods': price_list_goods(5)}, allow_unicode=True).encode()
+    price_list_server.etag = True
+    assert get_import(partner.id, url)['Objects created'] == 5
+    result = get_import(partner.id, url)
+    assert result['Skipped'] is True
+    assert 'HTTP 304' in result['Reason']
+    assert price_list_server.requests[-1]['If-None-Match']
+
+    price_list_server.etag = False
+    result = get_import(partner.id, url)
+    assert result['Skipped'] is True
+    assert result['Reason'] == 'Price list content is unchanged'
+    assert PriceList.objects.get(retailer__user=partner).etag == ''
+
+
+@pytest.fixture
+def import_staging(settings):
+    settings.IMPORT_STAGING_REDIS_URL = 'redis://localhost:6379/15'
+    import_staging_redis.cache_clear()
+    import_staging_redis().flushdb()
+    yield import_staging_redis()
+    import_staging_redis().flushdb()
+    import_staging_redis.cache_clear()
+
+
+@pytest.mark.django_db
+def test_get_import_parallel(user_factory, price_list_server, celery_eager, settings, monkeypatch,
+                             import_staging):
+    settings.IMPORT_PARALLEL_CHUNK_SIZE = 4
+    partner = user_factory(type='Retailer')
+    url = f'{price_list_server.url}/shop.yaml'
+    price_list_server.files['/shop.yaml'] = yaml.safe_dump(
+        {'retailer': 'Retailer1', 'categories': [{'id': 224, 'name': 'Smartphones'}],
+         'goods': price_list_goods(10) + price_list_goods(1)}, allow_unicode=True).encode()
+    chunks = []
+
+    def recording_group(tasks):
+        for task in tasks:
+            assert not any(isinstance(argument, list) for argument in task.args)
+            chunks.append([item['id'] for item in load_chunk(task.args[0])])
+        return group(tasks)
+
+    monkeypatch.setattr('retail.tasks.group', recording_group)
+    result = get_import(partner.id, url, parallel=True)
+    assert result['Chunks'] == 3
+    assert chunks == [list(range(1000, 1004)), list(range(1004, 1008)), [1008, 1009]]
+    assert not import_staging.keys('retail:import:*')
+    assert ProductInfo.objects.filter(retailer__user=partner).count() == 10
+    assert PriceList.objects.filter(retailer__user=partner).exists()
+
+    price_list_server.files['/shop.yaml'] = yaml.safe_dump(
+        {'retailer': 'Retailer1', 'categories': [{'id': 224, 'name': 'Smartphones'}],
+         'goods': price_list_goods(6, start=4)}, allow_unicode=True).encode()
+    import_goods = PriceListImporter.import_goods
+    catalog_sizes = []
+
+    def counting_import_goods(importer, goods):
+        catalog_sizes.append(ProductInfo.objects.filter(retailer__user=partner).count())
+        return import_goods(importer, goods)
+
+    monkeypatch.setattr(PriceListImporter, 'import_goods', counting_import_goods)
+    result = get_import(partner.id, url, sync=False, parallel=True)
+    assert min(catalog_sizes) == 10
+    assert result['Chunks'] == 2
+    assert set(ProductInfo.objects.values_list('cat_id', flat=True)) == set(range(1004, 1010))
+    assert Product.objects.count() == 10
+
+
+@pytest.mark.django_db
+def test_get_import_parallel_chunk_failure(user_factory, price_list_server, celery_eager, settings, monkeypatch,
+                                           import_staging):
+    settings.IMPORT_PARALLEL_CHUNK_SIZE = 4
+    partner = user_factory(type='Retailer')
+    url = f'{price_list_server.url}/shop.yaml'
+    price_list_server.files['/shop.yaml'] = yaml.safe_dump(
+        {'retailer': 'Retailer1', 'categories': [{'id': 224, 'name': 'Smartphones'}],
+         'goods': price_list_goods(10)}, allow_unicode=True).encode()
+    job = ImportJob.objects.create(user=partner, url=url)
+    import_goods = PriceListImporter.import_goods
+
+    def failing_import_goods(importer, goods):
+        if any(item['id'] == 1009 for item in goods):
+            raise RuntimeError('chunk failed')
+        return import_goods(importer, goods)
+
+    monkeypatch.setattr(PriceListImporter, 'import_goods', failing_import_goods)
+    with pytest.raises(RuntimeError):
+        get_import(partner.id, url, parallel=True, job_id=job.id)
+    job.refresh_from_db()
+    assert job.state == 'failed'
+    assert job.message == 'RuntimeError: chunk failed'
+    assert job.finished_at is not None
+    assert not PriceList.objects.filter(retailer__user=partner).exists()
+
+
+@pytest.mark.django_db
+def test_partner_update_job(api_client, user_factory, price_list_server, celery_eager):
+    partner = user_factory(type='Retailer')
+    api_client.force_authenticate(user=partner)
+    price_list_server.files['/shop.yaml'] = yaml.safe_dump(
+        {'retailer': 'Retailer1', 'categories': [{'id': 224, 'name': 'Smartphones'}],
+         'goods': price_list_goods(7)}, allow_unicode=True).encode()
+    resp = api_client.post(reverse('retail:partner-update'),
+                           data={'url': f'{price_list_server.url}/shop.yaml'})
+    assert resp.status_code == HTTP_200_OK
+    job_id = resp.json()['Job']
+    resp = api_client.get(reverse('retail:partner-update-status', args=[job_id]))
+    assert resp.status_code == HTTP_200_OK
+    assert resp.json()['state'] == 'finished'
+    assert resp.json()['rows'] == 7
+    assert resp.json()['rows_per_sec'] > 0
+
+    resp = api_client.post(reverse('retail:partner-update'),
+                           data={'url': f'{price_list_server.url}/missing.yaml'})
+    resp = api_client.get(reverse('retail:partner-update-status', args=[resp.json()['Job']]))
+    assert resp.json()['state'] == 'failed'
+    assert resp.json()['message']
+    assert len(api_client.get(reverse('retail:partner-update')).json()) == 2
+
+
+def test_price_list_formats():
+    categories = [{'id': 224, 'name': 'Smartphones'}]
+    goods = price_list_goods(3)
+    for item in goods:
+        item['parameters']['Memory'] = str(item['parameters']['Memory'])
+    json_price_list = ujson.dumps({'retailer': 'Retailer1', 'categories': categories, 'goods': goods})
+    ndjson_price_list = '\n'.join([ujson.dumps({'retailer': 'Retailer1', 'categories': categories})]
+                                  + [ujson.dumps(item) for item in goods])
+    csv_price_list = 'retailer,category,category_name,id,name,model,price,price_rrc,quantity,Color,Memory\n' + ''.join(
+        f"Retailer1,224,Smartphones,{item['id']},{item['name']},{item['model']},{item['price']},"
+        f"{item['price_rrc']},{item['quantity']},black,{item['parameters']['Memory']}\n" for item in goods)
+    for reader_class, price_list in ((JsonPriceListReader, json_price_list),
+                                     (NdjsonPriceListReader, ndjson_price_list),
+                                     (CsvPriceListReader, csv_price_list)):
+        reader = reader_class(io.BytesIO(price_list.encode()))
+        assert reader.retailer == 'Retailer1'
+        assert reader.categories == categories
+        assert list(reader.goods()) == goods
+
+    assert detect_format('http://shop.ru/price.csv') == 'csv'
+    assert detect_format('http://shop.ru/price.jsonl?v=2') == 'ndjson'
+    assert detect_format('http://shop.ru/price', 'application/json; charset=utf-8') == 'json'
+    assert detect_format('http://shop.ru/price.yml', 'text/plain') == 'yaml'
+
+
+@pytest.mark.django_db
+def test_get_import_csv(user_factory, price_list_server):
+    partner = user_factory(type='Retailer')
+    price_list_server.files['/shop.csv'] = (
+        'retailer,category,category_name,id,name,model,price,price_rrc,quantity,Color\n'
+        'Retailer1,224,Smartphones,1,Phone 1,m1,100,120,5,black\n'
+        'Retailer1,225,Tablets,2,Tablet 1,m2,200,220,0,\n').encode()
+    result = get_import(partner.id, f'{price_list_server.url}/shop.csv')
+    assert result['Objects created'] == 2
+    assert ProductParameter.objects.count() == 1
+
+
+@pytest.mark.django_db
+def test_import_pricelist_command(user_factory, tmp_path, settings):
+    settings.CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+    partner = user_factory(type='Retailer')
+    versions = get_versions([CATALOG_VERSION_KEY, category_cache.version_key, retailer_cache.version_key])
+    path = tmp_path / 'shop.yaml'
+    path.write_text(yaml.safe_dump({'retailer': 'Retailer1',
+                                    'categories': [{'id': 224, 'name': 'Smartphones'}],
+                                    'goods': price_list_goods(5)}, allow_unicode=True))
+    out = io.StringIO()
+    call_command('import_pricelist', str(path), retailer_user=partner.id, dry_run=True,
+                 profile=True, profile_limit=5, stdout=out)
+    assert 'ProductParameter writes' in out.getvalue()
+    assert 'cumulative' in out.getvalue()
+    assert not ProductInfo.objects.exists()
+    assert get_versions(list(versions)) == versions
+    assert retailer_cache.get_many('user_id', [partner.id]) == {}
+    assert category_cache.all() == []
+    call_command('import_pricelist', str(path), retailer_user=partner.id, stdout=io.StringIO())
+    assert ProductInfo.objects.count() == 5
+
+
+def test_download_price_list_retries_and_limits(price_list_server, settings):
+    settings.IMPORT_HTTP_BACKOFF_FACTOR = 0
+    price_list_server.files['/shop.yaml'] = b'retailer: Retailer1\n' * 100
+    price_list_server.gzip = True
+    price_list_server.failures = 2
+    price_list_file, fetch_info, content_type = download_price_list(f'{price_list_server.url}/shop.yaml')
+    assert price_list_file.read() == price_list_server.files['/shop.yaml']
+    assert len(price_list_server.requests) == 3
+    assert price_list_server.requests[-1]['Accept-Encoding'] == 'gzip'
+
+    settings.IMPORT_HTTP_MAX_SIZE = 1000
+    with pytest.raises(PriceListTooLarge):
+        download_price_list(f'{price_list_server.url}/shop.yaml')
+
+
+@pytest.mark.django_db
+def test_reference_cache(api_client, user_factory, category_factory, settings,
+                         django_assert_num_queries):
+    category_factory(_quantity=3)
+    url = reverse('retail:categories')
+    assert len(api_client.get(url).data['results']) == 3
+    with django_assert_num_queries(0):
+        assert len(api_client.get(url).data['results']) == 3
+    category_factory()
+    assert len(api_client.get(url).data['results']) == 4
+
+    partner = user_factory(type='Retailer')
+    importer = PriceListImporter(partner.id, batch_size=50, sync=False)
+    importer.import_retailer('Retailer1')
+    importer.import_categories([{'id': 224, 'name': 'Smartphones'}])
+    importer.import_goods(price_list_goods(10))
+    warm_up = PriceListImporter(partner.id)
+    warm_up.import_retailer('Retailer1')
+    warm_up.resolve_parameters(price_list_goods(10))
+    importer = PriceListImporter(partner.id, batch_size=50, sync=False)
+    with django_assert_num_queries(0):
+        importer.import_retailer('Retailer1')
+        importer.resolve_parameters(price_list_goods(10))
+    assert set(importer.parameters) == {'Color', 'Memory'}
+    with django_assert_num_queries(2):
+        importer.import_categories([{'id': 224, 'name': 'Smartphones'}])
+
+    settings.REFERENCE_CACHE_SIZE = 2
+    assert len(api_client.get(url).data['results']) == 5
+
+    settings.REFERENCE_CACHE_SIZE = 10
+    settings.CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+    category_cache.invalidate()
+    assert len(category_cache.all()) == 5
+    with django_assert_num_queries(0):
+        assert len(ReferenceCache(Category).all()) == 5
+
+
+@pytest.mark.django_db
+def test_reference_cache_follows_response_version(api_client, category_factory, settings):
+    settings.CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+    settings.REFERENCE_CACHE_CHECK_INTERVAL = 3600
+    category_factory(_quantity=2)
+    url = reverse('retail:categories')
+    first = api_client.get(url)
+    assert len(first.data['results']) == 2
+
+    Category.objects.bulk_create([Category(name='Other process')])
+    ReferenceCache(Category).invalidate()
+    second = api_client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+    assert second.status_code == 200
+    assert second['ETag'] != first['ETag']
+    assert len(second.data['results']) == 3
+    assert api_client.get(url, HTTP_IF_NONE_MATCH=second['ETag']).status_code == 304
+
+
+@pytest.mark.django_db
+def test_catalog_snapshots(api_client, user_factory, django_assert_max_num_queries):
+    partner = user_factory(type='Retailer')
+    importer = PriceListImporter(partner.id, batch_size=50)
+    importer.import_retailer('Retailer1')
+    importer.import_categories([{'id': 224, 'name': 'Smartphones'}])
+    importer.import_goods(price_list_goods(60))
+    url = reverse('retail:retailers-list')
+    with django_assert_max_num_queries(2):
+        response = api_client.get(url, {'category_id': 224})
+    assert response.json()['count'] == 60
+    row = ProductInfo.objects.get(cat_id=1000)
+    expected = ProductInfoViewSerializer(row).data
+    assert response.json()['results'][0] == ujson.loads(ujson.dumps(expected))
+
+    goods = price_list_goods(60)
+    goods[0]['price'] = 1
+    goods[0]['parameters']['Color'] = 'white'
+    importer = PriceListImporter(partner.id, batch_size=50)
+    importer.import_retailer('Retailer1')
+    importer.import_goods(goods)
+    data = CatalogEntry.objects.get(product_info=row).data
+    assert data['price'] == 1
+    assert {'parameter': 'Color', 'value': 'white'} in data['product_parameters']
+
+    category = Category.objects.get(id=224)
+    category.name = 'Phones'
+    category.save()
+    assert CatalogEntry.objects.get(product_info=row).data['product']['category'] == 'Phones'
+    importer.retailer.state = False
+    importer.retailer.save()
+    assert api_client.get(url).json()['count'] == 0
+
+
+@pytest.mark.django_db
+def test_cursor_pagination(api_client, user_factory, order_factory, django_assert_max_num_queries):
+    partner = user_factory(type='Retailer')
+    importer = PriceListImporter(partner.id, batch_size=50)
+    importer.import_retailer('Retailer1')
+    importer.import_categories([{'id': 224, 'name': 'Smartphones'}])
+    importer.import_goods(price_list_goods(60))
+
+    url = reverse('retail:retailers-list')
+    response = api_client.get(url, {'pagination': 'cursor', 'page_size': 25, 'count': 'estimate'})
+    assert response.json()['count_estimate'] > 0
+    cat_ids = []
+    while True:
+        payload = response.json()
+        assert 'count' not in payload
+        cat_ids += [row['cat_id'] for row in payload['results']]
+        if payload['next'] is None:
+            break
+        with django_assert_max_num_queries(2) as queries:
+            response = api_client.get(payload['next'])
+        assert not any('COUNT(' in query['sql'] for query in queries.captured_queries)
+    assert cat_ids == [1000 + number for number in range(60)]
+
+    customer = user_factory()
+    orders = [order_factory(user=customer, state='new') for _ in range(3)]
+    api_client.force_authenticate(user=customer)
+    response = api_client.generic('GET', reverse('retail:order') + '?pagination=cursor&page_size=2',
+                                  data=ujson.dumps({'id_order': 'all'}), content_type='application/json')
+    assert [order['id'] for order in response.json()['results']] == [orders[2].id, orders[1].id]
+    response = api_client.generic('GET', response.json()['next'],
+                                  data=ujson.dumps({'id_order': 'all'}), content_type='application/json')
+    assert [order['id'] for order in response.json()['results']] == [orders[0].id]
+
+
+def seq_scans(queryset, tables):
+    """
+    Таблицы из tables, которые планировщик читает последовательным сканированием
+    """
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    nodes, scanned = [plan[0]['Plan']], []
+    while nodes:
+        node = nodes.pop()
+        if node['Node Type'] == 'Seq Scan' and node['Relation Name'] in tables:
+            scanned.append(node['Relation Name'])
+        nodes += node.get('Plans', [])
+    return scanned
+
+
+@pytest.mark.django_db
+def test_hot_queries_use_indexes(user_factory):
+    retailers, customers = 200, 500
+    users = User.objects.bulk_create(User(email=f'user{number}@example.com', username=f'user{number}',
+                                          type='Retailer' if number < retailers else 'Client')
+                                     for number in range(retailers + customers))
+    category = Category.objects.create(id=224, name='Smartphones')
+    retailer_rows = Retailer.objects.bulk_create(Retailer(name=f'Retailer {number}', user=users[number])
+                                                 for number in range(retailers))
+    products = Product.objects.bulk_create(Product(name=f'Smartphone {number}', category=category)
+                                           for number in range(retailers * 100))
+    products_info = ProductInfo.objects.bulk_create(
+        ProductInfo(product=product, retailer=retailer_rows[number % retailers], cat_id=number,
+                    model='model', price=100 + number % 997, price_rrc=120, quantity=5)
+        for number, product in enumerate(products))
+    CatalogEntry.objects.bulk_create(
+        CatalogEntry(product_info=row, retailer_id=row.retailer_id, category=category,
+                     price=row.price, quantity=row.quantity, data={})
+        for row in products_info)
+    orders = Order.objects.bulk_create(Order(user=users[retailers + number % customers],
+                                             state='basket' if number < customers else 'new')
+                                       for number in range(customers * 10))
+    OrderItem.objects.bulk_create(OrderItem(order=order, product_info=products_info[number * 7 % len(products_info)],
+                                            quantity=1)
+                                  for number, order in enumerate(orders))
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+
+    large_tables = {table._meta.db_table for table in (Product, ProductInfo, CatalogEntry, Order, OrderItem)}
+    retailer_user = users[7]
+    customer = users[retailers + 7]
+    hot_queries = {
+        'catalog': CatalogEntry.objects.filter(retailer_state=True).order_by('pk')[:40],
+        'catalog by retailer': CatalogEntry.objects.filter(retailer_state=True,
+                                                           retailer_id=retailer_rows[7].id)[:40],
+        'catalog by price': CatalogEntry.objects.filter(retailer_state=True, category_id=224,
+                                                        quantity__gt=0).order_by('-price', '-pk')[:40],
+        'basket': Order.objects.filter(user_id=customer.id, state='basket'),
+        'partner orders': OrderItem.objects.filter(product_info__retailer__user_id=retailer_user.id,
+                                                   order__state='basket'),
+        'import products': Product.objects.filter(name__in=['Smartphone 1', 'Smartphone 2'],
+                                                  category_id__in=[224]),
+        'import sync': ProductInfo.objects.filter(retailer_id=retailer_rows[7].id,
+                                                  product_id__in=[products[7].id],
+                                                  cat_id__in=[7]),
+        'import delete': ProductInfo.objects.filter(retailer_id=retailer_rows[7].id).values_list('id'),
+    }
+    for name, queryset in hot_queries.items():
+        assert seq_scans(queryset, large_tables) == [], name
+
+
+@pytest.mark.django_db
+def test_catalog_search(api_client, user_factory):
+    partner = user_factory(type='Retailer')
+    importer = PriceListImporter(partner.id, batch_size=50)
+    importer.import_retailer('Retailer1')
+    importer.import_categories([{'id': 224, 'name': 'Smartphones'}])
+    goods = price_list_goods(20)
+    goods[3]['name'] = 'Смартфон Apple iPhone XS Max 512GB (золотистый)'
+    goods[3]['model'] = 'apple/iphone/xs-max'
+    goods[5]['name'] = 'Apple iPad'
+    goods[5]['parameters']['Color'] = 'золотистый'
+    importer.import_goods(goods)
+    url = reverse('retail:retailers-list')
+
+    results = api_client.get(url, {'q': 'золотистые смартфоны'}).json()['results']
+    assert [row['cat_id'] for row in results] == [1003]
+    results = api_client.get(url, {'q': 'apple'}).json()['results']
+    assert [row['cat_id'] for row in results] == [1003, 1005]
+    results = api_client.get(url, {'q': 'золотистый'}).json()['results']
+    assert [row['cat_id'] for row in results] == [1003, 1005]
+
+    with connection.cursor() as cursor:
+        cursor.execute('SET LOCAL enable_seqscan = off')
+        sql, params = search_catalog(CatalogEntry.objects.all(), 'apple').query.sql_with_params()
+        cursor.execute(f'EXPLAIN {sql}', params)
+        plan = '\n'.join(row[0] for row in cursor.fetchall())
+    assert 'catalog_search_idx' in plan
+
+
+@pytest.mark.django_db
+def test_catalog_parameter_filters_and_facets(api_client, user_factory, django_assert_max_num_queries):
+    partner = user_factory(type='Retailer')
+    importer = PriceListImporter(partner.id, batch_size=50)
+    importer.import_retailer('Retailer1')
+    importer.import_categories([{'id': 224, 'name': 'Smartphones'}])
+    goods = price_list_goods(10)
+    for item in goods[:3]:
+        item['parameters']['Color'] = 'white'
+    importer.import_goods(goods)
+    importer.finish()
+    url = reverse('retail:retailers-list')
+
+    response = api_client.get(url, {'param[Color]': 'white'}).json()
+    assert [row['cat_id'] for row in response['results']] == [1000, 1001, 1002]
+    response = api_client.get(url + '?param[Color]=white&param[Color]=black&param[Memory]=4').json()
+    assert [row['cat_id'] for row in response['results']] == [1004]
+
+    with django_assert_max_num_queries(3):
+        response = api_client.get(url, {'category_id': 224, 'param[Color]': 'white', 'facets': 'true'}).json()
+    assert response['count'] == 3
+    assert response['facets']['Color'] == {'black': 7, 'white': 3}
+    assert len(response['facets']['Memory']) == 3
+    response = api_client.get(url, {'max_price': 103, 'facets': 'true'}).json()
+    assert response['facets']['Color'] == {'white': 3, 'black': 1}
+    response = api_client.get(url + '?param[Color]=black&param[Memory]=4&facets=true').json()
+    assert response['facets']['Color'] == {'black': 1}
+    assert len(response['facets']['Memory']) == 7
+    assert api_client.get(url, {'category_id': 224, 'facets': 'true'}).json()['facets']['Color'] == {
+        'black': 7, 'white': 3}
+    importer.retailer.state = False
+    importer.retailer.save()
+    assert api_client.get(url, {'facets': 'true'}).json()['facets'] == {}
+
+
+@pytest.mark.django_db
+def test_catalog_price_filters_and_ordering(api_client, user_factory):
+    partner = user_factory(type='Retailer')
+    importer = PriceListImporter(partner.id, batch_size=50)
+    importer.import_retailer('Retailer1')
+    importer.import_categories([{'id': 224, 'name': 'Smartphones'}])
+    goods = price_list_goods(10)
+    goods[2]['quantity'] = 0
+    goods[8]['price'] = 50
+    importer.import_goods(goods)
+    url = reverse('retail:retailers-list')
+
+    response = api_client.get(url, {'min_price': 102, 'max_price': 106, 'in_stock': 'true',
+                                    'ordering': '-price'}).json()
+    assert [row['price'] for row in response['results']] == [106, 105, 104, 103]
+    response = api_client.get(url, {'ordering': 'price', 'pagination': 'cursor', 'page_size': 4}).json()
+    assert [row['price'] for row in response['results']] == [50, 100, 101, 102]
+    response = api_client.get(response['next']).json()
+    assert [row['price'] for row in response['results']] == [103, 104, 105, 106]
+    assert api_client.get(url, {'ordering': 'name'}).status_code == 400
+    assert api_client.get(url, {'min_price': 'cheap'}).status_code == 400
+    assert api_client.get(url, {'q': 'smartphone', 'pagination': 'cursor'}).status_code == 400
+
+    for item in goods:
+        item['price'] = 100
+    importer.import_goods(goods)
+    pages, link = [], f'{url}?ordering=-price&pagination=cursor&page_size=3'
+    while link is not None:
+        response = api_client.get(link).json()
+        pages.append([row['cat_id'] for row in response['results']])
+        link = response['next']
+    assert pages == [[1009, 1008, 1007], [1006, 1005, 1004], [1003, 1002, 1001], [1000]]
+    response = api_client.get(response['previous']).json()
+    assert [row['cat_id'] for row in response['results']] == [1003, 1002, 1001]
+
+    with connection.cursor() as cursor:
+        cursor.execute('SET LOCAL enable_seqscan = off')
+        cursor.execute('SET LOCAL enable_bitmapscan = off')
+        cursor.execute('SET LOCAL enable_sort = off')
+        sql, params = CatalogEntry.objects.filter(retailer_state=True, category_id=224).order_by(
+            'price', 'pk')[:40].query.sql_with_params()
+        cursor.execute(f'EXPLAIN {sql}', params)
+        plan = '\n'.join(row[0] for row in cursor.fetchall())
+    assert 'catalog_category_price_idx' in plan
+    assert 'Sort' not in plan
+
+
+@pytest.mark.django_db
+def test_catalog_conditional_requests(api_client, user_factory, category_factory, settings,
+                                      django_assert_num_queries, monkeypatch):
+    settings.CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+    partner = user_factory(type='Retailer')
+    importer = PriceListImporter(partner.id, batch_size=50)
+    importer.import_retailer('Retailer1')
+    importer.import_categories([{'id': 224, 'name': 'Smartphones'}])
+    importer.import_goods(price_list_goods(10))
+    urls = [reverse('retail:retailers-list'), reverse('retail:retailers-list') + f'?retailer_id={importer.retailer.id}',
+            reverse('retail:categories'), reverse('retail:retailers')]
+    etags = {}
+    for url in urls:
+        response = api_client.get(url)
+        assert response.status_code == 200
+        etags[url] = response['ETag']
+        with django_assert_num_queries(0):
+            response = api_client.get(url, HTTP_IF_NONE_MATCH=etags[url])
+        assert response.status_code == 304
+        assert response['ETag'] == etags[url]
+
+    goods = price_list_goods(10)
+    goods[0]['price'] = 1
+    importer.import_goods(goods)
+    category_factory()
+    for url in urls[:3]:
+        assert api_client.get(url, HTTP_IF_NONE_MATCH=etags[url]).status_code == 200
+    assert api_client.get(urls[3], HTTP_IF_NONE_MATCH=etags[urls[3]]).status_code == 304
+
+    response = api_client.get(urls[3], HTTP_IF_MODIFIED_SINCE='Fri, 01 Jan 2100 00:00:00 GMT')
+    assert response.status_code == 200
+    assert 'Last-Modified' not in response
+    monkeypatch.setattr(SimpleRateThrottle, 'THROTTLE_RATES', {'user': '1/minute', 'anon': '1/minute'})
+    assert api_client.get(urls[3], HTTP_IF_NONE_MATCH=etags[urls[3]]).status_code == 429
+
+
+@pytest.mark.django_db
+def test_catalog_response_cache(api_client, user_factory, settings, django_assert_num_queries,
+                                django_assert_max_num_queries):
+    settings.CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+    importers = []
+    for number in range(2):
+        importer = PriceListImporter(user_factory(type='Retailer').id, batch_size=50)
+        importer.import_retailer(f'Retailer{number}')
+        importer.import_categories([{'id': 224 + number, 'name': f'Category{number}'}])
+        goods = price_list_goods(5, start=10 * number)
+        for item in goods:
+            item['category'] = 224 + number
+        importer.import_goods(goods)
+        importers.append(importer)
+    url = reverse('retail:retailers-list')
+    scopes = [{'retailer_id': importers[0].retailer.id}, {'retailer_id': importers[1].retailer.id},
+              {'category_id': 224}, {'category_id': 225}, {}]
+    first = [api_client.get(url, scope).json() for scope in scopes]
+    with django_assert_num_queries(0):
+        assert [api_client.get(url, scope).json() for scope in scopes] == first
+    padded = {'retailer_id': f'0{importers[1].retailer.id}'}
+    assert api_client.get(url, padded).json() == first[1]
+    assert api_client.get(url, {'retailer_id': 'Retailer1'}).status_code == 400
+    assert api_client.get(url, {'category_id': '224,225'}).status_code == 400
+
+    goods = price_list_goods(5, start=10)
+    for item in goods:
+        item['category'] = 225
+    goods[0]['price'] = 1
+    importers[1].import_goods(goods)
+    with django_assert_num_queries(0):
+        assert api_client.get(url, scopes[0]).json() == first[0]
+        assert api_client.get(url, scopes[2]).json() == first[2]
+    for scope in scopes[1], scopes[3], scopes[4], padded:
+        assert {row['price'] for row in api_client.get(url, scope).json()['results']} >= {1}
+
+    customer = user_factory()
+    api_client.force_authenticate(user=customer)
+    for _ in range(2):
+        with django_assert_max_num_queries(10) as queries:
+            assert api_client.get(reverse('retail:basket')).status_code == 200
+        assert len(queries.captured_queries) > 0
+
+
+@pytest.mark.django_db
+def test_catalog_sparse_fieldsets(api_client, user_factory):
+    partner = user_factory(type='Retailer')
+    importer = PriceListImporter(partner.id, batch_size=50)
+    importer.import_retailer('Retailer1')
+    importer.import_categories([{'id': 224, 'name': 'Smartphones'}])
+    importer.import_goods(price_list_goods(3))
+    url = reverse('retail:retailers-list')
+
+    full = api_client.get(url).json()['results'][0]
+    assert {'product', 'product_parameters'} <= set(full)
+    row = api_client.get(url, {'fields': 'id,model,price,quantity'}).json()['results'][0]
+    assert row == {name: full[name] for name in ('id', 'model', 'price', 'quantity')}
+    row = api_client.get(url, {'expand': 'product'}).json()['results'][0]
+    assert 'product' in row and 'product_parameters' not in row and 'price_rrc' in row
+    row = api_client.get(url, {'fields': 'id', 'expand': 'product_parameters'}).json()['results'][0]
+    assert row == {'id': full['id'], 'product_parameters': full['product_parameters']}
+    assert api_client.get(url, {'fields': 'id,secret'}).status_code == 400
+    assert api_client.get(url, {'expand': 'model'}).status_code == 400
+
+    cards = catalog_cards(CatalogEntry.objects.all(), ('id', 'price'))
+    sql = str(cards.query)
+    assert '"data" - ' in sql
+    assert list(cards.values_list('card', flat=True)) and all(
+        set(card) == {'id', 'price'} for card in cards.values_list('card', flat=True))
+
+
+@pytest.mark.django_db
+def test_values_read_path_matches_serializers(api_client, user_factory, contact_factory):
+    partner = user_factory(type='Retailer')
+    customer = user_factory()
+    importer = PriceListImporter(partner.id, batch_size=50)
+    importer.import_retailer('Retailer1')
+    importer.import_categories([{'id': 224, 'name': 'Smartphones'}])
+    importer.import_goods(price_list_goods(6))
+    product_info_ids = list(ProductInfo.objects.order_by('id').values_list('id', flat=True))
+    contact = contact_factory(user=customer)
+    orders = [Order.objects.create(user=customer, state='new', contact=contact),
+              Order.objects.create(user=customer, state='confirmed')]
+    OrderItem.objects.bulk_create(OrderItem(order=orders[number % 2], product_info_id=product_info_id,
+                                            quantity=number + 1)
+                                  for number, product_info_id in enumerate(product_info_ids))
+    call_command('repair_order_totals', stdout=io.StringIO())
+    annotated = Order.objects.filter(user=customer).order_by('-id')
+    expected = OrderViewSerializer(annotated.prefetch_related(
+        Prefetch('ordered_items', queryset=OrderItem.objects.order_by('id'))), many=True).data
+    assert order_rows(annotated.values(*ORDER_VALUES)) == ujson.loads(ujson.dumps(expected))
+    items = OrderItem.objects.filter(product_info__retailer__user_id=partner.id).order_by('id')
+    expected = PartnerOrdersSerializer(items, many=True).data
+    assert partner_order_rows(items.values(*PARTNER_ORDER_VALUES)) == ujson.loads(ujson.dumps(expected))
+
+    api_client.force_authenticate(user=customer)
+    response = api_client.generic('GET', reverse('retail:order'), data=ujson.dumps({'id_order': 'all'}),
+                                  content_type='application/json')
+    assert response.status_code == 200
+    assert [order['total_sum'] for order in response.json()] == [row['total_sum'] for row in order_rows(
+        annotated.values(*ORDER_VALUES))]
+    assert type(response.accepted_renderer) is UJSONRenderer
+    assert type(api_client.get(reverse('retail:user-details')).accepted_renderer) is JSONRenderer
+
+    renderer = UJSONRenderer()
+    data = {'name': 'Смартфон / 1', 'created': datetime.datetime(2024, 1, 1)}
+    assert ujson.loads(renderer.render({'name': data['name']})) == {'name': data['name']}
+    assert renderer.render(data) == JSONRenderer().render(data)
+
+    out = io.StringIO()
+    call_command('benchmark_serialization', rows=40, repeat=1, stdout=out)
+    assert 'partner orders' in out.getvalue()
+    assert not ProductInfo.objects.filter(retailer__name='Benchmark retailer').exists()
+
+
+@pytest.mark.django_db
+def test_catalog_export(api_client, user_factory, settings, django_assert_max_num_queries):
+    settings.CATALOG_EXPORT_CHUNK_SIZE = 7
+    partner = user_factory(type='Retailer')
+    importer = PriceListImporter(partner.id, batch_size=50)
+    importer.import_retailer('Retailer1')
+    importer.import_categories([{'id': 224, 'name': 'Smartphones'}])
+    importer.import_goods(price_list_goods(30))
+    url = reverse('retail:retailers-export')
+
+    with django_assert_max_num_queries(2):
+        response = api_client.get(url, {'category_id': 224})
+        assert response.streaming
+        lines = b''.join(response.streaming_content).decode().splitlines()
+    assert response['Content-Type'].startswith('application/x-ndjson')
+    expected = api_client.get(reverse('retail:retailers-list'), {'page_size': 100}).json()
+    assert [ujson.loads(line) for line in lines][:10] == expected['results'][:10]
+    assert len(lines) == 30
+
+    response = api_client.get(url, {'type': 'csv', 'min_price': 120, 'ordering': '-price'})
+    rows = list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode())))
+    assert [row['price'] for row in rows] == [str(price) for price in range(129, 119, -1)]
+    assert rows[0]['product'] == 'Smartphone 29' and rows[0]['category'] == 'Smartphones'
+    assert rows[0]['parameters'] == 'Color: black; Memory: 29'
+
+    response = api_client.get(url, {'type': 'csv', 'fields': 'id,price', 'expand': 'product'})
+    header = b''.join(response.streaming_content).decode().splitlines()[0]
+    assert header == 'id,product,category,price'
+    response = api_client.get(url, {'fields': 'id'})
+    assert all(set(ujson.loads(line)) == {'id'} for line in response.streaming_content)
+    assert api_client.get(url, {'type': 'xml'}).status_code == 400
+
+
+@pytest.mark.django_db
+def test_basket_batched_mutations(api_client, user_factory, django_assert_max_num_queries):
+    partner = user_factory(type='Retailer')
+    importer = PriceListImporter(partner.id, batch_size=100)
+    importer.import_retailer('Retailer1')
+    importer.import_categories([{'id': 224, 'name': 'Smartphones'}])
+    importer.import_goods(price_list_goods(60))
+    product_info_ids = list(ProductInfo.objects.order_by('id').values_list('id', flat=True))
+    customer = user_factory()
+    api_client.force_authenticate(user=customer)
+    url = reverse('retail:basket')
+    Order.objects.create(user=customer, state='basket')
+
+    queries = []
+    for count in (5, 50):
+        OrderItem.objects.filter(order__user=customer).delete()
+        items = [{'product_info': id_, 'quantity': 1} for id_ in product_info_ids[:count]]
+        with django_assert_max_num_queries(12) as captured:
+            response = api_client.post(url, {'items': items})
+        queries.append(len(captured))
+        assert response.status_code == 201
+        assert response.json()['Objects created'] == count
+    assert queries[0] == queries[1]
+    assert OrderItem.objects.filter(order__user=customer).count() == 50
+
+    response = api_client.post(url, {'items': [{'product_info': product_info_ids[55], 'quantity': 2},
+                                               {'product_info': product_info_ids[0], 'quantity': 1},
+                                               {'product_info': 10 ** 9, 'quantity': 1},
+                                               {'product_info': product_info_ids[56], 'quantity': 'many'},
+                                               {'quantity': 1}]})
+    assert response.status_code == 201
+    payload = response.json()
+    assert payload['Status'] is False and payload['Objects created'] == 1
+    assert [item['Status'] for item in payload['Items']] == [True, False, False, False, False]
+
+    items = [{'product_info': id_, 'quantity': 3} for id_ in product_info_ids[:50]]
+    with django_assert_max_num_queries(12):
+        response = api_client.put(url, {'items': items + [{'product_info': product_info_ids[59], 'quantity': 3}]})
+    assert response.json()['Objects updated'] == 50
+    assert response.json()['Items'][-1]['Status'] is False
+    assert set(OrderItem.objects.filter(order__user=customer, product_info_id__in=product_info_ids[:50]).values_list(
+        'quantity', flat=True)) == {3}
+
+    ids = list(OrderItem.objects.filter(order__user=customer).values_list('id', flat=True))
+    with django_assert_max_num_queries(12):
+        response = api_client.delete(url, {'items': ids[:40] + [10 ** 9]})
+    assert response.json()['Objects deleted'] == 40
+    assert [item['Status'] for item in response.json()['Items']][-2:] == [True, False]
+    assert OrderItem.objects.filter(order__user=customer).count() == 11
+    assert api_client.delete(url, {'items': [10 ** 9]}).status_code == 400
+    assert api_client.put(url, {'items': 'broken'}).status_code == 400
+
+
+@pytest.mark.django_db
+def test_checkout_reserves_stock(api_client, user_factory, contact_factory, django_capture_on_commit_callbacks):
+    partner = user_factory(type='Retailer')
+    importer = PriceListImporter(partner.id, batch_size=50)
+    importer.import_retailer('Retailer1')
+    importer.import_categories([{'id': 224, 'name': 'Smartphones'}])
+    goods = price_list_goods(2)
+    goods[0]['quantity'], goods[1]['quantity'] = 3, 10
+    importer.import_goods(goods)
+    hot, other = ProductInfo.objects.order_by('cat_id')
+    customer = user_factory()
+    contact = contact_factory(user=customer)
+    api_client.force_authenticate(user=customer)
+    url = reverse('retail:order')
+
+    basket = Order.objects.create(user=customer, state='basket')
+    OrderItem.objects.bulk_create([OrderItem(order=basket, product_info=hot, quantity=4),
+                                   OrderItem(order=basket, product_info=other, quantity=2)])
+    response = api_client.post(url, {'order_id': basket.id, 'contact_id': contact.id})
+    assert response.status_code == 409
+    assert response.json()['Shortages'] == {str(hot.id): {'requested': 4, 'available': 3}}
+    assert ProductInfo.objects.get(id=other.id).quantity == 10
+    assert Order.objects.get(id=basket.id).state == 'basket'
+
+    OrderItem.objects.filter(order=basket, product_info=hot).update(quantity=3)
+    for _ in range(2):
+        with django_capture_on_commit_callbacks(execute=True):
+            response = api_client.post(url, {'order_id': basket.id, 'contact_id': contact.id})
+        assert response.status_code == 200
+    assert dict(ProductInfo.objects.filter(id__in=[hot.id, other.id]).values_list('id', 'quantity')) == {
+        hot.id: 0, other.id: 8}
+    assert Order.objects.get(id=basket.id).state == 'new'
+    assert CatalogEntry.objects.get(product_info=hot).quantity == 0
+
+
+@pytest.mark.django_db(transaction=True)
+def test_checkout_benchmark_does_not_oversell():
+    out = io.StringIO()
+    call_command('benchmark_checkout', threads=8, orders=40, stock=15, stdout=out)
+    assert 'placed 15, rejected 25, stock left 0, oversold units 0' in out.getvalue()
+    assert not ProductInfo.objects.exists() and not User.objects.exists()
+
+
+@pytest.fixture
+def redis_basket(settings):
+    settings.BASKET_STORAGE = 'redis'
+    settings.BASKET_REDIS_URL = 'redis://localhost:6379/15'
+    basket_redis.cache_clear()
+    basket_redis().flushdb()
+    yield basket_redis()
+    basket_redis().flushdb()
+    basket_redis.cache_clear()
+
+
+@pytest.mark.django_db
+def test_redis_basket_write_behind(api_client, user_factory, contact_factory, settings, redis_basket,
+                                   django_assert_max_num_queries, monkeypatch):
+    partner = user_factory(type='Retailer')
+    importer = PriceListImporter(partner.id, batch_size=50)
+    importer.import_retailer('Retailer1')
+    importer.import_categories([{'id': 224, 'name': 'Smartphones'}])
+    importer.import_goods(price_list_goods(5))
+    ids = list(ProductInfo.objects.order_by('cat_id').values_list('id', flat=True))
+    customer = user_factory()
+    contact = contact_factory(user=customer)
+    api_client.force_authenticate(user=customer)
+    url = reverse('retail:basket')
+
+    assert api_client.get(url).json() == []
+    response = api_client.post(url, {'items': [{'product_info': id_, 'quantity': 2} for id_ in ids[:3]]})
+    assert response.json()['Objects created'] == 3
+    with django_assert_max_num_queries(1):
+        response = api_client.put(url, {'items': [{'product_info': ids[0], 'quantity': 5}]})
+    assert response.json()['Objects updated'] == 1
+    item_ids = {item['product_info']['id']: item['id'] for item in api_client.get(url).json()[0]['ordered_items']}
+    with django_assert_max_num_queries(0):
+        response = api_client.delete(url, {'items': [item_ids[ids[2]]]})
+    assert response.json()['Objects deleted'] == 1
+    assert not OrderItem.objects.exists()
+    basket = api_client.get(url).json()
+    assert [(item['id'], item['quantity']) for item in basket[0]['ordered_items']] == [(item_ids[ids[0]], 5),
+                                                                                     (item_ids[ids[1]], 2)]
+    assert basket[0]['total_sum'] == 5 * 100 + 2 * 101
+
+    materialize = RedisBasket.materialize
+    monkeypatch.setattr(RedisBasket, 'materialize', lambda basket: 1 / 0)
+    with pytest.raises(ZeroDivisionError):
+        persist_baskets()
+    assert redis_basket.smembers(BASKET_DIRTY_KEY) == {str(customer.id).encode()}
+    monkeypatch.setattr(RedisBasket, 'materialize', materialize)
+    assert persist_baskets() == 1
+    assert not redis_basket.exists(BASKET_DIRTY_KEY)
+    assert dict(OrderItem.objects.values_list('id', 'quantity')) == {item_ids[ids[0]]: 5, item_ids[ids[1]]: 2}
+    settings.BASKET_STORAGE = 'database'
+    assert api_client.get(url).json() == basket
+    settings.BASKET_STORAGE = 'redis'
+    api_client.delete(url, {'items': [item_ids[ids[1]]]})
+    api_client.post(url, {'items': [{'product_info': ids[1], 'quantity': 3}]})
+    assert persist_baskets() == 1
+    settings.BASKET_STORAGE = 'database'
+    stored = api_client.get(url).json()
+    assert stored[0]['ordered_items'][1]['id'] != item_ids[ids[1]]
+    settings.BASKET_STORAGE = 'redis'
+    assert api_client.get(url).json() == stored
+    api_client.put(url, {'items': [{'product_info': ids[1], 'quantity': 2}]})
+
+    settings.BASKET_STORAGE = 'redis'
+    api_client.post(url, {'items': [{'product_info': ids[4], 'quantity': 1}]})
+    response = api_client.post(reverse('retail:order'), {'order_id': basket[0]['id'], 'contact_id': contact.id})
+    assert response.status_code == 200
+    assert dict(OrderItem.objects.values_list('product_info_id', 'quantity')) == {ids[0]: 5, ids[1]: 2, ids[4]: 1}
+    assert Order.objects.get(id=basket[0]['id']).state == 'new'
+    assert ProductInfo.objects.get(id=ids[0]).quantity == 0
+    assert not redis_basket.exists(f'retail:basket:{customer.id}')
+    assert api_client.get(url).json() == []
+
+
+@pytest.mark.django_db
+def test_order_totals_are_persisted(api_client, user_factory, django_assert_max_num_queries):
+    partner = user_factory(type='Retailer')
+    importer = PriceListImporter(partner.id, batch_size=50)
+    importer.import_retailer('Retailer1')
+    importer.import_categories([{'id': 224, 'name': 'Smartphones'}])
+    importer.import_goods(price_list_goods(3))
+    ids = list(ProductInfo.objects.order_by('cat_id').values_list('id', flat=True))
+    customer = user_factory()
+    api_client.force_authenticate(user=customer)
+    url = reverse('retail:basket')
+
+    api_client.post(url, {'items': [{'product_info': ids[0], 'quantity': 2}, {'product_info': ids[1], 'quantity': 1}]})
+    basket = Order.objects.get(user=customer, state='basket')
+    assert (basket.total_sum, basket.items_count) == (2 * 100 + 101, 2)
+    api_client.put(url, {'items': [{'product_info': ids[0], 'quantity': 3}]})
+    basket.refresh_from_db()
+    assert basket.total_sum == 3 * 100 + 101
+
+    product_info = ProductInfo.objects.get(id=ids[1])
+    product_info.price = 1000
+    product_info.save()
+    OrderItem.objects.create(order=basket, product_info_id=ids[2], quantity=1)
+    basket.refresh_from_db()
+    assert (basket.total_sum, basket.items_count) == (3 * 100 + 1000 + 102, 3)
+    item_id = OrderItem.objects.get(order=basket, product_info_id=ids[2]).id
+    api_client.delete(url, {'items': [item_id]})
+    basket.refresh_from_db()
+    assert (basket.total_sum, basket.items_count) == (1300, 2)
+
+    with django_assert_max_num_queries(6) as queries:
+        response = api_client.get(url).json()
+    assert response[0]['total_sum'] == 1300 and response[0]['items_count'] == 2
+    assert not any('SUM(' in query['sql'] for query in queries.captured_queries)
+
+    Order.objects.filter(id=basket.id).update(total_sum=0, items_count=0)
+    out = io.StringIO()
+    call_command('repair_order_totals', state='basket', batch_size=1, stdout=out)
+    assert 'recomputed: 1 orders' in out.getvalue()
+    basket.refresh_from_db()
+    assert (basket.total_sum, basket.items_count) == (1300, 2)
+
+
+@pytest.mark.django_db
+def test_order_totals_after_cascade_deletes(user_factory, rf, django_capture_on_commit_callbacks):
+    partner = user_factory(type='Retailer')
+    price_list = yaml.safe_dump({'retailer': 'Retailer1', 'categories': [{'id': 224, 'name': 'Smartphones'}],
+                                 'goods': price_list_goods(3)}, allow_unicode=True).encode()
+    PriceListImporter(partner.id, sync=False).run(YamlPriceListReader(io.BytesIO(price_list)))
+    customer = user_factory()
+    basket = Order.objects.create(user=customer, state='basket')
+    OrderItem.objects.create(order=basket, product_info=ProductInfo.objects.get(cat_id=1000), quantity=2)
+    basket.refresh_from_db()
+    assert (basket.total_sum, basket.items_count) == (200, 1)
+
+    with django_capture_on_commit_callbacks(execute=True):
+        PriceListImporter(partner.id, sync=False).run(YamlPriceListReader(io.BytesIO(price_list)))
+    basket.refresh_from_db()
+    assert not OrderItem.objects.filter(order=basket).exists()
+    assert (basket.total_sum, basket.items_count) == (0, 0)
+
+    model_admin = admin.site._registry[ProductInfo]
+    request = rf.post('/')
+    OrderItem.objects.bulk_create(OrderItem(order=basket, product_info=product_info, quantity=1)
+                                  for product_info in ProductInfo.objects.order_by('cat_id'))
+    update_order_totals([basket.id])
+    with django_capture_on_commit_callbacks(execute=True):
+        model_admin.delete_model(request, ProductInfo.objects.get(cat_id=1000))
+    basket.refresh_from_db()
+    assert (basket.total_sum, basket.items_count) == (101 + 102, 2)
+    with django_capture_on_commit_callbacks(execute=True):
+        model_admin.delete_queryset(request, ProductInfo.objects.filter(cat_id=1001))
+    basket.refresh_from_db()
+    assert (basket.total_sum, basket.items_count) == (102, 1)
+
+    other = Order.objects.create(user=user_factory(), state='basket')
+    OrderItem.objects.create(order=other, product_info=ProductInfo.objects.get(cat_id=1002), quantity=3)
+    with django_capture_on_commit_callbacks(execute=True):
+        Product.objects.filter(products_info__cat_id=1002).delete()
+    assert not OrderItem.objects.exists()
+    assert list(Order.objects.order_by('id').values_list('total_sum', 'items_count')) == [(0, 0), (0, 0)]